@@ -0,0 +1,165 @@
+"""Benchmark of the stream decode-and-transform path.
+
+Compares decoding every payload with json.loads, as `on_data` used to do,
+with `decode_utils`, which skips control messages before decoding and uses
+orjson when it is installed.
+
+Run it from the crawler folder, optionally with a file of recorded stream
+messages (one raw payload per line):
+
+    python -m benchmarks.bench_decode --payloads recorded.ndjson
+"""
+import json
+import time
+import random
+import argparse
+
+import utils.decode_utils as decode_utils
+import utils.transform_utils as transform_utils
+from benchmarks.bench_transform import make_statuses
+
+def make_payloads(n: int, notices: float = 0.05, seed: int = 0):
+    """Method which generates synthetic raw stream messages.
+
+    Tweets carry full user, entities and retweeted status objects, so they
+    are several KB long like the real ones. A fraction of the messages are
+    limit and delete notices or keep-alives.
+
+    Parameters
+    ----------
+    n: int
+        Number of messages to generate.
+    notices: float
+        Fraction of control messages and keep-alives.
+    seed: int
+        Seed of the random generator.
+    """
+
+    rng = random.Random(seed)
+    payloads = []
+    for status in make_statuses(n, seed):
+        roll = rng.random()
+        if roll < notices / 3:
+            payloads.append(b'')
+        elif roll < notices * 2 / 3:
+            payloads.append(json.dumps({'limit': {
+                'track': rng.randint(1, 1000),
+                'timestamp_ms': '1646092800000'
+            }}).encode('utf-8'))
+        elif roll < notices:
+            payloads.append(json.dumps({'delete': {'status': {
+                'id': status['id'], 'id_str': status['id_str'],
+                'user_id': 1, 'user_id_str': '1'
+            }}}).encode('utf-8'))
+        else:
+            status['user'].update({
+                'name': 'User {}'.format(status['id']),
+                'description': 'Home furnishing enthusiast. ' * 10,
+                'location': 'Stockholm, Sweden',
+                'followers_count': rng.randint(0, 10000),
+                'profile_image_url_https': 'https://pbs.twimg.com/x.jpg'
+            })
+            status['entities'] = {
+                'hashtags': [{'text': 'IKEA', 'indices': [43, 48]}] * 4,
+                'urls': [{'url': 'https://t.co/x',
+                          'expanded_url': 'https://www.ikea.com/' + 'a' * 60,
+                          'indices': [0, 10]}] * 3,
+                'user_mentions': [{'screen_name': 'IKEA', 'id': 1,
+                                   'indices': [0, 5]}] * 3
+            }
+            status['retweeted_status'] = dict(status)
+            payloads.append(json.dumps(status).encode('utf-8'))
+    return payloads
+
+def legacy_decode(payloads: list):
+    """Method which decodes and transforms the payloads as `on_data` used
+    to, where control messages raised while being transformed.
+
+    Parameters
+    ----------
+    payloads: list[bytes]
+        Raw stream messages.
+    """
+
+    output = []
+    for raw_data in payloads:
+        if not raw_data:
+            continue
+        try:
+            output.append(transform_utils.transform(
+                json.loads(raw_data), 'streaming'))
+        except KeyError:
+            continue
+    return output
+
+def decode(payloads: list):
+    """Method which decodes and transforms the payloads as `on_data` does.
+
+    Parameters
+    ----------
+    payloads: list[bytes]
+        Raw stream messages.
+    """
+
+    output = []
+    for raw_data in payloads:
+        if decode_utils.classify(raw_data) != decode_utils.TWEET:
+            continue
+        output.append(transform_utils.transform(
+            decode_utils.loads(raw_data), 'streaming'))
+    return output
+
+def run(name: str, function, payloads: list, repeat: int):
+    """Method which times a decoder and prints its throughput.
+
+    Parameters
+    ----------
+    name: str
+        Name printed next to the results.
+    function: Callable[[list[bytes]], list[dict]]
+        Function which decodes the whole list of payloads.
+    payloads: list[bytes]
+        Raw stream messages.
+    repeat: int
+        Number of runs. The best one is reported.
+    """
+
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(payloads)
+        best = min(best, time.perf_counter() - start)
+    megabytes = sum(len(payload) for payload in payloads) / 1e6
+    print('{:<16} {:>10,.0f} msgs/s {:>8.1f} MB/s'.format(
+        name, len(payloads) / best, megabytes / best))
+    return len(payloads) / best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--payloads', help='file with one message per line')
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.payloads:
+        with open(args.payloads, 'rb') as f:
+            payloads = [line.rstrip(b'\r\n') for line in f]
+    else:
+        payloads = make_payloads(args.messages)
+    print('{} messages, {:.0f} bytes on average'.format(
+        len(payloads), sum(map(len, payloads)) / max(1, len(payloads))))
+
+    old = run('json.loads', legacy_decode, payloads, args.repeat)
+    orjson = decode_utils.orjson
+    decode_utils.orjson = None
+    try:
+        new = run('decode_utils/json', decode, payloads, args.repeat)
+    finally:
+        decode_utils.orjson = orjson
+    if orjson is not None:
+        new = run('decode_utils/orjson', decode, payloads, args.repeat)
+    assert decode(payloads) == legacy_decode(payloads)
+    print('speedup: {:.1f}x'.format(new / old))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""Offline load test of both crawlers, from the raw payloads to the sink.
+
+The streaming crawler is fed through `on_data` with synthetic or recorded
+stream messages, at a fixed rate or as fast as possible. The batch crawler
+pages through canned search results served by a fake Twitter API. Tweets
+are written to an in-memory, SQLite, mongomock or fake BigQuery sink.
+
+It reports the throughput, the p50/p99 latency of each tweet from the
+moment it enters the crawler until it is written, and the memory used.
+No credentials nor network are needed.
+
+Run it from the crawler folder:
+
+    python -m benchmarks.bench_ingest streaming --sink sqlite --rate 2000
+    python -m benchmarks.bench_ingest batch --sink bigquery --page-latency 0.2
+
+Streaming latencies include the write buffer age, so they depend on
+STREAM_BUFFER_SIZE and STREAM_BUFFER_MAX_AGE.
+"""
+import time
+import resource
+import argparse
+import tracemalloc
+
+import utils.decode_utils as decode_utils
+from benchmarks.bench_decode import make_payloads
+from benchmarks.bench_transform import make_statuses
+from benchmarks.fakes import (SINKS, FakeTwitterAPI, TimedTweetStore,
+                              make_store)
+from modules.CrawlSessions import CrawlSessions
+from modules.IKEABatchCrawler import IKEABatchCrawler
+from modules.IKEAStreamingCrawler import IKEAStreamingCrawler
+from modules.StreamManager import ManagedStream
+
+DRAIN_TIMEOUT = 300
+
+def percentile(values: list, q: float):
+    """Method which returns the q-th percentile of a list of values, using
+    the nearest rank.
+
+    Parameters
+    ----------
+    values: list[float]
+        Values, in any order.
+    q: float
+        Percentile, between 0 and 100.
+    """
+
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(q / 100 * len(values))) - 1))
+    return values[index]
+
+def load_payloads(path: str):
+    """Method which reads recorded stream messages, one raw payload per line.
+
+    Parameters
+    ----------
+    path: str
+        Path of the file.
+    """
+
+    with open(path, 'rb') as f:
+        return [line.rstrip(b'\r\n') for line in f]
+
+def run_streaming(store: TimedTweetStore, payloads: list, rate: float):
+    """Method which replays raw messages through `on_data` and waits until
+    every tweet has been written.
+
+    Parameters
+    ----------
+    store: TimedTweetStore
+        Sink the crawler writes to.
+    payloads: list[bytes]
+        Raw stream messages.
+    rate: float
+        Messages per second. If 0, they are sent as fast as possible.
+
+    Returns
+    -------
+    tuple[float, int]
+        Seconds elapsed and number of tweets replayed.
+    """
+
+    ids = []
+    for payload in payloads:
+        tweet_id = None
+        if decode_utils.classify(payload) == decode_utils.TWEET:
+            tweet_id = decode_utils.loads(payload).get('id_str')
+        ids.append(tweet_id)
+
+    crawler = IKEAStreamingCrawler('key', 'secret', 'token', 'token_secret')
+    session_id = crawler.start_session()
+    stream = ManagedStream(
+        {'name': 'bench', 'track': '', 'session_id': session_id}, store,
+        CrawlSessions())
+    crawler.router = lambda tweet, raw: stream.add(tweet)
+    start = time.perf_counter()
+    for i, (payload, tweet_id) in enumerate(zip(payloads, ids)):
+        if rate:
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        if tweet_id is not None:
+            store.start_times[tweet_id] = time.perf_counter()
+        crawler.on_data(payload)
+    crawler.queue.stop(DRAIN_TIMEOUT)
+    stream.close()
+    elapsed = (store.last_write or time.perf_counter()) - start
+    return elapsed, sum(tweet_id is not None for tweet_id in ids)
+
+def run_batch(store: TimedTweetStore, statuses: list, per_page: int,
+              page_latency: float):
+    """Method which crawls every canned status through the batch crawler.
+
+    Parameters
+    ----------
+    store: TimedTweetStore
+        Sink the crawler writes to.
+    statuses: list[dict]
+        Statuses served by the fake search endpoint.
+    per_page: int
+        Number of statuses per page.
+    page_latency: float
+        Seconds each page takes to be served.
+
+    Returns
+    -------
+    tuple[float, int]
+        Seconds elapsed and number of tweets crawled.
+    """
+
+    api = FakeTwitterAPI(statuses, page_latency)
+    store.start_times = api.page_times
+    crawler = IKEABatchCrawler('key', 'secret', 'token', 'token_secret',
+                               store, CrawlSessions())
+    crawler.api = api
+    start = time.perf_counter()
+    crawler.crawl_tweets('IKEA', None, per_page, None, total=len(statuses),
+                         resume=False)
+    return time.perf_counter() - start, len(statuses)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('crawler', choices=['streaming', 'batch'])
+    parser.add_argument('--sink', choices=SINKS, default='memory')
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--payloads', help='file with one message per line')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='streaming messages per second, 0 for no limit')
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--page-latency', type=float, default=0,
+                        help='seconds the fake API takes per page')
+    parser.add_argument('--sink-latency', type=float, default=0,
+                        help='seconds each write takes (memory, bigquery)')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='report the peak of Python allocations, slower')
+    args = parser.parse_args()
+
+    store = TimedTweetStore(make_store(args.sink, args.sink_latency), {})
+    if args.crawler == 'streaming':
+        payloads = (load_payloads(args.payloads) if args.payloads
+                    else make_payloads(args.messages))
+    else:
+        statuses = make_statuses(args.messages)
+
+    if args.trace_memory:
+        tracemalloc.start()
+    if args.crawler == 'streaming':
+        elapsed, sent = run_streaming(store, payloads, args.rate)
+    else:
+        elapsed, sent = run_batch(store, statuses, args.page_size,
+                                  args.page_latency)
+    peak = None
+    if args.trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    latencies = store.latencies
+    print('{} crawler -> {} sink'.format(args.crawler, args.sink))
+    print('tweets: {} sent, {} written'.format(sent, len(latencies)))
+    print('throughput: {:,.0f} tweets/s ({:.2f}s)'.format(
+        len(latencies) / elapsed if elapsed else 0, elapsed))
+    print('latency: p50 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms'.format(
+        percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000,
+        max(latencies, default=float('nan')) * 1000))
+    # ru_maxrss is in KB on Linux
+    print('memory: max RSS {:.1f} MB'.format(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+    if peak is not None:
+        print('memory: peak Python allocations {:.1f} MB'.format(peak / 1e6))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Microbenchmark of the tweet transformation step.
+
+Compares the per-tweet transformation previously inlined in both crawlers,
+which parsed `created_at` with dateutil, with `transform_utils`.
+
+Run it from the crawler folder:
+
+    python -m benchmarks.bench_transform --tweets 20000
+"""
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+import dateutil.parser
+
+import utils.transform_utils as transform_utils
+
+def make_statuses(n: int, seed: int = 0):
+    """Method which generates synthetic statuses shaped like the Twitter API
+    v1.1 payloads.
+
+    Parameters
+    ----------
+    n: int
+        Number of statuses to generate.
+    seed: int
+        Seed of the random generator.
+    """
+
+    rng = random.Random(seed)
+    start = datetime(2022, 3, 1)
+    statuses = []
+    for i in range(n):
+        created_at = start + timedelta(seconds=rng.randint(0, 7 * 86400))
+        status = {
+            'created_at': created_at.strftime('%a %b %d %H:%M:%S +0000 %Y'),
+            'id': 1500000000000000000 + i,
+            'id_str': str(1500000000000000000 + i),
+            'text': 'Just bought a new BILLY bookcase at #IKEA ' * 2,
+            'lang': rng.choice(['en', 'es', 'sv', 'de']),
+            'coordinates': None,
+            'source': '<a href="http://twitter.com">Twitter Web App</a>',
+            'favorite_count': rng.randint(0, 100),
+            'retweet_count': rng.randint(0, 10),
+            'quote_count': 0,
+            'reply_count': rng.randint(0, 5),
+            'user': {'id': i, 'screen_name': 'user{}'.format(i)}
+        }
+        if rng.random() < 0.3:
+            status['extended_tweet'] = {'full_text': status['text'] * 3}
+        statuses.append(status)
+    return statuses
+
+def legacy_transform(status: dict, crawler: str, session_id: str = None):
+    """Method which reproduces the transformation previously inlined in
+    `IKEABatchCrawler.crawl_tweets` and `IKEAStreamingCrawler.on_data`.
+
+    Parameters
+    ----------
+    status: dict
+        JSON-like object returned by the Twitter API.
+    crawler: str
+        Type of crawler which gathered the tweet.
+    session_id: str
+        Identifier of the crawl session.
+    """
+
+    tweet = {}
+    tweet['id'] = status['id_str']
+    created_at = dateutil.parser.parse(status['created_at'])
+    tweet['created_at'] = created_at.strftime('%Y-%m-%d %H:%M:%S')
+    if ('extended_tweet' in status
+            and 'full_text' in status['extended_tweet']):
+        tweet['text'] = status['extended_tweet']['full_text']
+    else:
+        tweet['text'] = status['text']
+
+    keys = ['lang', 'coordinates', 'source']
+    for key in keys:
+        if status.get(key) != None:
+            tweet[key] = status[key]
+    keys = ['favorite_count', 'retweet_count', 'quote_count',
+            'reply_count']
+    for key in keys:
+        if status.get(key) != None:
+            if 'interactions' not in tweet:
+                tweet['interactions'] = {}
+            tweet['interactions'][key] = status[key]
+    tweet['crawler'] = crawler
+    tweet['session_id'] = session_id
+    return tweet
+
+def run(name: str, function, statuses: list, repeat: int):
+    """Method which times a transformation and prints its throughput.
+
+    Parameters
+    ----------
+    name: str
+        Name printed next to the results.
+    function: Callable[[list[dict]], list[dict]]
+        Function which transforms the whole list of statuses.
+    statuses: list[dict]
+        Statuses to transform.
+    repeat: int
+        Number of runs. The best one is reported.
+    """
+
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(statuses)
+        best = min(best, time.perf_counter() - start)
+    rate = len(statuses) / best
+    print('{:<16} {:>12,.0f} tweets/s {:>10.2f} us/tweet'.format(
+        name, rate, best / len(statuses) * 1e6))
+    return rate
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tweets', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    statuses = make_statuses(args.tweets)
+    for status in statuses:
+        assert (legacy_transform(status, 'batch')
+                == transform_utils.transform(status, 'batch'))
+
+    old = run('legacy', lambda s: [legacy_transform(x, 'batch') for x in s],
+              statuses, args.repeat)
+    new = run('transform_many',
+              lambda s: transform_utils.transform_many(s, 'batch'),
+              statuses, args.repeat)
+    print('speedup: {:.1f}x'.format(new / old))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,453 @@
+"""Fake Twitter API and fake sinks used by the ingest benchmarks.
+
+They let both crawlers run offline, without Twitter credentials nor a
+database, while still going through the real transformation, buffering and
+store code.
+"""
+import json
+import time
+import bisect
+import tempfile
+import threading
+from collections import Counter
+from typing import Callable, List
+
+import utils.aggregate_utils as aggregate_utils
+import utils.gcp_utils as gcp_utils
+import utils.mongo_utils as mongo_utils
+from modules.TweetStore import (TweetStore, MongoTweetStore,
+                                BigQueryTweetStore, SQLiteTweetStore)
+
+SINKS = ['memory', 'sqlite', 'mongo', 'bigquery']
+DEFAULT_FIELDS = ['created_at', 'text', 'interactions']
+
+class FakeStatus():
+    """
+    Class used to mimic the `tweepy.models.Status` objects returned by the
+    search endpoint. Only the attributes read by the batch crawler are set.
+    """
+
+    def __init__(self, status: dict):
+        self.id = status['id']
+        self._json = status
+
+class FakeTwitterAPI():
+    """
+    Class used to serve canned search results to `IKEABatchCrawler`, paged
+    with `max_id` and `since_id` like `tweepy.API.search_tweets`.
+
+    Attributes
+    ----------
+    latency: float
+        Seconds each page takes to be served.
+    pages: int
+        Number of pages served.
+    page_times: dict
+        Time at which each tweet id was served, used to measure the latency
+        of the tweets until they are saved.
+    """
+
+    def __init__(self, statuses: List[dict], latency: float = 0):
+        """
+        Parameters
+        ----------
+        statuses: list[dict]
+            Statuses shaped like the Twitter API v1.1 payloads.
+        latency: float
+            Seconds each page takes to be served.
+        """
+
+        self.latency = latency
+        self.pages = 0
+        self.page_times = {}
+        self._statuses = sorted(statuses, key=lambda status: status['id'])
+        self._ids = [status['id'] for status in self._statuses]
+
+    def search_tweets(self, q: str, count: int = 15, since_id: int = None,
+                      max_id: int = None, **kw):
+        """Method which returns a page of statuses, newest first.
+
+        Parameters
+        ----------
+        q: str
+            Query, ignored.
+        count: int
+            Number of statuses to return.
+        since_id: int
+            Only statuses with a greater id are returned.
+        max_id: int
+            Only statuses with a lower or equal id are returned.
+        """
+
+        if self.latency:
+            time.sleep(self.latency)
+        end = len(self._ids)
+        if max_id is not None:
+            end = bisect.bisect_right(self._ids, max_id)
+        start = 0
+        if since_id is not None:
+            start = bisect.bisect_right(self._ids, since_id)
+        start = max(start, end - count)
+        page = [FakeStatus(status)
+                for status in reversed(self._statuses[start:end])]
+        now = time.perf_counter()
+        for status in page:
+            self.page_times[status._json['id_str']] = now
+        self.pages += 1
+        return page
+
+class FakeJob():
+    """
+    Class used to mimic the BigQuery jobs, which are already done.
+    """
+
+    total_bytes_processed = 0
+    total_bytes_billed = 0
+
+    def result(self):
+        return []
+
+class FakeTable():
+    """
+    Class used to mimic a BigQuery table without streaming buffer.
+    """
+
+    streaming_buffer = None
+
+class FakeBigQueryClient():
+    """
+    Class used to mimic the BigQuery client used to write tweets. Rows are
+    encoded to JSON, as the real client does before sending them, and kept
+    in memory.
+
+    Attributes
+    ----------
+    latency: float
+        Seconds each request takes.
+    rows: list[str]
+        Encoded rows received.
+    """
+
+    def __init__(self, latency: float = 0):
+        """
+        Parameters
+        ----------
+        latency: float
+            Seconds each request takes.
+        """
+
+        self.latency = latency
+        self.rows = []
+
+    def create_table(self, table, exists_ok: bool = False):
+        return table
+
+    def get_table(self, table):
+        return FakeTable()
+
+    def update_table(self, table, fields: List[str]):
+        return table
+
+    def delete_table(self, table, not_found_ok: bool = False):
+        pass
+
+    def insert_rows_json(self, table, rows: List[dict], row_ids=None):
+        self._send(rows)
+        return []
+
+    def load_table_from_json(self, rows: List[dict], destination,
+                             job_config=None):
+        self._send(rows)
+        return FakeJob()
+
+    def query(self, query: str, job_config=None, location: str = None):
+        if self.latency:
+            time.sleep(self.latency)
+        return FakeJob()
+
+    def _send(self, rows: List[dict]):
+        if self.latency:
+            time.sleep(self.latency)
+        self.rows.extend(json.dumps(row, default=str) for row in rows)
+
+class FakeStorageClient():
+    """
+    Class used to mimic the Cloud Storage client, serving the local table
+    schema as if it was stored in the bucket.
+    """
+
+    def bucket(self, name: str):
+        return self
+
+    def get_blob(self, name: str):
+        return self
+
+    @property
+    def etag(self):
+        return 'local'
+
+    def download_as_bytes(self):
+        with open(gcp_utils.LOCAL_SCHEMA_PATH, 'rb') as f:
+            return f.read()
+
+class MemoryTweetStore(TweetStore):
+    """
+    Class used to keep the tweets in a dictionary, indexed by id, so the
+    benchmarks can measure the crawlers without any database cost.
+
+    Attributes
+    ----------
+    latency: float
+        Seconds each write takes.
+    tweets: dict
+        Tweets saved, by id.
+    """
+
+    name = 'memory'
+
+    def __init__(self, latency: float = 0):
+        """
+        Parameters
+        ----------
+        latency: float
+            Seconds each write takes.
+        """
+
+        self.latency = latency
+        self.tweets = {}
+        self._checkpoints = {}
+        self._lock = threading.Lock()
+
+    def write(self, tweets: List[dict], retry: bool = False):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            for tweet in tweets:
+                self.tweets[tweet['id']] = tweet
+
+    def get_by_ids(self, ids: List[str], fields: List[str] = None,
+                   start: str = None, end: str = None):
+        with self._lock:
+            tweets = [self.tweets[str(id)] for id in ids
+                      if str(id) in self.tweets]
+        return [_project(tweet, fields) for tweet in tweets], None
+
+    def get_by_session(self, session_id: str, limit: int, after: str = None,
+                       fields: List[str] = None, start: str = None,
+                       end: str = None):
+        tweets = sorted(self._select({'session_id': session_id}),
+                        key=lambda tweet: int(tweet['id']), reverse=True)
+        if after is not None:
+            tweets = [tweet for tweet in tweets
+                      if int(tweet['id']) < int(after)]
+        page = tweets[:limit]
+        cursor = page[-1]['id'] if len(tweets) > limit else None
+        return [_project(tweet, fields) for tweet in page], cursor, None
+
+    def iter_tweets(self, filters: dict, fields: List[str] = None,
+                    batch_size: int = 1000):
+        for tweet in self._select(filters):
+            yield _project(tweet, fields) if fields else dict(tweet)
+
+    def count(self, filters: dict = None):
+        return len(self._select(filters))
+
+    def timeseries(self, filters: dict, interval: str = 'hour'):
+        length = aggregate_utils.INTERVALS[interval]
+        counts = Counter(
+            (tweet['created_at'][:length], tweet.get('crawler'),
+             tweet.get('lang'))
+            for tweet in self._select(filters))
+        return aggregate_utils.sort_timeseries([
+            {'time': time, 'crawler': crawler, 'lang': lang, 'count': count}
+            for (time, crawler, lang), count in counts.items()])
+
+    def interactions(self, filters: dict):
+        rows = {}
+        for tweet in self._select(filters):
+            row = rows.setdefault(tweet.get('crawler'), dict(
+                {'crawler': tweet.get('crawler'), 'tweets': 0},
+                **{field: 0 for field in aggregate_utils.INTERACTION_FIELDS}))
+            row['tweets'] += 1
+            for field in aggregate_utils.INTERACTION_FIELDS:
+                row[field] += (tweet.get('interactions') or {}).get(field, 0)
+        return list(rows.values())
+
+    def top_words(self, filters: dict, kind: str = 'hashtag',
+                  limit: int = 20):
+        return aggregate_utils.top_words(
+            (tweet.get('text') for tweet in self._select(filters)), kind,
+            limit)
+
+    def sources(self, filters: dict, limit: int = 20):
+        counts = Counter(tweet.get('source') for tweet in self._select(filters))
+        return aggregate_utils.merge_sources(
+            [{'source': source, 'count': count}
+             for source, count in counts.items()], limit)
+
+    def get_checkpoint(self, key: str):
+        return self._checkpoints.get(key)
+
+    def save_checkpoint(self, key: str, checkpoint: dict):
+        self._checkpoints[key] = dict(checkpoint)
+
+    def _select(self, filters: dict = None):
+        """Submethod which returns the tweets matching the given filters.
+
+        Parameters
+        ----------
+        filters: dict
+            Optional `crawler`, `lang`, `session_id`, `since` and `until`
+            filters.
+        """
+
+        filters = filters or {}
+        with self._lock:
+            tweets = list(self.tweets.values())
+        for key in ('crawler', 'lang', 'session_id'):
+            if filters.get(key):
+                tweets = [tweet for tweet in tweets
+                          if tweet.get(key) == filters[key]]
+        if filters.get('since'):
+            tweets = [tweet for tweet in tweets
+                      if tweet['created_at'] >= filters['since']]
+        if filters.get('until'):
+            tweets = [tweet for tweet in tweets
+                      if tweet['created_at'] < filters['until']]
+        return tweets
+
+class TimedTweetStore(TweetStore):
+    """
+    Class used to wrap a store and record, for every tweet written, the
+    seconds elapsed since it entered the crawler.
+
+    Attributes
+    ----------
+    store: TweetStore
+        Store the tweets are written to.
+    latencies: list[float]
+        Latency of each tweet written, in seconds.
+    last_write: float
+        Time at which the last write finished.
+    """
+
+    def __init__(self, store: TweetStore, start_times: dict,
+                 clock: Callable[[], float] = time.perf_counter):
+        """
+        Parameters
+        ----------
+        store: TweetStore
+            Store the tweets are written to.
+        start_times: dict
+            Time at which each tweet id entered the crawler. It may be
+            updated while the benchmark runs.
+        clock: Callable[[], float]
+            Clock the start times were taken with.
+        """
+
+        self.name = store.name
+        self.store = store
+        self.start_times = start_times
+        self.clock = clock
+        self.latencies = []
+        self.last_write = None
+        self._lock = threading.Lock()
+
+    def write(self, tweets: List[dict], retry: bool = False):
+        self.store.write(tweets, retry)
+        now = self.clock()
+        with self._lock:
+            for tweet in tweets:
+                start = self.start_times.get(tweet['id'])
+                if start is not None:
+                    self.latencies.append(now - start)
+            self.last_write = now
+
+    def get_by_ids(self, ids: List[str], fields: List[str] = None,
+                   start: str = None, end: str = None):
+        return self.store.get_by_ids(ids, fields, start, end)
+
+    def get_by_session(self, session_id: str, limit: int, after: str = None,
+                       fields: List[str] = None, start: str = None,
+                       end: str = None):
+        return self.store.get_by_session(session_id, limit, after, fields,
+                                         start, end)
+
+    def iter_tweets(self, filters: dict, fields: List[str] = None,
+                    batch_size: int = 1000):
+        return self.store.iter_tweets(filters, fields, batch_size)
+
+    def count(self, filters: dict = None):
+        return self.store.count(filters)
+
+    def timeseries(self, filters: dict, interval: str = 'hour'):
+        return self.store.timeseries(filters, interval)
+
+    def interactions(self, filters: dict):
+        return self.store.interactions(filters)
+
+    def top_words(self, filters: dict, kind: str = 'hashtag',
+                  limit: int = 20):
+        return self.store.top_words(filters, kind, limit)
+
+    def sources(self, filters: dict, limit: int = 20):
+        return self.store.sources(filters, limit)
+
+    def get_checkpoint(self, key: str):
+        return self.store.get_checkpoint(key)
+
+    def save_checkpoint(self, key: str, checkpoint: dict):
+        self.store.save_checkpoint(key, checkpoint)
+
+def _project(tweet: dict, fields: List[str] = None):
+    """Submethod which keeps the given fields of a tweet.
+
+    Parameters
+    ----------
+    tweet: dict
+        JSON-like object in the data model.
+    fields: list[str]
+        Fields to keep. Defaults to `DEFAULT_FIELDS`.
+    """
+
+    return {field: tweet.get(field) for field in fields or DEFAULT_FIELDS}
+
+def make_store(sink: str, latency: float = 0):
+    """Method which builds the store a benchmark writes to.
+
+    Parameters
+    ----------
+    sink: str
+        One of `SINKS`:
+        - memory: dictionary in memory.
+        - sqlite: SQLite store in a temporary file.
+        - mongo: MongoDB store over mongomock, which must be installed. It
+          runs the real upserts and indexes, but mongomock is much slower
+          than a server, so only compare it with itself.
+        - bigquery: BigQuery store over `FakeBigQueryClient`.
+    latency: float
+        Seconds each write takes, added to the memory and BigQuery sinks
+        to emulate a remote database.
+    """
+
+    if sink == 'memory':
+        return MemoryTweetStore(latency)
+    if sink == 'sqlite':
+        path = tempfile.NamedTemporaryFile(
+            prefix='bench-', suffix='.sqlite', delete=False).name
+        return SQLiteTweetStore(path)
+    if sink == 'mongo':
+        try:
+            import mongomock
+        except ImportError:
+            raise SystemExit('The mongo sink requires mongomock.')
+        mongo_utils.MONGODB_COLLECTION = (mongo_utils.MONGODB_COLLECTION
+                                          or 'tweets')
+        return MongoTweetStore(mongomock.MongoClient().benchmark)
+    if sink == 'bigquery':
+        gcp_utils.GOOGLE_CLOUD_PROJECT = 'benchmark'
+        gcp_utils.DATASET = gcp_utils.DATASET or 'benchmark'
+        gcp_utils.TABLENAME = gcp_utils.TABLENAME or 'tweets'
+        gcp_utils._storage_client = FakeStorageClient()
+        return BigQueryTweetStore(FakeBigQueryClient(latency))
+    raise ValueError('Unknown sink: {}'.format(sink))
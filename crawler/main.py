@@ -1,47 +1,199 @@
 import os
 import json
-from google.cloud import bigquery
+import zlib
+import atexit
+import functools
+from datetime import datetime, timedelta
 
-from flask import Flask, request, jsonify, make_response
+from flask import (Flask, Response, request, jsonify, stream_with_context)
 from flask_pymongo import PyMongo
 
-import utils.mongo_utils as mongo_utils
+import utils.aggregate_utils as aggregate_utils
 import utils.gcp_utils as gcp_utils
+import utils.metrics_utils as metrics_utils
 from modules.IKEABatchCrawler import IKEABatchCrawler
 from modules.IKEAStreamingCrawler import IKEAStreamingCrawler
+from modules.BatchCoordinator import BatchCoordinator
+from modules.BatchJobManager import BatchJobManager
+from modules.CrawlSessions import CrawlSessions
+from modules.RateLimitScheduler import RateLimitScheduler
+from modules.SharedState import (MemorySharedState, MongoSharedState,
+                                 SQLiteSharedState)
+from modules.StreamManager import (StreamManager, STREAM_CONNECTION_LEASE,
+                                   DEFAULT_STREAM)
+from modules.TTLCache import TTLCache
+from modules.TweetSpool import TweetSpool, SPOOL_DIR
+from modules.TweetStore import (MongoTweetStore, BigQueryTweetStore,
+                                SQLiteTweetStore, FanOutTweetStore)
 
 API_KEY = os.environ['API_KEY'].strip()
 API_SECRET = os.environ['API_SECRET'].strip()
 ACCESS_TOKEN = os.environ['ACCESS_TOKEN'].strip()
 ACCESS_SECRET = os.environ['ACCESS_SECRET'].strip()
+# Additional credentials for the batch crawls, whose rate limits are shared
+# by every process: comma separated sets of
+# API_KEY:API_SECRET:ACCESS_TOKEN:ACCESS_SECRET
+BATCH_CREDENTIALS = [
+    tuple(field.strip() for field in credentials.split(':'))
+    for credentials in os.environ.get('BATCH_CREDENTIALS', '').split(',')
+    if credentials.strip()
+]
 GOOGLE_CLOUD_PROJECT = os.environ.get('GOOGLE_CLOUD_PROJECT')
+# Comma separated list of stores, the first one serves the reads
+TWEET_STORES = os.environ.get(
+    'TWEET_STORES', 'mongo' if GOOGLE_CLOUD_PROJECT == "False" else 'bigquery'
+)
+DEFAULT_PAGE_SIZE = int(os.environ.get('DEFAULT_PAGE_SIZE', 100))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 1000))
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+EXPORT_CHUNK_SIZE = 64 * 1024
+AGGREGATES = ['timeseries', 'interactions', 'hashtags', 'terms', 'sources']
+AGGREGATES_DEFAULT_DAYS = int(os.environ.get('AGGREGATES_DEFAULT_DAYS', 7))
+AGGREGATES_DEFAULT_LIMIT = 20
+AGGREGATES_MAX_LIMIT = 100
+SPOOL_DRAIN_TIMEOUT = float(os.environ.get('SPOOL_DRAIN_TIMEOUT', 30))
+# Where the streams and leases shared by every crawler process are kept
+STREAM_STATE = os.environ.get('STREAM_STATE')
+TWEET_FIELDS = ['id', 'created_at', 'text', 'lang', 'coordinates', 'source',
+                'interactions', 'crawler', 'session_id']
 
 app = Flask(__name__)
-# Check the environment where the project has been deployed
-if GOOGLE_CLOUD_PROJECT == "False":
-    app.config["MONGO_URI"] = ('mongodb://' + os.getenv('MONGODB_USERNAME')
-                            + ':' + os.environ.get('MONGODB_PASSWORD') + '@'
-                            + os.environ.get('MONGODB_HOSTNAME') + ':27017/'
-                            + os.environ.get('MONGODB_DATABASE'))
-    mongo = PyMongo(app)
-    db = mongo.db
+stores = []
+for name in TWEET_STORES.split(','):
+    name = name.strip()
+    if name == 'mongo':
+        app.config["MONGO_URI"] = (
+            'mongodb://' + os.getenv('MONGODB_USERNAME') + ':'
+            + os.environ.get('MONGODB_PASSWORD') + '@'
+            + os.environ.get('MONGODB_HOSTNAME') + ':27017/'
+            + os.environ.get('MONGODB_DATABASE'))
+        mongo = PyMongo(app)
+        stores.append(MongoTweetStore(mongo.db))
+    elif name == 'bigquery':
+        stores.append(BigQueryTweetStore(gcp_utils.get_bigquery_client()))
+    elif name == 'sqlite':
+        stores.append(SQLiteTweetStore())
+    else:
+        raise ValueError('Unknown tweet store: {}'.format(name))
+store = stores[0] if len(stores) == 1 else FanOutTweetStore(stores)
+sinks = {s.name: s for s in stores}
+
+# State is shared through the primary store when it is reachable by every
+# process, so several workers or containers do not open duplicate streams
+state_name = STREAM_STATE or (
+    stores[0].name if stores[0].name in ('mongo', 'sqlite') else 'memory')
+if state_name == 'mongo':
+    state = MongoSharedState(mongo.db)
+elif state_name == 'sqlite':
+    state = SQLiteSharedState()
+elif state_name == 'memory':
+    state = MemorySharedState()
 else:
-    db = bigquery.Client()
+    raise ValueError('Unknown stream state: {}'.format(state_name))
+
+sessions = CrawlSessions()
+aggregates_cache = TTLCache()
+
+def persist_tweets(tweets, retry, target=None):
+    """Method which writes a batch of spooled tweets to the database, and
+    then records them in the sessions and publishes the streamed ones to the
+    live feed.
+
+    Parameters
+    ----------
+    tweets: list[dict]
+        List of JSON-like objects to be saved.
+    retry: bool
+        Whether the batch may have been written before.
+    target: TweetStore
+        Store the tweets are written to. Defaults to `store`.
+    """
+
+    target = target or store
+    metrics_utils.record_write(
+        'spool', tweets, lambda batch: target.write(batch, retry))
+    sessions.record(tweets)
+    streaming_crawler.publish(
+        [tweet for tweet in tweets if tweet.get('crawler') == 'streaming'])
 
+# The spools publish the tweets they replay, so the crawler must exist first
 streaming_crawler = IKEAStreamingCrawler(
     consumer_key=API_KEY,
     consumer_secret=API_SECRET,
     access_token=ACCESS_TOKEN,
-    access_token_secret=ACCESS_SECRET,
-    db=db
+    access_token_secret=ACCESS_SECRET
 )
+# Tweets go through a local write-ahead spool when a folder is configured.
+# Each worker process claims its own subfolder. Streams saved to a named
+# sink have a spool of their own, which only writes to that sink.
+spool = TweetSpool.claim(SPOOL_DIR, persist_tweets) if SPOOL_DIR else None
+sink_spools = {
+    name: TweetSpool.claim(os.path.join(SPOOL_DIR, 'sinks', name),
+                           functools.partial(persist_tweets, target=sink))
+    for name, sink in sinks.items()
+} if SPOOL_DIR else {}
 batch_crawler = IKEABatchCrawler(
     consumer_key=API_KEY,
     consumer_secret=API_SECRET,
     access_token=ACCESS_TOKEN,
     access_token_secret=ACCESS_SECRET,
-    db=db
+    store=store,
+    sessions=sessions,
+    spool=spool,
+    credentials=BATCH_CREDENTIALS
 )
+batch_crawler.scheduler = RateLimitScheduler(state, batch_crawler.apis)
+batch_jobs = BatchJobManager(batch_crawler)
+batch_coordinator = BatchCoordinator(batch_crawler, state)
+batch_coordinator.start()
+stream_manager = StreamManager(streaming_crawler, state, sinks, store,
+                               sessions, spool, sink_spools)
+stream_manager.start()
+# Exit handlers run in reverse order, so the spools are closed last
+for sink_spool in sink_spools.values():
+    atexit.register(sink_spool.close, SPOOL_DRAIN_TIMEOUT)
+if spool is not None:
+    atexit.register(spool.close, SPOOL_DRAIN_TIMEOUT)
+atexit.register(streaming_crawler.queue.stop, 30)
+atexit.register(batch_jobs.shutdown)
+atexit.register(batch_coordinator.shutdown)
+atexit.register(stream_manager.close)
+
+# Gauges are read when the metrics are scraped, so they cost nothing meanwhile
+metrics_utils.gauge(
+    'crawler_stream_queue_depth',
+    'Raw stream messages waiting to be processed.',
+    lambda: streaming_crawler.queue.stats()['depth'])
+metrics_utils.gauge(
+    'crawler_stream_queue_lag_seconds',
+    'Seconds the last processed stream message waited in the queue.',
+    lambda: streaming_crawler.queue.stats()['last_lag'])
+metrics_utils.gauge(
+    'crawler_stream_queue_dropped',
+    'Stream messages dropped because the queue was full.',
+    lambda: streaming_crawler.queue.stats()['dropped'])
+metrics_utils.gauge(
+    'crawler_write_buffer_pending',
+    'Streamed tweets waiting in the write buffers of the streams.',
+    lambda: stream_manager.pending)
+metrics_utils.gauge(
+    'crawler_stream_running',
+    'Whether the stream is connected.',
+    lambda: int(bool(streaming_crawler.running)))
+metrics_utils.gauge(
+    'crawler_rate_limit_queued',
+    'Batch requests waiting for their turn or for the rate limit.',
+    lambda: batch_crawler.scheduler.queued)
+metrics_utils.gauge(
+    'crawler_stream_event_subscribers',
+    'Clients subscribed to the live stream feed.',
+    lambda: streaming_crawler.events.subscribers)
+if spool is not None:
+    metrics_utils.gauge(
+        'crawler_spool_pending_bytes',
+        'Bytes of the spools not written to the database yet.',
+        lambda: sum(s.stats()['pending_bytes']
+                    for s in [spool] + list(sink_spools.values())))
 
 confirmation_response = {
     'status': 200,
@@ -64,53 +216,185 @@ def index():
         message='Welcome to the IKEA crawler!'
     )
     
+@app.route('/metrics')
+def get_metrics():
+    """/metrics route.
+    
+    get:
+        description: exposes the crawler metrics to Prometheus. With several
+            worker processes, counters and histograms are added up, but the
+            gauges are the ones of the worker which serves the request.
+        responses:
+            200:
+                description: counters, gauges and histograms in the
+                    Prometheus text exposition format.
+    """
+
+    return Response(metrics_utils.render(),
+                    content_type=metrics_utils.CONTENT_TYPE)
+
 @app.route('/stream/status')
 def get_status():
     """/stream/status route.
     
     get:
         description: checks the stream status.
+        parameters:
+            - name: name
+              description: name of the stream. Defaults to 'default'.
+              required: false
         responses:
             200:
-                description: boolean indicating the stream status.
+                description: boolean indicating whether the stream is
+                    running, along with every stream and its counters, the
+                    process holding the connection, the control messages
+                    received, the number of tweets undelivered due to rate
+                    limits, the queue counters and the counters of the
+                    spool and of the spools of the named sinks, if it is
+                    enabled. With several worker processes, the
+                    stream counters are shared, but the rest are the ones
+                    of the worker which serves the request.
     """
 
+    stream = stream_manager.get_stream(request.args.get('name', DEFAULT_STREAM))
+    lease = state.get_lease(STREAM_CONNECTION_LEASE)
     return jsonify(
         status=200,
-        message=streaming_crawler.running
+        message=stream is not None and stream['status'] == 'running',
+        streams=stream_manager.get_streams(),
+        owner=lease['owner'] if lease is not None else None,
+        connected=stream_manager.is_connected(),
+        notices=dict(streaming_crawler.notices),
+        undelivered=streaming_crawler.undelivered,
+        queue=streaming_crawler.queue.stats(),
+        spool=spool.stats() if spool is not None else None,
+        sink_spools={name: sink_spool.stats()
+                     for name, sink_spool in sink_spools.items()}
     )
 
+@app.route('/stream/stats')
+def get_stream_stats():
+    """/stream/stats route.
+    
+    get:
+        description: get the rolling statistics of the current stream
+            session, kept in memory as tweets arrive. They are only kept by
+            the worker process holding the connection, see `owner` in
+            /stream/status.
+        parameters:
+            - name: top
+              description: number of hashtags and terms to return.
+              required: false
+        responses:
+            200:
+                description: total tweets, rate over the sliding window in
+                    tweets per second, counts by language, interaction sums,
+                    and approximate top hashtags and terms.
+    """
+
+    top = request.args.get('top', 10, type=int)
+    top = min(max(top, 1), AGGREGATES_MAX_LIMIT)
+    return jsonify(
+        status=200,
+        message=streaming_crawler.stats.snapshot(top)
+    )
+
+@app.route('/stream/events')
+def get_stream_events():
+    """/stream/events route.
+    
+    get:
+        description: live feed of the stream as Server-Sent Events. Each
+            connection holds a server thread, so the number of simultaneous
+            subscribers is limited. Tweets are only published by the worker
+            process holding the connection, see `owner` in /stream/status.
+        responses:
+            200:
+                description: event stream with a `tweet` event for each
+                    tweet received and a `counters` event every second
+                    with the stream status, the tweets received and saved
+                    in the current session and the current rate.
+            503:
+                description: too many subscribers.
+    """
+
+    subscriber = streaming_crawler.events.subscribe()
+    if subscriber is None:
+        return jsonify(
+            code=503,
+            message='Too many subscribers to the stream events.'
+        )
+
+    def counters():
+        stats = streaming_crawler.stats.snapshot(0)
+        stream = stream_manager.get_stream(DEFAULT_STREAM) or {}
+        stream_counters = stream.get('counters') or {}
+        return {
+            'running': stream.get('status') == 'running',
+            'session': stream.get('session_id'),
+            'received': stream_counters.get('received', 0),
+            'saved': stream_counters.get('saved', 0),
+            'rate': stats['rate']
+        }
+
+    response = Response(
+        stream_with_context(
+            streaming_crawler.events.stream(subscriber, counters)),
+        mimetype='text/event-stream'
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    # Also release the slot if the client leaves before the stream starts
+    response.call_on_close(
+        lambda: streaming_crawler.events.unsubscribe(subscriber))
+    return response
+
 @app.route('/stream/start', methods=['POST'])
 def start_stream():
     """/stream/start route.
     
     post:
-        description: creates a new stream connection.
+        description: starts a named stream, or restarts it with a new track
+            and session. Every running stream shares the same connection.
         parameters:
             - name: track
               description: comma separated list of terms to search.
               required: true
+            - name: name
+              description: name of the stream. Defaults to 'default'.
+              required: false
+            - name: sink
+              description: store the tweets are saved to, among the ones
+                  in TWEET_STORES. Defaults to every store.
+              required: false
     """
 
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         track = data.get('track', None)
         if not track:
             return jsonify(
                 code=400,
                 message="Missing required argument: 'track'."
             )
-        streaming_crawler.count = 0
-        streaming_crawler.tweet_ids = []
-        streaming_crawler.filter(
-            track=track.split(','), threaded=True
+        name = data.get('name', DEFAULT_STREAM)
+        try:
+            stream = stream_manager.start_stream(
+                name, track, data.get('sink', None))
+        except ValueError as e:
+            return jsonify(
+                code=400,
+                message=str(e)
+            )
+        return jsonify(
+            status=200,
+            message={'name': name, 'session_id': stream['session_id']}
         )
-        return jsonify(confirmation_response)
     except Exception as e:
         print(e)
         return jsonify(
             status=500,
-            message='Interval server error: disconnected.'
+            message='Internal server error: disconnected.'
         )
     
 @app.route('/stream/stop', methods=['POST'])
@@ -118,17 +402,28 @@ def stop_stream():
     """/stream/stop route.
     
     post:
-        description: closes a previously created stream connection.
+        description: stops a named stream. The connection is closed once
+            no stream is running.
+        parameters:
+            - name: name
+              description: name of the stream. Defaults to 'default'.
+              required: false
     """
 
     try:
-        streaming_crawler.disconnect()
+        data = request.get_json(silent=True) or {}
+        name = data.get('name', DEFAULT_STREAM)
+        if stream_manager.stop_stream(name) is None:
+            return jsonify(
+                code=404,
+                message="Unknown stream: '{}'.".format(name)
+            )
         return jsonify(confirmation_response)
     except Exception as e:
         print(e)
         return jsonify(
             status=500,
-            message='Interval server error: disconnected.'
+            message='Internal server error: disconnected.'
         )
 
 @app.route('/stream/tweets')
@@ -136,43 +431,164 @@ def get_stream_tweets():
     """/stream/tweets route.
     
     get:
-        description: get the tweets collected by the stream.
+        description: get the tweets collected by a stream session.
+        parameters:
+            - name: name
+              description: name of the stream. Defaults to 'default'.
+              required: false
+            - name: session
+              description: stream session id. Defaults to the current
+                  session of the stream.
+              required: false
+            - name: limit
+              description: maximum number of tweets to return.
+              required: false
+            - name: after
+              description: cursor returned as 'next' by the previous page.
+              required: false
+            - name: fields
+              description: comma separated list of fields to return.
+              required: false
         responses:
             200:
-                description: list of tweets collected by the stream.
+                description: list of tweets collected by the stream, newest
+                    first.
     """
 
-    if GOOGLE_CLOUD_PROJECT == "False":
-        tweets = list(mongo_utils.get_by_ids(db, streaming_crawler.tweet_ids))
-    else:
-        tweets = gcp_utils.get_by_ids(db, streaming_crawler.tweet_ids)
-    return jsonify(
-        status=200,
-        message=json.dumps(tweets)
-    )
+    session_id = request.args.get('session', None)
+    if session_id is None:
+        stream = stream_manager.get_stream(
+            request.args.get('name', DEFAULT_STREAM))
+        session_id = stream['session_id'] if stream is not None else None
+    return get_session_tweets(session_id)
     
 @app.route('/stream/count')
 def get_stream_count():
     """/stream/count route.
     
     get:
-        description: get the number of tweets collected by the stream.
+        description: get the number of tweets collected by a stream session.
+        parameters:
+            - name: name
+              description: name of the stream. Defaults to 'default'.
+              required: false
+            - name: session
+              description: stream session id. Defaults to the current
+                  session of the stream.
+              required: false
         responses:
             200:
                 description: number of tweets collected by the stream.
     """
 
+    session_id = request.args.get('session', None)
+    if session_id is None:
+        stream = stream_manager.get_stream(
+            request.args.get('name', DEFAULT_STREAM))
+        session_id = stream['session_id'] if stream is not None else None
+    return jsonify(
+        status=200,
+        message=count_session_tweets(session_id)
+    )
+
+@app.route('/streams')
+def get_streams():
+    """/streams route.
+    
+    get:
+        description: get every named stream.
+        responses:
+            200:
+                description: list of streams with their track, sink,
+                    status, current session and counters.
+    """
+
+    return jsonify(
+        status=200,
+        message=stream_manager.get_streams()
+    )
+
+@app.route('/schema/refresh', methods=['POST'])
+def refresh_schema():
+    """/schema/refresh route.
+    
+    post:
+        description: reloads the BigQuery table schema from the bucket.
+    """
+
+    try:
+        if not store.refresh_schema():
+            return jsonify(
+                code=400,
+                message='Schema is only used by the BigQuery deployment.'
+            )
+        return jsonify(confirmation_response)
+    except Exception as e:
+        print(e)
+        return jsonify(
+            status=500,
+            message='Internal server error: schema not loaded.'
+        )
+
+@app.route('/indexes/check')
+def check_indexes():
+    """/indexes/check route.
+    
+    get:
+        description: explains the queries made by the API and reports
+            whether they are covered by the MongoDB indexes.
+        responses:
+            200:
+                description: winning plan stages, indexes used and whether
+                    the query is indexed and covered, by query name.
+    """
+
+    report = store.check_indexes()
+    if report is None:
+        return jsonify(
+            code=400,
+            message='Indexes are only checked on the MongoDB deployment.'
+        )
     return jsonify(
         status=200,
-        message=streaming_crawler.count
+        message=report
     )
 
+@app.route('/tweets/deduplicate', methods=['POST'])
+def deduplicate_tweets():
+    """/tweets/deduplicate route.
+    
+    post:
+        description: removes the duplicated tweets left in the BigQuery
+            table by streaming inserts, keeping one copy of each tweet.
+    """
+
+    try:
+        deduplicated = store.deduplicate()
+    except Exception as e:
+        print(e)
+        return jsonify(
+            status=500,
+            message='Internal server error: tweets not deduplicated.'
+        )
+    if deduplicated is None:
+        return jsonify(
+            code=400,
+            message='Tweets are only deduplicated on the BigQuery deployment.'
+        )
+    if not deduplicated:
+        return jsonify(
+            code=409,
+            message='The table has a streaming buffer, retry later.'
+        )
+    return jsonify(confirmation_response)
+
 @app.route('/batch/crawl', methods=['POST'])
 def batch_crawl():
     """/batch/crawl route.
     
     post:
-        description: starts a batch process to download the tweets.
+        description: queues a batch process to download the tweets.
         parameters:
             - name: query
               description: query of terms that the tweets must match.
@@ -186,66 +602,675 @@ def batch_crawl():
             - name: until
               description: limit date to retrieve tweets from.
               required: false
+            - name: total
+              description: maximum number of tweets to be retrieved.
+              required: false
+            - name: resume
+              description: whether to continue from the query checkpoint.
+              required: false
+            - name: priority
+              description: priority of the requests of the job when the
+                  rate limit is shared. Higher ones are sent first.
+              required: false
+        responses:
+            202:
+                description: the job which has been queued.
     """
 
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         query = data.get('query', None)
         if not query:
             return jsonify(
-                code=400,
+                status=400,
                 message="Missing required argument: 'query'."
             )
         lang = data.get('lang', None)
         count = data.get('count', None)
         until = data.get('until', None)
-        batch_crawler.crawl_tweets(
-            query=query, lang=lang, count=count, until=until
+        total = data.get('total', None)
+        resume = data.get('resume', True)
+        priority = data.get('priority', 0)
+        job = batch_jobs.submit(
+            query=query, lang=lang, count=count, until=until, total=total,
+            resume=resume, priority=priority
+        )
+        return jsonify(
+            status=202,
+            message=job.to_dict()
         )
-        return jsonify(confirmation_response)
     except Exception as e:
         print(e)
         return jsonify(
             status=500,
-            message='Interval server error: disconnected.'
+            message='Internal server error: disconnected.'
         )
 
-@app.route('/batch/tweets')
-def get_batch_tweets():
-    """/batch/tweets route.
+@app.route('/batch/crawls', methods=['POST'])
+def create_batch_crawl():
+    """/batch/crawls route.
+    
+    post:
+        description: splits a batch crawl into shards, which are crawled at
+            the same time by every crawler process.
+        parameters:
+            - name: query
+              description: query of terms that the tweets must match.
+              required: true, unless 'queries' is given
+            - name: queries
+              description: list of sub-queries to crawl separately.
+              required: false
+            - name: lang
+              description: language in which the tweets must be written.
+              required: false
+            - name: langs
+              description: list of languages to crawl separately.
+              required: false
+            - name: since
+              description: oldest date to retrieve tweets from, which
+                  splits the crawl by date (YYYY-MM-DD).
+              required: false
+            - name: until
+              description: limit date to retrieve tweets from (YYYY-MM-DD).
+              required: false
+            - name: days
+              description: number of days of each date window.
+              required: false
+            - name: count
+              description: number of tweets to be retrieved per page.
+              required: false
+            - name: total
+              description: maximum number of tweets to be retrieved by each
+                  shard.
+              required: false
+            - name: resume
+              description: whether each shard continues from its checkpoint.
+              required: false
+            - name: priority
+              description: priority of the requests of the crawl when the
+                  rate limit is shared. Higher ones are sent first.
+              required: false
+        responses:
+            202:
+                description: the crawl which has been queued.
+    """
+
+    data = request.get_json(silent=True) or {}
+    try:
+        crawl = batch_coordinator.submit(
+            query=data.get('query', None),
+            lang=data.get('lang', None),
+            until=data.get('until', None),
+            since=data.get('since', None),
+            days=data.get('days', 1),
+            langs=data.get('langs', None),
+            queries=data.get('queries', None),
+            count=data.get('count', None),
+            total=data.get('total', None),
+            resume=data.get('resume', True),
+            priority=data.get('priority', 0)
+        )
+    except ValueError as e:
+        return jsonify(
+            code=400,
+            message=str(e)
+        )
+    return jsonify(
+        status=202,
+        message=crawl
+    )
+
+@app.route('/batch/crawls')
+def get_batch_crawls():
+    """/batch/crawls route.
     
     get:
-        description: get the tweets collected by the batch process.
+        description: get the latest sharded batch crawls.
         responses:
             200:
-                description: list of tweets collected by the batch process.
+                description: list of crawls with their status and, once
+                    finished, their merged results.
     """
 
-    if GOOGLE_CLOUD_PROJECT == "False":
-        tweets = list(mongo_utils.get_by_ids(db, batch_crawler.tweet_ids))
-    else:
-        tweets = gcp_utils.get_by_ids(db, batch_crawler.tweet_ids)
     return jsonify(
         status=200,
-        message=json.dumps(tweets)
+        message=batch_coordinator.list()
+    )
+
+@app.route('/batch/crawls/<crawl_id>')
+def get_batch_crawl(crawl_id):
+    """/batch/crawls/<crawl_id> route.
+    
+    get:
+        description: get the status and progress of a sharded batch crawl.
+            Its tweets are retrieved from /batch/tweets with the crawl id as
+            session.
+        responses:
+            200:
+                description: crawl status, progress by shard status and the
+                    list of shards.
+            404:
+                description: unknown crawl.
+    """
+
+    crawl = batch_coordinator.get(crawl_id)
+    if crawl is None:
+        return jsonify(
+            code=404,
+            message="Unknown crawl: '{}'.".format(crawl_id)
+        )
+    return jsonify(
+        status=200,
+        message=crawl
+    )
+
+@app.route('/batch/crawls/<crawl_id>/cancel', methods=['POST'])
+def cancel_batch_crawl(crawl_id):
+    """/batch/crawls/<crawl_id>/cancel route.
+    
+    post:
+        description: cancels a sharded batch crawl and its pending shards.
+    """
+
+    crawl = batch_coordinator.cancel(crawl_id)
+    if crawl is None:
+        return jsonify(
+            code=404,
+            message="Unknown crawl: '{}'.".format(crawl_id)
+        )
+    return jsonify(
+        status=200,
+        message=crawl
     )
 
+@app.route('/batch/rate-limits')
+def get_rate_limits():
+    """/batch/rate-limits route.
+    
+    get:
+        description: get the rate limit budget shared by the batch crawls.
+        responses:
+            200:
+                description: by endpoint, the requests waiting, the limit
+                    per window, the requests left and the timestamp when
+                    the next one can be sent, overall and by set of
+                    credentials.
+    """
+
+    return jsonify(
+        status=200,
+        message=batch_crawler.scheduler.status()
+    )
+
+@app.route('/batch/jobs')
+def get_batch_jobs():
+    """/batch/jobs route.
+    
+    get:
+        description: get the latest batch jobs. Jobs are kept in the memory
+            of the worker process which runs them, so with several workers
+            use the sharded crawls of /batch/crawls instead.
+        responses:
+            200:
+                description: list of jobs with their status and progress.
+    """
+
+    return jsonify(
+        status=200,
+        message=[job.to_dict() for job in batch_jobs.list()]
+    )
+
+@app.route('/batch/jobs/<job_id>')
+def get_batch_job(job_id):
+    """/batch/jobs/<job_id> route.
+    
+    get:
+        description: get the status and progress of a batch job, if it runs
+            in the worker process which serves the request.
+        responses:
+            200:
+                description: job status and progress.
+            404:
+                description: unknown job.
+    """
+
+    job = batch_jobs.get(job_id)
+    if job is None:
+        return jsonify(
+            code=404,
+            message="Unknown job: '{}'.".format(job_id)
+        )
+    return jsonify(
+        status=200,
+        message=job.to_dict()
+    )
+
+@app.route('/batch/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_batch_job(job_id):
+    """/batch/jobs/<job_id>/cancel route.
+    
+    post:
+        description: cancels a queued or running batch job.
+    """
+
+    job = batch_jobs.cancel(job_id)
+    if job is None:
+        return jsonify(
+            code=404,
+            message="Unknown job: '{}'.".format(job_id)
+        )
+    return jsonify(
+        status=200,
+        message=job.to_dict()
+    )
+
+@app.route('/batch/tweets')
+def get_batch_tweets():
+    """/batch/tweets route.
+    
+    get:
+        description: get the tweets collected by a batch job.
+        parameters:
+            - name: session
+              description: batch job id. Defaults to the latest job.
+              required: false
+            - name: limit
+              description: maximum number of tweets to return.
+              required: false
+            - name: after
+              description: cursor returned as 'next' by the previous page.
+              required: false
+            - name: fields
+              description: comma separated list of fields to return.
+              required: false
+        responses:
+            200:
+                description: list of tweets collected by the batch process,
+                    newest first.
+    """
+
+    session_id = request.args.get('session', latest_batch_session())
+    return get_session_tweets(session_id)
+
 @app.route('/batch/count')
 def get_batch_count():
     """/batch/count route.
     
     get:
-        description: get the number of tweets collected by the batch process.
+        description: get the number of tweets collected by a batch job.
+        parameters:
+            - name: session
+              description: batch job id. Defaults to the latest job.
+              required: false
         responses:
             200:
                 description: number of tweets collected by the batch process.
     """
 
+    session_id = request.args.get('session', latest_batch_session())
+    return jsonify(
+        status=200,
+        message=count_session_tweets(session_id)
+    )
+
+@app.route('/tweets/lookup', methods=['POST'])
+def lookup_tweets():
+    """/tweets/lookup route.
+    
+    post:
+        description: get the stored tweets with the given ids.
+        parameters:
+            - name: ids
+              description: list of tweet ids.
+              required: true
+            - name: fields
+              description: list of fields to return.
+              required: false
+            - name: since
+              description: oldest creation date of the tweets, used to
+                  reduce the data scanned (YYYY-MM-DD HH:MM:SS). BigQuery
+                  requires since or until.
+              required: false
+            - name: until
+              description: newest creation date of the tweets, used to
+                  reduce the data scanned (YYYY-MM-DD HH:MM:SS).
+              required: false
+        responses:
+            200:
+                description: list of tweets and bytes processed by
+                    BigQuery, if used.
+    """
+
+    data = request.get_json(silent=True) or {}
+    ids = data.get('ids', None)
+    if not ids:
+        return jsonify(
+            code=400,
+            message="Missing required argument: 'ids'."
+        )
+    if not all(str(id).isdigit() for id in ids):
+        return jsonify(
+            code=400,
+            message='Tweet ids must be numeric.'
+        )
+    fields = data.get('fields', None)
+    unknown = [field for field in fields or [] if field not in TWEET_FIELDS]
+    if unknown:
+        return jsonify(
+            code=400,
+            message="Unknown fields: '{}'.".format(','.join(unknown))
+        )
+    since = parse_date(data['since']) if data.get('since') else None
+    until = parse_date(data['until']) if data.get('until') else None
+    try:
+        tweets, bytes_processed = store.get_by_ids(
+            ids, fields, start=since, end=until
+        )
+    except ValueError as e:
+        return jsonify(
+            code=400,
+            message=str(e)
+        )
     return jsonify(
         status=200,
-        message=batch_crawler.count
+        message=tweets,
+        bytes_processed=bytes_processed
     )
+
+@app.route('/tweets/export')
+def export_tweets():
+    """/tweets/export route.
     
+    get:
+        description: streams the stored tweets as newline-delimited JSON.
+        parameters:
+            - name: crawler
+              description: type of crawler, 'streaming' or 'batch'.
+              required: false
+            - name: lang
+              description: language in which the tweets must be written.
+              required: false
+            - name: session
+              description: crawl session id.
+              required: false
+            - name: since
+              description: only tweets created on or after this date
+                  (YYYY-MM-DD or YYYY-MM-DD HH:MM:SS).
+              required: false
+            - name: until
+              description: only tweets created before this date
+                  (YYYY-MM-DD or YYYY-MM-DD HH:MM:SS).
+              required: false
+            - name: fields
+              description: comma separated list of fields to return.
+              required: false
+            - name: gzip
+              description: whether to gzip-compress the response.
+              required: false
+        responses:
+            200:
+                description: one JSON tweet per line.
+    """
+
+    filters, invalid = parse_filters()
+    if invalid:
+        return jsonify(
+            code=400,
+            message="Invalid date for '{}': '{}'.".format(*invalid)
+        )
+    fields, unknown = parse_fields()
+    if unknown:
+        return jsonify(
+            code=400,
+            message="Unknown fields: '{}'.".format(','.join(unknown))
+        )
+    compress = request.args.get('gzip', 'false').lower() in ('1', 'true')
+
+    tweets = store.iter_tweets(filters, fields, EXPORT_BATCH_SIZE)
+
+    def generate():
+        compressor = zlib.compressobj(wbits=31) if compress else None
+        lines, size = [], 0
+        for tweet in tweets:
+            line = json.dumps(tweet, default=str) + '\n'
+            lines.append(line)
+            size += len(line)
+            if size >= EXPORT_CHUNK_SIZE:
+                chunk = ''.join(lines).encode('utf-8')
+                lines, size = [], 0
+                yield compressor.compress(chunk) if compressor else chunk
+        chunk = ''.join(lines).encode('utf-8')
+        if compressor:
+            yield compressor.compress(chunk) + compressor.flush()
+        elif chunk:
+            yield chunk
+
+    if compress:
+        response = Response(stream_with_context(generate()),
+                            mimetype='application/gzip')
+        response.headers['Content-Disposition'] = (
+            'attachment; filename=tweets.ndjson.gz')
+    else:
+        response = Response(stream_with_context(generate()),
+                            mimetype='application/x-ndjson')
+    return response
+
+@app.route('/tweets/aggregates/<kind>')
+def aggregate_tweets(kind: str):
+    """/tweets/aggregates/<kind> route.
+    
+    get:
+        description: get pre-aggregated data of the stored tweets. Kind is
+            one of 'timeseries' (tweets per time bucket, crawler and
+            language), 'interactions' (interaction totals by crawler),
+            'hashtags', 'terms' or 'sources'. Results are cached for
+            `AGGREGATES_CACHE_TTL` seconds.
+        parameters:
+            - name: crawler
+              description: type of crawler, 'streaming' or 'batch'.
+              required: false
+            - name: lang
+              description: language in which the tweets must be written.
+              required: false
+            - name: session
+              description: crawl session id.
+              required: false
+            - name: since
+              description: only tweets created on or after this date
+                  (YYYY-MM-DD or YYYY-MM-DD HH:MM:SS). Defaults to
+                  `AGGREGATES_DEFAULT_DAYS` days ago.
+              required: false
+            - name: until
+              description: only tweets created before this date
+                  (YYYY-MM-DD or YYYY-MM-DD HH:MM:SS).
+              required: false
+            - name: interval
+              description: size of the time buckets, 'minute', 'hour' or
+                  'day'. Only used by 'timeseries'.
+              required: false
+            - name: limit
+              description: number of rows to return. Only used by
+                  'hashtags', 'terms' and 'sources'.
+              required: false
+        responses:
+            200:
+                description: aggregated rows and whether they were served
+                    from the cache.
+    """
+
+    if kind not in AGGREGATES:
+        return jsonify(
+            code=404,
+            message="Unknown aggregate: '{}'.".format(kind)
+        )
+    filters, invalid = parse_filters()
+    if invalid:
+        return jsonify(
+            code=400,
+            message="Invalid date for '{}': '{}'.".format(*invalid)
+        )
+    if not filters.get('since'):
+        # Rounded to the day, so the cache key is stable during the day
+        since = datetime.utcnow().date() - timedelta(
+            days=AGGREGATES_DEFAULT_DAYS)
+        filters['since'] = since.strftime('%Y-%m-%d %H:%M:%S')
+    interval = request.args.get('interval', 'hour')
+    if interval not in aggregate_utils.INTERVALS:
+        return jsonify(
+            code=400,
+            message="Unknown interval: '{}'.".format(interval)
+        )
+    limit = request.args.get('limit', AGGREGATES_DEFAULT_LIMIT, type=int)
+    limit = min(max(limit, 1), AGGREGATES_MAX_LIMIT)
+
+    def compute():
+        if kind == 'timeseries':
+            return store.timeseries(filters, interval)
+        if kind == 'interactions':
+            return store.interactions(filters)
+        if kind == 'hashtags':
+            return store.top_words(filters, 'hashtag', limit)
+        if kind == 'terms':
+            return store.top_words(filters, 'term', limit)
+        return store.sources(filters, limit)
+
+    key = (kind, tuple(sorted(filters.items())), interval, limit)
+    rows, cached = aggregates_cache.get_or_compute(key, compute)
+    return jsonify(
+        status=200,
+        message=rows,
+        cached=cached
+    )
+
+def parse_filters():
+    """Method which reads the `crawler`, `lang`, `session`, `since` and
+    `until` query parameters.
+
+    Returns
+    -------
+    tuple[dict, tuple[str, str]]
+        Filters, and the name and value of the first invalid date, if any.
+    """
+
+    filters = {
+        'crawler': request.args.get('crawler', None),
+        'lang': request.args.get('lang', None),
+        'session_id': request.args.get('session', None)
+    }
+    for key in ['since', 'until']:
+        value = request.args.get(key, None)
+        if not value:
+            continue
+        parsed = parse_date(value)
+        if parsed is None:
+            return filters, (key, value)
+        filters[key] = parsed
+    return filters, None
+
+def parse_fields():
+    """Method which reads the `fields` query parameter.
+
+    Returns
+    -------
+    tuple[list[str], list[str]]
+        Requested fields, or None if missing, and those which are not part
+        of the data model.
+    """
+
+    fields = request.args.get('fields', None)
+    if not fields:
+        return None, []
+    fields = [field.strip() for field in fields.split(',')]
+    return fields, [field for field in fields if field not in TWEET_FIELDS]
+
+def parse_date(value: str):
+    """Method which normalizes a date given as a query parameter.
+
+    Parameters
+    ----------
+    value: str
+        Date formatted as YYYY-MM-DD or YYYY-MM-DD HH:MM:SS.
+
+    Returns
+    -------
+    str
+        Date formatted as YYYY-MM-DD HH:MM:SS, or None if it is not valid.
+    """
+
+    for date_format in ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d']:
+        try:
+            parsed = datetime.strptime(value, date_format)
+            return parsed.strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            continue
+    return None
+
+def latest_batch_session():
+    """
+    Method which returns the id of the latest batch job or crawl, if any.
+    Crawls are read from the shared state, so every process agrees on them,
+    while jobs are only known by the process which runs them.
+    """
+
+    latest = [(crawl['created_at'], crawl['id'])
+              for crawl in state.get_crawls(1)]
+    latest += [(job.created_at, job.id) for job in batch_jobs.list()[-1:]]
+    return max(latest)[1] if latest else None
+
+def count_session_tweets(session_id: str):
+    """Method which counts the tweets saved by a crawl session. They are
+    counted in the database, so the result does not depend on the process
+    which ran the session.
+
+    Parameters
+    ----------
+    session_id: str
+        Identifier of the crawl session.
+    """
+
+    if not session_id:
+        return 0
+    return store.count({'session_id': session_id})
+
+def get_session_tweets(session_id: str):
+    """Method which retrieves a page of the tweets saved by a crawl session.
+
+    Page bounds and projection are read from the `limit`, `after` and
+    `fields` query parameters. The response includes the cursor of the next
+    page as `next`, which is null on the last page.
+
+    Parameters
+    ----------
+    session_id: str
+        Identifier of the crawl session.
+    """
+
+    fields, unknown = parse_fields()
+    if unknown:
+        return jsonify(
+            code=400,
+            message="Unknown fields: '{}'.".format(','.join(unknown))
+        )
+    if not session_id:
+        return jsonify(status=200, message=[], next=None)
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
+    after = request.args.get('after', None)
+    try:
+        tweets, cursor, bytes_processed = store.get_by_session(
+            session_id, limit, after, fields)
+    except ValueError:
+        return jsonify(
+            code=400,
+            message="Invalid cursor: '{}'.".format(after)
+        )
+    return jsonify(
+        status=200,
+        message=tweets,
+        next=cursor,
+        bytes_processed=bytes_processed
+    )
+
 if __name__ == '__main__':
     ENVIRONMENT_DEBUG = os.environ.get('APP_DEBUG', True)
     ENVIRONMENT_PORT = os.environ.get('APP_PORT', 5000)
@@ -0,0 +1,472 @@
+import os
+import time
+import uuid
+import socket
+import logging
+import threading
+from collections import Counter
+from typing import Any, List
+
+import utils.shard_utils as shard_utils
+from modules.BatchJobManager import BatchJob, BatchJobCancelled
+from modules.SharedState import SharedState
+
+BATCH_SHARD_WORKERS = int(os.environ.get('BATCH_SHARD_WORKERS', 2))
+BATCH_SHARD_LEASE_TTL = float(os.environ.get('BATCH_SHARD_LEASE_TTL', 60))
+BATCH_SHARD_MAX_ATTEMPTS = int(os.environ.get('BATCH_SHARD_MAX_ATTEMPTS', 3))
+BATCH_SHARD_POLL_INTERVAL = float(
+    os.environ.get('BATCH_SHARD_POLL_INTERVAL', 2))
+BATCH_CRAWLS_HISTORY = int(os.environ.get('BATCH_CRAWLS_HISTORY', 100))
+
+class ShardJob(BatchJob):
+    """
+    Class used to run a shard of a crawl as a batch job, which keeps the
+    lease of the shard while it runs and reports its progress to the shared
+    state.
+
+    The lease is renewed before each page and while waiting for the rate
+    limit. If it is lost, because the shard was cancelled or given to
+    another worker, the job is cancelled.
+
+    Extends
+    -------
+    BatchJob
+
+    Attributes
+    ----------
+    shard: dict
+        Shard being crawled.
+    state: SharedState
+        Shared state where the work queue is kept.
+    owner: str
+        Identifier of the worker holding the lease.
+    ttl: float
+        Seconds the lease is renewed for.
+    """
+
+    def __init__(self, shard: dict, state: SharedState, owner: str,
+                 ttl: float):
+        """
+        Parameters
+        ----------
+        shard: dict
+            Shard being crawled.
+        state: SharedState
+            Shared state where the work queue is kept.
+        owner: str
+            Identifier of the worker holding the lease.
+        ttl: float
+            Seconds the lease is renewed for.
+        """
+
+        super().__init__(shard['params'])
+        self.id = shard['id']
+        self.shard = shard
+        self.state = state
+        self.owner = owner
+        self.ttl = ttl
+        self.status = 'running'
+        self.started_at = time.time()
+
+    def check_cancelled(self):
+        """
+        Method which renews the lease, reporting the progress, and raises
+        BatchJobCancelled if it has been lost or the job cancelled.
+        """
+
+        if not self.cancelled and not self.update({}):
+            self.cancel()
+        super().check_cancelled()
+
+    def wait(self, seconds: float):
+        """Method which sleeps unless the job is cancelled meanwhile, renewing
+        the lease so it does not expire during long rate limit waits.
+
+        Parameters
+        ----------
+        seconds: float
+            Number of seconds to sleep.
+        """
+
+        end = time.time() + max(0, seconds)
+        while True:
+            self.check_cancelled()
+            remaining = end - time.time()
+            if remaining <= 0:
+                return
+            self._cancel_event.wait(min(remaining, self.ttl / 3))
+
+    def update(self, fields: dict):
+        """Method which reports the progress of the shard along with the
+        given fields, and renews the lease.
+
+        Parameters
+        ----------
+        fields: dict
+            Additional values of the shard, such as its `status`.
+
+        Returns
+        -------
+        bool
+            Whether the lease was still held.
+        """
+
+        fields = dict(fields, pages=self.pages, tweets=self.tweets)
+        return self.state.update_shard(self.id, self.owner, fields, self.ttl)
+
+class BatchCoordinator():
+    """
+    Class used to run batch crawls split into shards, which any number of
+    crawler processes crawl at the same time.
+
+    A crawl is split by sub-query, language and date window, and its shards
+    are put on a work queue in the shared state. Every process runs a few
+    worker threads which claim the next shard, crawl it and report it done.
+    Shards are leased, so the ones held by a worker which died are claimed
+    again once their lease expires, and continue from their checkpoint.
+
+    Every shard saves its tweets with the crawl id as session, and tweets
+    are upserted by id, so the ones found by several shards are stored once.
+    When the last shard finishes, the results are merged into the crawl.
+    They are added up from the shards rather than counted in the store,
+    since the spool may not have been replayed yet and a tweet keeps the
+    session of the crawl which first stored it.
+
+    Attributes
+    ----------
+    crawler: IKEABatchCrawler
+        Crawler used to crawl the shards.
+    state: SharedState
+        Shared state where the crawls and the work queue are kept.
+    owner: str
+        Identifier of this process in the leases.
+
+    Methods
+    -------
+    start(self)
+        Method which starts the worker threads.
+    submit(self, **params)
+        Method which splits a crawl into shards and queues them.
+    get(self, crawl_id: str)
+        Method which returns a crawl with its shards and progress.
+    list(self)
+        Method which returns the latest crawls.
+    cancel(self, crawl_id: str)
+        Method which cancels a crawl and its pending shards.
+    shutdown(self)
+        Method which stops the workers and puts their shards back.
+    """
+
+    def __init__(self, crawler: Any, state: SharedState,
+                 workers: int = BATCH_SHARD_WORKERS,
+                 lease_ttl: float = BATCH_SHARD_LEASE_TTL,
+                 max_attempts: int = BATCH_SHARD_MAX_ATTEMPTS,
+                 interval: float = BATCH_SHARD_POLL_INTERVAL):
+        """
+        Parameters
+        ----------
+        crawler: IKEABatchCrawler
+            Crawler used to crawl the shards.
+        state: SharedState
+            Shared state where the crawls and the work queue are kept.
+        workers: int
+            Number of shards crawled at the same time by this process.
+        lease_ttl: float
+            Seconds until the lease of a shard expires if not renewed.
+        max_attempts: int
+            Number of times a shard is crawled before it is failed.
+        interval: float
+            Seconds between two claims while the queue is empty.
+        """
+
+        self.crawler = crawler
+        self.state = state
+        self.workers = workers
+        self.lease_ttl = lease_ttl
+        self.max_attempts = max_attempts
+        self.interval = interval
+        self.owner = '{}-{}-{}'.format(
+            socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """
+        Method which starts the worker threads.
+        """
+
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._run, args=('{}-{}'.format(self.owner, i),),
+                daemon=True, name='shard-{}'.format(i))
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, query: str = None, lang: str = None, until: str = None,
+               since: str = None, days: int = 1, langs: List[str] = None,
+               queries: List[str] = None, count: int = None,
+               total: int = None, resume: bool = True, priority: int = 0):
+        """Method which splits a crawl into shards and queues them. Raises
+        ValueError if the parameters are not valid, such as `langs` or
+        `queries` which are not lists of strings, or `days`, `count` or
+        `total` which are not positive integers.
+
+        Parameters
+        ----------
+        query: str
+            Query of terms that the tweets must match.
+        lang: str
+            Language in which the tweets must be written.
+        until: str
+            Limit date to retrieve tweets from (YYYY-MM-DD).
+        since: str
+            Oldest date to retrieve tweets from (YYYY-MM-DD), if the crawl
+            is split by date.
+        days: int
+            Number of days of each date window.
+        langs: list[str]
+            Languages to crawl separately.
+        queries: list[str]
+            Sub-queries to crawl separately.
+        count: int
+            Number of tweets retrieved per page.
+        total: int
+            Maximum number of tweets retrieved by each shard.
+        resume: bool
+            Whether each shard reads and updates its checkpoint.
+        priority: int
+            Priority of the requests of the crawl in the scheduler.
+
+        Returns
+        -------
+        dict
+            Crawl which has been queued.
+        """
+
+        for key, value in [('query', query), ('lang', lang),
+                           ('until', until), ('since', since)]:
+            if value is not None and not isinstance(value, str):
+                raise ValueError(
+                    "Invalid value for '{}': '{}'.".format(key, value))
+        for key, value in [('langs', langs), ('queries', queries)]:
+            if value is not None and (
+                    not isinstance(value, list)
+                    or not all(isinstance(item, str) for item in value)):
+                raise ValueError("Invalid value for '{}': it must be a list "
+                                 "of strings.".format(key))
+        # bool is a subclass of int, but true is not a valid count
+        for key, value in [('days', days), ('count', count),
+                           ('total', total), ('priority', priority)]:
+            invalid = isinstance(value, bool) or not isinstance(value, int)
+            if key != 'priority':
+                invalid = value is not None and (invalid or value < 1)
+            if invalid:
+                raise ValueError(
+                    "Invalid value for '{}': '{}'.".format(key, value))
+        params = {
+            'query': query, 'lang': lang, 'until': until, 'since': since,
+            'days': days, 'langs': langs, 'queries': queries, 'count': count,
+            'total': total, 'resume': resume, 'priority': priority
+        }
+        splits = shard_utils.split(query, lang, until, since, days, langs,
+                                   queries)
+        now = time.time()
+        crawl = {
+            'id': uuid.uuid4().hex,
+            'params': params,
+            'status': 'running',
+            'shards': len(splits),
+            'created_at': now,
+            'finished_at': None
+        }
+        shards = [
+            {
+                'id': '{}-{}'.format(crawl['id'], position),
+                'crawl_id': crawl['id'],
+                'position': position,
+                'params': dict(split, count=count, total=total,
+                               resume=resume, priority=priority),
+                'status': 'queued',
+                'owner': None,
+                'expires_at': None,
+                'attempts': 0,
+                'pages': 0,
+                'tweets': 0,
+                'error': None,
+                'created_at': now
+            }
+            for position, split in enumerate(splits)
+        ]
+        self.state.save_crawl(crawl)
+        self.state.add_shards(shards)
+        message = 'BATCH | Crawl {} split in {} shards.'.format(
+            crawl['id'], len(shards))
+        print(message)
+        logging.info(message)
+        return crawl
+
+    def get(self, crawl_id: str):
+        """Method which returns a crawl with its shards and progress, or None
+        if it is unknown.
+
+        Parameters
+        ----------
+        crawl_id: str
+            Identifier of the crawl.
+        """
+
+        crawl = self.state.get_crawl(crawl_id)
+        if crawl is None:
+            return None
+        shards = self.state.get_shards(crawl_id)
+        crawl['progress'] = {
+            'status': dict(Counter(shard['status'] for shard in shards)),
+            'pages': sum(shard['pages'] or 0 for shard in shards),
+            'tweets': sum(shard['tweets'] or 0 for shard in shards)
+        }
+        crawl['shard_list'] = shards
+        return crawl
+
+    def list(self):
+        """
+        Method which returns the latest crawls.
+        """
+
+        return self.state.get_crawls(BATCH_CRAWLS_HISTORY)
+
+    def cancel(self, crawl_id: str):
+        """Method which cancels a crawl. Queued shards are cancelled right
+        away, running ones stop after the page in progress.
+
+        Parameters
+        ----------
+        crawl_id: str
+            Identifier of the crawl.
+        """
+
+        crawl = self.state.get_crawl(crawl_id)
+        if crawl is not None and crawl['status'] == 'running':
+            self.state.cancel_shards(crawl_id)
+            crawl['status'] = 'cancelled'
+            crawl['finished_at'] = time.time()
+            self.state.save_crawl(crawl)
+        return crawl
+
+    def shutdown(self):
+        """
+        Method which stops the workers. The shards in progress are put back
+        on the queue, so other processes can continue them.
+        """
+
+        self._stop.set()
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            job.cancel()
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self, owner: str):
+        """Submethod executed by the worker threads. Claims and crawls shards
+        until the coordinator is shut down.
+
+        Parameters
+        ----------
+        owner: str
+            Identifier of the worker in the leases.
+        """
+
+        while not self._stop.is_set():
+            try:
+                shard = self.state.claim_shard(owner, self.lease_ttl)
+            except Exception as e:
+                shard = None
+                message = 'BATCH | Shard not claimed: {}'.format(e)
+                print(message)
+                logging.error(message)
+            if shard is None:
+                self._stop.wait(self.interval)
+                continue
+            self._crawl_shard(shard, owner)
+
+    def _crawl_shard(self, shard: dict, owner: str):
+        """Submethod which crawls a claimed shard and reports the result.
+
+        A failed shard is put back on the queue until it has been attempted
+        `max_attempts` times.
+
+        Parameters
+        ----------
+        shard: dict
+            Shard claimed by the worker.
+        owner: str
+            Identifier of the worker in the leases.
+        """
+
+        job = ShardJob(shard, self.state, owner, self.lease_ttl)
+        if shard['attempts'] > self.max_attempts:
+            job.update({'status': 'failed'})
+            self._merge(shard['crawl_id'])
+            return
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self.crawler.crawl_tweets(session_id=shard['crawl_id'], job=job,
+                                      **shard['params'])
+            job.update({'status': 'done'})
+        except BatchJobCancelled:
+            if self._stop.is_set():
+                job.update({'status': 'queued', 'owner': None})
+        except Exception as e:
+            status = ('failed' if shard['attempts'] >= self.max_attempts
+                      else 'queued')
+            job.update({'status': status, 'owner': None, 'error': str(e)})
+            message = 'BATCH | Shard {} failed: {}'.format(job.id, e)
+            print(message)
+            logging.error(message)
+        finally:
+            with self._lock:
+                del self._jobs[job.id]
+        self._merge(shard['crawl_id'])
+
+    def _merge(self, crawl_id: str):
+        """Submethod which merges the results of a crawl once every shard has
+        finished: the overall status, and the pages and tweets written by
+        every shard. Tweets found by overlapping shards are counted by each
+        of them.
+
+        Parameters
+        ----------
+        crawl_id: str
+            Identifier of the crawl.
+        """
+
+        try:
+            shards = self.state.get_shards(crawl_id)
+            if any(shard['status'] in ('queued', 'running')
+                   for shard in shards):
+                return
+            crawl = self.state.get_crawl(crawl_id)
+            if crawl is None or crawl['status'] != 'running':
+                return
+            statuses = {shard['status'] for shard in shards}
+            if 'failed' in statuses:
+                crawl['status'] = 'failed'
+            elif 'cancelled' in statuses:
+                crawl['status'] = 'cancelled'
+            else:
+                crawl['status'] = 'done'
+            crawl['pages'] = sum(shard['pages'] or 0 for shard in shards)
+            crawl['tweets'] = sum(shard['tweets'] or 0 for shard in shards)
+            crawl['finished_at'] = time.time()
+            self.state.save_crawl(crawl)
+            message = 'BATCH | Crawl {} {}: {} tweets written.'.format(
+                crawl_id, crawl['status'], crawl['tweets'])
+            print(message)
+            logging.info(message)
+        except Exception as e:
+            message = 'BATCH | Crawl {} not merged: {}'.format(crawl_id, e)
+            print(message)
+            logging.error(message)
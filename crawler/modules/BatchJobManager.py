@@ -0,0 +1,273 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', 4))
+BATCH_JOBS_HISTORY = int(os.environ.get('BATCH_JOBS_HISTORY', 100))
+
+class BatchJobCancelled(Exception):
+    """
+    Exception raised inside a batch crawl when its job has been cancelled.
+    """
+
+class BatchJob():
+    """
+    Class used to keep track of the status and progress of a batch crawl.
+
+    Attributes
+    ----------
+    id: str
+        Unique identifier of the job.
+    params: dict
+        Parameters passed to `IKEABatchCrawler.crawl_tweets`.
+    status: str
+        One of 'queued', 'running', 'done', 'failed' or 'cancelled'.
+    pages: int
+        Number of result pages fetched.
+    tweets: int
+        Number of tweets saved to the database.
+    rate_limit_waits: int
+        Number of times the crawl had to wait for the rate limit to reset.
+    error: str
+        Error message, if the job failed.
+
+    Methods
+    -------
+    cancel(self)
+        Method which requests the job to stop.
+    check_cancelled(self)
+        Method which raises BatchJobCancelled if the job has been cancelled.
+    wait(self, seconds: float)
+        Method which sleeps unless the job is cancelled meanwhile.
+    to_dict(self)
+        Method which returns a JSON-serializable view of the job.
+    """
+
+    def __init__(self, params: dict):
+        """
+        Parameters
+        ----------
+        params: dict
+            Parameters passed to `IKEABatchCrawler.crawl_tweets`.
+        """
+
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.status = 'queued'
+        self.pages = 0
+        self.tweets = 0
+        self.rate_limit_waits = 0
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed', 'cancelled')
+
+    def cancel(self):
+        """
+        Method which requests the job to stop. A running crawl stops after
+        the page in progress.
+        """
+
+        self._cancel_event.set()
+
+    def check_cancelled(self):
+        """
+        Method which raises BatchJobCancelled if the job has been cancelled.
+        """
+
+        if self.cancelled:
+            raise BatchJobCancelled(self.id)
+
+    def wait(self, seconds: float):
+        """Method which sleeps unless the job is cancelled meanwhile.
+
+        Parameters
+        ----------
+        seconds: float
+            Number of seconds to sleep.
+        """
+
+        self._cancel_event.wait(max(0, seconds))
+        self.check_cancelled()
+
+    def to_dict(self):
+        """
+        Method which returns a JSON-serializable view of the job.
+        """
+
+        return {
+            'id': self.id,
+            'params': self.params,
+            'status': self.status,
+            'pages': self.pages,
+            'tweets': self.tweets,
+            'rate_limit_waits': self.rate_limit_waits,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+class BatchJobManager():
+    """
+    Class used to run batch crawls on a pool of worker threads.
+
+    Attributes
+    ----------
+    crawler: IKEABatchCrawler
+        Crawler used to run the jobs.
+    jobs: OrderedDict[str, BatchJob]
+        Registry with the latest jobs, ordered by creation.
+
+    Methods
+    -------
+    submit(self, **params)
+        Method which queues a new crawl and returns its job.
+    get(self, job_id: str)
+        Method which returns a job given its id.
+    list(self)
+        Method which returns every job in the registry.
+    cancel(self, job_id: str)
+        Method which cancels a job given its id.
+    shutdown(self)
+        Method which cancels every job and stops the workers.
+    """
+
+    def __init__(self, crawler: Any, workers: int = BATCH_WORKERS,
+                 history: int = BATCH_JOBS_HISTORY):
+        """
+        Parameters
+        ----------
+        crawler: IKEABatchCrawler
+            Crawler used to run the jobs.
+        workers: int
+            Number of crawls which can run at the same time.
+        history: int
+            Number of finished jobs kept in the registry.
+        """
+
+        self.crawler = crawler
+        self.history = history
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='batch'
+        )
+
+    def submit(self, **params):
+        """Method which queues a new crawl and returns its job.
+
+        Parameters
+        ----------
+        params: dict
+            Parameters passed to `IKEABatchCrawler.crawl_tweets`.
+        """
+
+        job = BatchJob(params)
+        with self._lock:
+            self.jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str):
+        """Method which returns a job given its id, or None if it is unknown.
+
+        Parameters
+        ----------
+        job_id: str
+            Identifier of the job.
+        """
+
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        """
+        Method which returns every job in the registry.
+        """
+
+        with self._lock:
+            return list(self.jobs.values())
+
+    def cancel(self, job_id: str):
+        """Method which cancels a job given its id.
+
+        Queued jobs are cancelled right away, running ones stop after the
+        page in progress.
+
+        Parameters
+        ----------
+        job_id: str
+            Identifier of the job.
+        """
+
+        job = self.get(job_id)
+        if job is not None and not job.finished:
+            job.cancel()
+            if job.status == 'queued':
+                job.status = 'cancelled'
+        return job
+
+    def shutdown(self):
+        """
+        Method which cancels every job and stops the workers.
+        """
+
+        for job in self.list():
+            job.cancel()
+        self._executor.shutdown(wait=True)
+
+    def _run(self, job: BatchJob):
+        """Submethod executed by the workers to run a job.
+
+        Parameters
+        ----------
+        job: BatchJob
+            Job to be run.
+        """
+
+        if job.cancelled:
+            job.status = 'cancelled'
+            return
+        job.status = 'running'
+        job.started_at = time.time()
+        try:
+            self.crawler.crawl_tweets(job=job, **job.params)
+            job.status = 'done'
+        except BatchJobCancelled:
+            job.status = 'cancelled'
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+            message = 'BATCH | Job {} failed: {}'.format(job.id, e)
+            print(message)
+            logging.error(message)
+        finally:
+            job.finished_at = time.time()
+
+    def _prune(self):
+        """
+        Submethod which removes the oldest finished jobs once the registry
+        holds more than `history` of them. It must be called while holding
+        the lock.
+        """
+
+        finished = [job_id for job_id, job in self.jobs.items()
+                    if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self.jobs[job_id]
@@ -0,0 +1,89 @@
+import os
+import uuid
+import threading
+from collections import OrderedDict
+from typing import List
+
+CRAWL_SESSIONS_HISTORY = int(os.environ.get('CRAWL_SESSIONS_HISTORY', 100))
+
+class CrawlSessions():
+    """
+    Class used to keep lightweight statistics about the tweets saved by each
+    crawl session. Tweets themselves are only kept in the database, tagged
+    with their `session_id`.
+
+    Attributes
+    ----------
+    history: int
+        Number of sessions kept in memory.
+
+    Methods
+    -------
+    create(self, session_id: str)
+        Method which registers a new session and returns its id.
+    record(self, tweets: list[dict])
+        Method which updates the statistics with a batch of saved tweets.
+    get(self, session_id: str)
+        Method which returns the statistics of a session.
+    """
+
+    def __init__(self, history: int = CRAWL_SESSIONS_HISTORY):
+        """
+        Parameters
+        ----------
+        history: int
+            Number of sessions kept in memory.
+        """
+
+        self.history = history
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, session_id: str = None):
+        """Method which registers a new session and returns its id.
+
+        Parameters
+        ----------
+        session_id: str
+            Identifier of the session. A random one is generated if missing.
+        """
+
+        session_id = session_id or uuid.uuid4().hex
+        with self._lock:
+            self._sessions[session_id] = {
+                'session_id': session_id,
+                'count': 0
+            }
+            while len(self._sessions) > self.history:
+                self._sessions.popitem(last=False)
+        return session_id
+
+    def record(self, tweets: List[dict]):
+        """Method which updates the statistics with a batch of saved tweets.
+
+        Parameters
+        ----------
+        tweets: list[dict]
+            List of JSON-like objects which have been saved.
+        """
+
+        with self._lock:
+            for tweet in tweets:
+                stats = self._sessions.get(tweet.get('session_id'))
+                if stats is None:
+                    continue
+                stats['count'] += 1
+
+    def get(self, session_id: str):
+        """Method which returns a copy of the statistics of a session, or None
+        if it is unknown.
+
+        Parameters
+        ----------
+        session_id: str
+            Identifier of the session.
+        """
+
+        with self._lock:
+            stats = self._sessions.get(session_id)
+            return dict(stats) if stats is not None else None
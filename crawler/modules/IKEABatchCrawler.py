@@ -1,15 +1,20 @@
-import os
+import time
+import hashlib
 import logging
 from datetime import date
-from typing import Any, Union
+from typing import Any, List, Tuple, Union
 
 import tweepy
-import dateutil.parser
 
-import utils.gcp_utils as gcp_utils
+import utils.metrics_utils as metrics_utils
+import utils.transform_utils as transform_utils
+from modules.CrawlSessions import CrawlSessions
+from modules.RateLimitScheduler import SEARCH_ENDPOINT
+from modules.TweetSpool import TweetSpool
+from modules.TweetStore import TweetStore
 
-MONGODB_COLLECTION = os.environ.get('MONGODB_COLLECTION')
-GOOGLE_CLOUD_PROJECT = os.environ.get('GOOGLE_CLOUD_PROJECT')
+MAX_PAGE_SIZE = 100
+RATE_LIMIT_DEFAULT_WAIT = 15 * 60
 
 class IKEABatchCrawler():
     """
@@ -19,21 +24,32 @@ class IKEABatchCrawler():
     ----------
     api: tweepy.api
         Twitter API object used to perform the queries.
-    db: pymongo.database.Database | google.cloud.bigquery.Client
-        Database object used to save the results.
-    tweet_ids: list
-        List contaning the tweet ids which have been collected.
-    count: int
-        Counter with the quantity of tweets collected.
+    apis: dict[str, tweepy.api]
+        Twitter API objects of every set of credentials, by key.
+    scheduler: RateLimitScheduler
+        Scheduler of the requests within the rate limits shared by every
+        process, if any. Each request is sent with the credentials it
+        assigns.
+    store: TweetStore
+        Store used to save the results.
+    sessions: CrawlSessions
+        Statistics of the tweets saved by each crawl session.
+    spool: TweetSpool
+        Write-ahead spool the tweets are appended to, if any, instead of
+        being saved directly to the database.
 
     Methods
     -------
-    crawl_tweets(self, query: str, lang: str, count: str, until: str)
+    crawl_tweets(self, query: str, lang: str, count: str, until: str,
+                 total: str, resume: bool, session_id: str, priority: int)
         Method which crawls the tweets which fits the given parameters.
     """
 
     def __init__(self, consumer_key: str, consumer_secret: str,
-                 access_token: str, access_token_secret:str, db: Any):
+                 access_token: str, access_token_secret:str,
+                 store: TweetStore, sessions: CrawlSessions,
+                 spool: TweetSpool = None,
+                 credentials: List[Tuple[str, str, str, str]] = None):
         """
         Parameters
         ----------
@@ -45,21 +61,40 @@ class IKEABatchCrawler():
             Access token from Twitter API.
         access_token_secret: str
             Access token secret from Twitter API.
-        db: pymongo.database.Database | google.cloud.bigquery.Client
-            Database object used to save the results.
+        store: TweetStore
+            Store used to save the results.
+        sessions: CrawlSessions
+            Registry used to keep the statistics of each crawl session.
+        spool: TweetSpool
+            Write-ahead spool the tweets are appended to, if any.
+        credentials: list[tuple[str, str, str, str]]
+            Additional sets of consumer key, consumer secret, access token
+            and access token secret, whose rate limits are used too.
         """
 
         auth = tweepy.OAuthHandler(consumer_key, consumer_secret)
         auth.set_access_token(access_token,access_token_secret)
-        self.api = tweepy.API(auth, wait_on_rate_limit=True)
-        self.db = db
-        self.tweet_ids = []
-        self.count = 0
+        self.api = tweepy.API(auth)
+        self.apis = {credentials_key(access_token): self.api}
+        for key, secret, token, token_secret in credentials or []:
+            auth = tweepy.OAuthHandler(key, secret)
+            auth.set_access_token(token, token_secret)
+            self.apis[credentials_key(token)] = tweepy.API(auth)
+        self.scheduler = None
+        self.store = store
+        self.sessions = sessions
+        self.spool = spool
     
     def crawl_tweets(self, query: str, lang: str, count: Union[str, int],
-                     until: Union[str, date]):
+                     until: Union[str, date], total: Union[str, int] = None,
+                     resume: bool = True, session_id: str = None,
+                     job: Any = None, priority: int = 0):
         """Method which crawls the tweets which fits the given parameters.
 
+        Results are paged from newest to oldest using `max_id` until `total`
+        tweets have been retrieved or there are no more results. Each page is
+        saved to the database as soon as it is retrieved.
+
         Data is processed, transformed and only certain fields are retrieved:
 
         [ id, created_at, text, lang, coordinates, source, favorite_count,
@@ -67,6 +102,14 @@ class IKEABatchCrawler():
 
         Finally, data is stored to the database defined as a calss atribute.
 
+        If `resume` is True, a checkpoint is kept in the database for every
+        query, so a crawl stopped by `total` continues where it left off, and
+        a crawl which reached the end of the results only fetches the tweets
+        published since then.
+
+        Every tweet is saved with the `session_id` of the crawl, which is the
+        job id when the crawl runs as a job.
+
         Parameters
         ----------
         query: str
@@ -80,49 +123,225 @@ class IKEABatchCrawler():
         until: str | date
             Returns tweets created before the given date. Date should be
             formatted as YYYY-MM-DD.
+        total: str | int
+            The maximum number of results to retrieve. Defaults to a single
+            page.
+        resume: bool
+            Whether to read and update the checkpoint of the query.
+        session_id: str
+            Identifier of the crawl session. Defaults to the job id, or to a
+            new random id.
+        job: BatchJob
+            Job used to report the progress of the crawl and to check whether
+            it has been cancelled, if any.
+        priority: int
+            Priority of the requests of the crawl in the scheduler. Higher
+            ones are sent first.
+
+        Returns
+        -------
+        str
+            Identifier of the crawl session.
         """
-        
-        statuses = self.api.search_tweets(
-            q=query, count=count, lang=lang, until=until
-        )
-
-        output = []
-        for status in statuses:
-            status = status._json
-            
-            tweet = {}
-            tweet['id'] = status['id_str']
-            created_at = dateutil.parser.parse(status['created_at'])
-            tweet['created_at'] = created_at.strftime('%Y-%m-%d %H:%M:%S')
-            if ('extended_tweet' in status
-                    and 'full_text' in status['extended_tweet']):
-                tweet['text'] = status['extended_tweet']['full_text']
-            else:
-                tweet['text'] = status['text']
-            
-            keys = ['lang', 'coordinates', 'source']
-            for key in keys:
-                if status.get(key) != None:
-                    tweet[key] = status[key]
-            keys = ['favorite_count', 'retweet_count', 'quote_count',
-                    'reply_count']
-            for key in keys:
-                if status.get(key) != None:
-                    if 'interactions' not in tweet:
-                        tweet['interactions'] = {}
-                    tweet['interactions'][key] = status[key]
-            tweet['crawler'] = 'batch'
-            output.append(tweet)
-
-        if GOOGLE_CLOUD_PROJECT == "False":
-            self.db[MONGODB_COLLECTION].insert_many(output)
-            ids = [tweet['_id'] for tweet in output if '_id' in tweet]
-        else:
-            gcp_utils.upload_data_to_bq(self.db, output)
-            ids = [tweet['id'] for tweet in output if 'id' in tweet]
-        self.tweet_ids = ids
-        self.count = len(ids)
-        
-        message = "BATCH | {} tweets saved to db.".format(len(output))
+
+        per_page = min(int(count or MAX_PAGE_SIZE), MAX_PAGE_SIZE)
+        priority = int(priority or 0)
+        total = int(total or per_page)
+        key = checkpoint_key(query, lang, until)
+        checkpoint = {}
+        if resume:
+            checkpoint = self._get_checkpoint(key) or {}
+        since_id = checkpoint.get('since_id')
+        max_id = checkpoint.get('max_id')
+        top_id = checkpoint.get('top_id')
+
+        if session_id is None and job is not None:
+            session_id = job.id
+        # Shards of the same crawl share its session
+        if session_id is None or self.sessions.get(session_id) is None:
+            session_id = self.sessions.create(session_id)
+        saved = 0
+        exhausted = False
+        while saved < total:
+            if job is not None:
+                job.check_cancelled()
+            statuses = self._search_page(
+                job, priority, q=query, count=min(per_page, total - saved),
+                lang=lang, until=until, since_id=since_id,
+                max_id=max_id - 1 if max_id else None
+            )
+            if not statuses:
+                exhausted = True
+                break
+            metrics_utils.TWEETS_RECEIVED.labels(crawler='batch').inc(
+                len(statuses))
+
+            transform_seconds = metrics_utils.TRANSFORM_SECONDS.labels(
+                crawler='batch')
+            with transform_seconds.time():
+                output = transform_utils.transform_many(
+                    (status._json for status in statuses), 'batch',
+                    session_id
+                )
+            metrics_utils.TWEETS_TRANSFORMED.labels(crawler='batch').inc(
+                len(output))
+            self._save_tweets(output)
+            saved += len(output)
+
+            ids = [status.id for status in statuses]
+            max_id = min(ids)
+            top_id = top_id or max(ids)
+            if resume:
+                self._save_checkpoint(key, since_id, max_id, top_id)
+            if job is not None:
+                job.pages += 1
+                job.tweets = saved
+
+        if resume and exhausted:
+            self._save_checkpoint(key, top_id or since_id, None, None)
+
+        message = "BATCH | {} tweets saved to db.".format(saved)
         print(message)
-        logging.info(message)
\ No newline at end of file
+        logging.info(message)
+        return session_id
+
+    def _search_page(self, job: Any, priority: int = 0, **params):
+        """Submethod which retrieves a single page of search results.
+
+        If the rate limit has been reached, it waits until the limit window
+        is reset and tries again. The wait is interrupted if the job is
+        cancelled. If a scheduler is set, the request waits for its turn
+        and is sent with the credentials it assigns.
+
+        Parameters
+        ----------
+        job: BatchJob
+            Job used to report rate limit waits, if any.
+        priority: int
+            Priority of the request in the scheduler.
+        params: dict
+            Parameters passed to `tweepy.API.search_tweets`.
+        """
+
+        while True:
+            key, api = None, self.api
+            if self.scheduler is not None:
+                key = self.scheduler.acquire(SEARCH_ENDPOINT, priority, job)
+                api = self.apis[key]
+            try:
+                with metrics_utils.TWITTER_REQUEST_SECONDS.time():
+                    return api.search_tweets(**params)
+            except tweepy.TooManyRequests as e:
+                reset = e.response.headers.get('x-rate-limit-reset')
+                if reset:
+                    seconds = int(reset) - time.time() + 1
+                else:
+                    seconds = RATE_LIMIT_DEFAULT_WAIT
+                if key is not None:
+                    # The response hook has already emptied the bucket,
+                    # unless the headers were missing
+                    if not reset:
+                        self.scheduler.exhaust(SEARCH_ENDPOINT, key,
+                                               time.time() + seconds)
+                    continue
+                self._wait_rate_limit(job, seconds)
+
+    def _wait_rate_limit(self, job: Any, seconds: float):
+        """Submethod which waits until the rate limit window is reset. The
+        wait is interrupted if the job is cancelled.
+
+        Parameters
+        ----------
+        job: BatchJob
+            Job used to report rate limit waits, if any.
+        seconds: float
+            Number of seconds to wait.
+        """
+
+        message = 'BATCH | Rate limit reached, waiting {:.0f}s.'.format(
+            seconds)
+        print(message)
+        logging.warning(message)
+        metrics_utils.RATE_LIMIT_SLEEPS.labels(crawler='batch').inc()
+        metrics_utils.RATE_LIMIT_SLEEP_SECONDS.labels(crawler='batch').inc(
+            max(0, seconds))
+        if job is None:
+            time.sleep(max(0, seconds))
+        else:
+            job.rate_limit_waits += 1
+            job.wait(seconds)
+
+    def _save_tweets(self, output: List[dict]):
+        """Submethod which saves a page of tweets to the database, or appends
+        it to the spool if one is set.
+
+        Parameters
+        ----------
+        output: list[dict]
+            List of JSON-like objects to be saved.
+        """
+
+        if self.spool is not None:
+            self.spool.append(output)
+            metrics_utils.TWEETS_SPOOLED.labels(crawler='batch').inc(
+                len(output))
+            return
+        metrics_utils.record_write('batch', output, self.store.write)
+        self.sessions.record(output)
+
+    def _get_checkpoint(self, key: str):
+        """Submethod which reads the checkpoint of a query.
+
+        Parameters
+        ----------
+        key: str
+            Checkpoint key of the query.
+        """
+
+        return self.store.get_checkpoint(key)
+
+    def _save_checkpoint(self, key: str, since_id: int, max_id: int,
+                         top_id: int):
+        """Submethod which saves the checkpoint of a query.
+
+        Parameters
+        ----------
+        key: str
+            Checkpoint key of the query.
+        since_id: int
+            Every tweet up to this id has already been retrieved.
+        max_id: int
+            Oldest id retrieved by the pass in progress, if any.
+        top_id: int
+            Newest id retrieved by the pass in progress, if any.
+        """
+
+        checkpoint = {'since_id': since_id, 'max_id': max_id, 'top_id': top_id}
+        self.store.save_checkpoint(key, checkpoint)
+
+def checkpoint_key(query: str, lang: str, until: Union[str, date]):
+    """Method which builds the key used to store the checkpoint of a query.
+
+    Parameters
+    ----------
+    query: str
+        Query of terms that the tweets must match.
+    lang: str
+        Language in which the tweets must be written.
+    until: str | date
+        Limit date to retrieve tweets from.
+    """
+
+    return '{}|{}|{}'.format(query, lang or '', until or '')
+
+def credentials_key(access_token: str):
+    """Method which builds the key identifying a set of credentials in the
+    shared rate limit budgets, without revealing the token.
+
+    Parameters
+    ----------
+    access_token: str
+        Access token from Twitter API.
+    """
+
+    return hashlib.sha1(access_token.encode('utf-8')).hexdigest()[:12]
@@ -1,19 +1,25 @@
 import os
-import json
+import time
+import uuid
 import logging
-from typing import Any
+from collections import Counter
+from typing import List, Union
 
 import tweepy
-import dateutil.parser
 
-import utils.gcp_utils as gcp_utils
+import utils.decode_utils as decode_utils
+import utils.metrics_utils as metrics_utils
+import utils.transform_utils as transform_utils
+from modules.StreamBroadcaster import StreamBroadcaster
+from modules.StreamQueue import StreamQueue
+from modules.StreamStats import StreamStats
 
-MONGODB_COLLECTION = os.environ.get('MONGODB_COLLECTION')
-GOOGLE_CLOUD_PROJECT = os.environ.get('GOOGLE_CLOUD_PROJECT')
+STREAM_DRAIN_TIMEOUT = float(os.environ.get('STREAM_DRAIN_TIMEOUT', 30))
 
 class IKEAStreamingCrawler(tweepy.Stream):
     """
-    Class used to crawl streaming data from Twitter API.
+    Class used to crawl streaming data from Twitter API. Tweets are decoded
+    and transformed, and handed to the router, which saves them.
 
     Extends
     -------
@@ -21,88 +27,152 @@ class IKEAStreamingCrawler(tweepy.Stream):
 
     Attributes
     ----------
-    db: pymongo.database.Database | google.cloud.bigquery.Client
-        Database object used to save the results.
-    tweet_ids: list
-        List contaning the tweet ids which have been collected.
-    count: int
-        Counter with the quantity of tweets collected.
+    session_id: str
+        Identifier of the current connection session.
+    notices: collections.Counter
+        Number of control messages received in the current session, by kind.
+    undelivered: int
+        Number of matching tweets not delivered in the current session due
+        to rate limits, as reported by the limit notices.
+    queue: StreamQueue
+        Bounded queue holding the raw messages until a worker processes them.
+    stats: StreamStats
+        Rolling statistics of the tweets received in the current session.
+    events: StreamBroadcaster
+        Live feed of the tweets saved, pushed to the dashboard.
+    router: Callable[[dict, dict], Any]
+        Function the transformed and raw tweets are handed to, such as
+        `StreamManager.route`. Tweets are dropped until it is set.
 
     Methods
     -------
-    crawl_tweets(self, query: str, lang: str, count: str, until: str)
-        Method which crawls the tweets which fits the given parameters.
+    start_session(self)
+        Method which starts a new stream session and returns its id.
+    on_data(self, raw_data: str)
+        Method which runs whenever a new tweet reachs the stream.
+    process_data(self, raw_data: str)
+        Method which processes a raw message taken from the queue.
+    on_notice(self, kind: str, message: dict)
+        Method which runs whenever a control message reachs the stream.
+    publish(self, tweets: list[dict])
+        Method which publishes a batch of saved tweets to the live feed.
     """
 
-    def __init__(self, db: Any, *args, **kw):
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self.session_id = None
+        self.notices = Counter()
+        self.undelivered = 0
+        self.queue = StreamQueue(self.process_data)
+        self.stats = StreamStats()
+        self.events = StreamBroadcaster()
+        self.router = None
+
+    def start_session(self):
         """
-        Parameters
-        ----------
-        db: pymongo.database.Database | google.cloud.bigquery.Client
-            Database object used to save the results.
+        Method which starts a new stream session and returns its id. It must
+        be called before opening a new stream connection.
         """
 
-        super().__init__(*args, **kw)
-        self.db = db
-        self.tweet_ids = []
-        self.count = 0
+        self.session_id = uuid.uuid4().hex
+        self.notices = Counter()
+        self.undelivered = 0
+        self.stats.reset()
+        return self.session_id
     
-    def on_data(self, raw_data: str):
+    def on_data(self, raw_data: Union[str, bytes]):
         """Method which runs whenever a new tweet reachs the stream.
 
+        The stream thread only puts the raw message in the queue, so a slow
+        database does not stall the connection. Messages are processed by
+        the queue workers through `process_data`.
+
+        Parameters
+        ----------
+        raw_data: str | bytes
+            JSON-like object containing the tweet data.
+        """
+
+        self.queue.put(raw_data)
+
+    def process_data(self, raw_data: Union[str, bytes]):
+        """Method which processes a raw message taken from the queue.
+
         Data is processed, transformed and only certain fields are retrieved:
 
         [ id, created_at, text, lang, coordinates, source, favorite_count,
           retweet_count, quote_count, reply_count ]
 
-        Finally, data is stored to the database defined as a class atribute.
+        Finally, data is added to the rolling statistics and handed to the
+        router, along with the raw tweet.
 
         Parameters
         ----------
-        raw_data: str
-            JSON-like object containing the tweet data.
+        raw_data: str | bytes
+            JSON-like object containing the tweet data. Keep-alives and
+            control messages are detected before decoding the payload, and
+            handed to `on_notice`.
         """
 
-        tweet = json.loads(raw_data)
-        
-        output = {}
-        output['id'] = tweet['id_str']
-        created_at = dateutil.parser.parse(tweet['created_at'])
-        output['created_at'] = created_at.strftime('%Y-%m-%d %H:%M:%S')
-        if ('extended_tweet' in tweet
-                and 'full_text' in tweet['extended_tweet']):
-            output['text'] = tweet['extended_tweet']['full_text']
-        else:
-            output['text'] = tweet['text']
-        
-        keys = ['lang', 'coordinates', 'source']
-        for key in keys:
-            if tweet.get(key) != None:
-                output[key] = tweet[key]
-        keys = ['favorite_count', 'retweet_count', 'quote_count',
-                    'reply_count']
-        for key in keys:
-            if tweet.get(key) != None:
-                if 'interactions' not in output:
-                    output['interactions'] = {}
-                output['interactions'][key] = tweet[key]
-        output['crawler'] = 'streaming'
-        
-        if GOOGLE_CLOUD_PROJECT == "False":
-            self.db[MONGODB_COLLECTION].insert_one(output)
-            id = output.get('_id', '')
+        start = time.perf_counter()
+        kind = decode_utils.classify(raw_data)
+        if kind == decode_utils.KEEP_ALIVE:
+            metrics_utils.STREAM_MESSAGES.labels(kind=kind).inc()
+            return
+        if kind == decode_utils.TWEET:
+            tweet = decode_utils.loads(raw_data)
         else:
-            gcp_utils.upload_data_to_bq(self.db, [output])
-            id = output.get('id', '')
+            message = decode_utils.loads(raw_data)
+            if kind == decode_utils.UNKNOWN and 'id_str' in message:
+                tweet = message
+            else:
+                metrics_utils.STREAM_MESSAGES.labels(kind=kind).inc()
+                self.on_notice(kind, message)
+                return
+        decoded = time.perf_counter()
+        metrics_utils.DECODE_SECONDS.observe(decoded - start)
+        metrics_utils.STREAM_MESSAGES.labels(kind=decode_utils.TWEET).inc()
+        metrics_utils.TWEETS_RECEIVED.labels(crawler='streaming').inc()
+
+        output = transform_utils.transform(tweet, 'streaming', self.session_id)
+        metrics_utils.TRANSFORM_SECONDS.labels(crawler='streaming').observe(
+            time.perf_counter() - decoded)
+        metrics_utils.TWEETS_TRANSFORMED.labels(crawler='streaming').inc()
+        self.stats.record(output)
+        if self.router is not None:
+            self.router(output, tweet)
+
+    def on_notice(self, kind: str, message: dict):
+        """Method which runs whenever a control message reachs the stream.
+
+        Limit notices carry the total number of undelivered tweets since the
+        connection was opened, which is kept in `undelivered`.
+
+        Parameters
+        ----------
+        kind: str
+            Kind of control message, such as 'limit' or 'delete'.
+        message: dict
+            Decoded control message.
+        """
+
+        self.notices[kind] += 1
+        if kind == 'limit':
+            track = message['limit'].get('track', 0)
+            self.undelivered = max(self.undelivered, track)
+
+    def publish(self, tweets: List[dict]):
+        """Method which publishes a batch of saved tweets to the live feed.
+
+        Parameters
+        ----------
+        tweets: list[dict]
+            List of JSON-like objects which have been saved.
+        """
+
+        for tweet in tweets:
+            self.events.publish('tweet', tweet)
 
-        if id:
-            self.tweet_ids.append(id)
-            self.count += 1
-        
-        message = "STREAMING | Tweet '{}' saved to db.".format(str(id))
-        print(message)
-        logging.info(message)
-        
     def on_connect(self):
         """
         Method which runs whenever a new streaming connection is created.
@@ -115,8 +185,16 @@ class IKEAStreamingCrawler(tweepy.Stream):
     def on_disconnect(self):
         """
         Method which runs whenever a new streaming connection is closed.
+
+        Queued messages are processed, so they are routed before a new
+        connection is opened.
         """
 
+        try:
+            self.queue.drain(STREAM_DRAIN_TIMEOUT)
+        except Exception as e:
+            self.on_exception(e)
+
         message = 'STREAMING | IKEAStreamingCrawler disconnected.'
         print(message)
         logging.info(message)
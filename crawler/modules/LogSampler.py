@@ -0,0 +1,101 @@
+import os
+import time
+import logging
+import threading
+
+LOG_SAMPLE_INTERVAL = float(os.environ.get('LOG_SAMPLE_INTERVAL', 10))
+
+class LogSampler():
+    """
+    Class used to aggregate a frequent log message, so it is written at most
+    once every `interval` seconds instead of once per event.
+
+    The first event is logged right away. The following ones are counted,
+    and the next message logged after the interval reports how many events
+    happened since the previous one.
+
+    Attributes
+    ----------
+    interval: float
+        Minimum number of seconds between two messages.
+
+    Methods
+    -------
+    log(self, level: int, message: str, count: int, *args)
+        Method which counts an event and logs it if the interval has passed.
+    flush(self, level: int, message: str, *args)
+        Method which logs the events counted since the last message, if any.
+    """
+
+    def __init__(self, interval: float = LOG_SAMPLE_INTERVAL):
+        """
+        Parameters
+        ----------
+        interval: float
+            Minimum number of seconds between two messages.
+        """
+
+        self.interval = interval
+        self._count = 0
+        self._logged_at = None
+        self._lock = threading.Lock()
+
+    def log(self, level: int, message: str, count: int = 1, *args):
+        """Method which counts an event and logs it if the interval has
+        passed since the previous message.
+
+        Parameters
+        ----------
+        level: int
+            Logging level, such as `logging.INFO`.
+        message: str
+            Message, formatted with the number of events counted since the
+            previous message followed by `args`.
+        count: int
+            Number of events to count.
+        args: tuple
+            Additional values the message is formatted with.
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            self._count += count
+            if (self._logged_at is not None
+                    and now - self._logged_at < self.interval):
+                return
+            total, self._count, self._logged_at = self._count, 0, now
+        self._write(level, message.format(total, *args))
+
+    def flush(self, level: int, message: str, *args):
+        """Method which logs the events counted since the last message, if
+        any, regardless of the interval.
+
+        Parameters
+        ----------
+        level: int
+            Logging level, such as `logging.INFO`.
+        message: str
+            Message, formatted as in `log`.
+        args: tuple
+            Additional values the message is formatted with.
+        """
+
+        with self._lock:
+            total, self._count = self._count, 0
+            self._logged_at = time.monotonic()
+        if total:
+            self._write(level, message.format(total, *args))
+
+    def _write(self, level: int, message: str):
+        """Submethod which prints and logs a message.
+
+        Parameters
+        ----------
+        level: int
+            Logging level.
+        message: str
+            Message to write.
+        """
+
+        print(message)
+        logging.log(level, message)
@@ -0,0 +1,304 @@
+import os
+import time
+import heapq
+import logging
+import itertools
+import threading
+from typing import Any, Dict
+from urllib.parse import urlparse
+
+import utils.metrics_utils as metrics_utils
+from modules.SharedState import SharedState
+
+SEARCH_ENDPOINT = 'search/tweets'
+# Requests allowed per window with user auth, until reported by Twitter
+SEARCH_RATE_LIMIT = int(os.environ.get('SEARCH_RATE_LIMIT', 180))
+DEFAULT_RATE_LIMIT = 15
+RATE_LIMIT_WINDOW = float(os.environ.get('RATE_LIMIT_WINDOW', 15 * 60))
+RATE_LIMIT_POLL_INTERVAL = float(
+    os.environ.get('RATE_LIMIT_POLL_INTERVAL', 1))
+
+class RateLimitScheduler():
+    """
+    Class used to schedule the requests of every batch crawl within the rate
+    limits of several sets of credentials.
+
+    Each endpoint and set of credentials has a token bucket, kept in the
+    shared state so every process and thread draws from the same budget. It
+    holds the requests left in the current window, and is refilled when the
+    window is reset. The `x-rate-limit-*` headers of every response are
+    read by a hook of the API session, and overwrite the bucket with the
+    budget reported by Twitter.
+
+    Requests wait in a queue for each endpoint, ordered by priority and then
+    by arrival. Only the first one takes tokens, from the next set of
+    credentials with budget left, so a crawl with higher priority is served
+    first once the window is reset, and crawls of the same priority take
+    turns instead of sleeping blindly.
+
+    Attributes
+    ----------
+    state: SharedState
+        Shared state where the token buckets are kept.
+    keys: list[str]
+        Identifiers of the sets of credentials.
+    limits: dict[str, int]
+        Requests allowed per window, by endpoint.
+    window: float
+        Length of the window in seconds.
+    poll_interval: float
+        Maximum number of seconds between two checks of a waiting request.
+
+    Methods
+    -------
+    acquire(self, endpoint: str, priority: int, job: BatchJob)
+        Method which waits for its turn and a token, and returns the set of
+        credentials to send the request with.
+    exhaust(self, endpoint: str, key: str, reset_at: float)
+        Method which empties a bucket until the given time.
+    status(self)
+        Method which reports the budget left and when the next one is
+        available, by endpoint and set of credentials.
+    """
+
+    def __init__(self, state: SharedState, apis: Dict[str, Any],
+                 window: float = RATE_LIMIT_WINDOW,
+                 poll_interval: float = RATE_LIMIT_POLL_INTERVAL):
+        """
+        Parameters
+        ----------
+        state: SharedState
+            Shared state where the token buckets are kept.
+        apis: dict[str, tweepy.API]
+            Twitter API objects of every set of credentials, by key. A hook
+            is added to their sessions to read the rate limit headers.
+        window: float
+            Length of the window in seconds.
+        poll_interval: float
+            Maximum number of seconds between two checks of a waiting
+            request.
+        """
+
+        self.state = state
+        self.keys = list(apis)
+        self.limits = {SEARCH_ENDPOINT: SEARCH_RATE_LIMIT}
+        self.window = window
+        self.poll_interval = poll_interval
+        self._queues = {}
+        self._next = {}
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        for key, api in apis.items():
+            api.session.hooks['response'].append(self._hook(key))
+
+    @property
+    def queued(self):
+        with self._cond:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def acquire(self, endpoint: str, priority: int = 0, job: Any = None):
+        """Method which waits for its turn and a token, and returns the set
+        of credentials to send the request with.
+
+        Parameters
+        ----------
+        endpoint: str
+            Endpoint of the request, such as 'search/tweets'.
+        priority: int
+            Priority of the request. Higher ones are served first.
+        job: BatchJob
+            Job used to report rate limit waits and to check whether it has
+            been cancelled, if any. If so, BatchJobCancelled is raised.
+
+        Returns
+        -------
+        str
+            Identifier of the set of credentials.
+        """
+
+        ticket = (-priority, next(self._counter))
+        with self._cond:
+            heapq.heappush(self._queues.setdefault(endpoint, []), ticket)
+        waiting_since = None
+        try:
+            while True:
+                with self._cond:
+                    first = self._queues[endpoint][0] == ticket
+                wait = self.poll_interval
+                if first:
+                    key, wait = self._take(endpoint)
+                    if key is not None:
+                        return key
+                    if waiting_since is None:
+                        waiting_since = time.monotonic()
+                        self._report_wait(endpoint, wait, job)
+                if job is not None:
+                    job.check_cancelled()
+                with self._cond:
+                    self._cond.wait(min(wait, self.poll_interval))
+        finally:
+            with self._cond:
+                queue = self._queues[endpoint]
+                queue.remove(ticket)
+                heapq.heapify(queue)
+                self._cond.notify_all()
+            if waiting_since is not None:
+                metrics_utils.RATE_LIMIT_SLEEP_SECONDS.labels(
+                    crawler='batch').inc(time.monotonic() - waiting_since)
+
+    def exhaust(self, endpoint: str, key: str, reset_at: float):
+        """Method which empties a bucket until the given time, such as when
+        the limit was reached without the response reporting it.
+
+        Parameters
+        ----------
+        endpoint: str
+            Endpoint of the bucket.
+        key: str
+            Identifier of the set of credentials.
+        reset_at: float
+            Timestamp when the window is reset.
+        """
+
+        self.state.update_rate_limit(self._bucket(endpoint, key), 0, reset_at)
+
+    def status(self):
+        """
+        Method which reports, by endpoint, the number of requests waiting,
+        the budget left and when the next request can be sent, overall and
+        for each set of credentials. Times are timestamps.
+        """
+
+        now = time.time()
+        with self._cond:
+            queued = {endpoint: len(queue)
+                      for endpoint, queue in self._queues.items()}
+        report = {}
+        for endpoint in sorted(set(self.limits) | set(queued)):
+            limit = self.limits.get(endpoint, DEFAULT_RATE_LIMIT)
+            credentials = {}
+            for key in self.keys:
+                budget = self.state.get_rate_limit(self._bucket(endpoint, key))
+                if budget is None or budget['reset_at'] <= now:
+                    budget = {'remaining': limit, 'reset_at': None}
+                budget['available_at'] = (
+                    now if budget['remaining'] > 0 else budget['reset_at'])
+                credentials[key] = budget
+            report[endpoint] = {
+                'limit': limit,
+                'queued': queued.get(endpoint, 0),
+                'remaining': sum(budget['remaining']
+                                 for budget in credentials.values()),
+                'available_at': min(budget['available_at']
+                                    for budget in credentials.values()),
+                'credentials': credentials
+            }
+        return report
+
+    def _take(self, endpoint: str):
+        """Submethod which takes a token from the next set of credentials
+        with budget left.
+
+        Parameters
+        ----------
+        endpoint: str
+            Endpoint of the request.
+
+        Returns
+        -------
+        tuple[str, float]
+            Identifier of the set of credentials and 0, or None and the
+            seconds until the first bucket is refilled.
+        """
+
+        with self._cond:
+            start = self._next.get(endpoint, 0)
+            self._next[endpoint] = (start + 1) % len(self.keys)
+        limit = self.limits.get(endpoint, DEFAULT_RATE_LIMIT)
+        waits = []
+        for i in range(len(self.keys)):
+            key = self.keys[(start + i) % len(self.keys)]
+            wait = self.state.take_rate_limit(
+                self._bucket(endpoint, key), limit, self.window)
+            if wait <= 0:
+                return key, 0
+            waits.append(wait)
+        return None, min(waits)
+
+    def _hook(self, key: str):
+        """Submethod which builds the response hook of a set of credentials,
+        which overwrites its bucket with the budget reported by Twitter.
+
+        Parameters
+        ----------
+        key: str
+            Identifier of the set of credentials.
+        """
+
+        def hook(response, *args, **kw):
+            headers = response.headers
+            if 'x-rate-limit-remaining' not in headers:
+                return
+            try:
+                endpoint = self._endpoint(response.url)
+                if 'x-rate-limit-limit' in headers:
+                    self.limits[endpoint] = int(headers['x-rate-limit-limit'])
+                self.state.update_rate_limit(
+                    self._bucket(endpoint, key),
+                    int(headers['x-rate-limit-remaining']),
+                    float(headers['x-rate-limit-reset']))
+            except Exception as e:
+                message = 'BATCH | Rate limit headers not read: {}'.format(e)
+                print(message)
+                logging.error(message)
+
+        return hook
+
+    def _report_wait(self, endpoint: str, seconds: float, job: Any):
+        """Submethod which logs and counts a wait for the rate limit.
+
+        Parameters
+        ----------
+        endpoint: str
+            Endpoint of the request.
+        seconds: float
+            Seconds until the first bucket is refilled.
+        job: BatchJob
+            Job waiting, if any.
+        """
+
+        message = 'BATCH | Rate limit of {} reached, waiting {:.0f}s.'.format(
+            endpoint, seconds)
+        print(message)
+        logging.warning(message)
+        metrics_utils.RATE_LIMIT_SLEEPS.labels(crawler='batch').inc()
+        if job is not None:
+            job.rate_limit_waits += 1
+
+    def _bucket(self, endpoint: str, key: str):
+        """Submethod which builds the identifier of the bucket of an
+        endpoint and set of credentials.
+
+        Parameters
+        ----------
+        endpoint: str
+            Endpoint of the bucket.
+        key: str
+            Identifier of the set of credentials.
+        """
+
+        return '{}|{}'.format(endpoint, key)
+
+    def _endpoint(self, url: str):
+        """Submethod which extracts the endpoint from the URL of a request,
+        such as 'search/tweets' from '/1.1/search/tweets.json'.
+
+        Parameters
+        ----------
+        url: str
+            URL of the request.
+        """
+
+        path = urlparse(url).path
+        path = path.split('/', 2)[-1]
+        return path[:-len('.json')] if path.endswith('.json') else path
@@ -0,0 +1,471 @@
+import time
+import copy
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, List
+
+import utils.mongo_utils as mongo_utils
+import utils.sqlite_utils as sqlite_utils
+
+class SharedState(ABC):
+    """
+    Class used as the interface of the state shared by every crawler process,
+    so several gunicorn workers or containers can coordinate through the
+    database instead of process memory: the named streams, the leases, the
+    work queue of the sharded batch crawls and the rate limit budgets.
+
+    Leases rely on the clocks of the processes being roughly in sync.
+
+    Methods
+    -------
+    get_streams(self)
+        Method which retrieves every stream definition with its counters.
+    get_stream(self, name: str)
+        Method which retrieves a stream definition with its counters.
+    save_stream(self, stream: dict)
+        Method which stores a stream definition, keeping its counters.
+    save_stream_counters(self, name: str, counters: dict)
+        Method which stores the counters of a stream.
+    acquire_lease(self, name: str, owner: str, ttl: float)
+        Method which takes or renews a lease and returns whether it is held.
+    release_lease(self, name: str, owner: str)
+        Method which releases a lease, if `owner` holds it.
+    get_lease(self, name: str)
+        Method which retrieves the holder of a lease, if it has not expired.
+    save_crawl(self, crawl: dict)
+        Method which stores a sharded batch crawl.
+    get_crawl(self, crawl_id: str)
+        Method which retrieves a sharded batch crawl.
+    get_crawls(self, limit: int)
+        Method which retrieves the latest sharded batch crawls.
+    add_shards(self, shards: list[dict])
+        Method which puts the shards of a crawl on the work queue.
+    get_shards(self, crawl_id: str)
+        Method which retrieves the shards of a crawl.
+    claim_shard(self, owner: str, ttl: float)
+        Method which leases the next queued or abandoned shard to `owner`.
+    update_shard(self, shard_id: str, owner: str, fields: dict, ttl: float)
+        Method which updates a running shard, if `owner` still holds it.
+    cancel_shards(self, crawl_id: str)
+        Method which cancels the queued and running shards of a crawl.
+    take_rate_limit(self, key: str, limit: int, window: float)
+        Method which takes a request from a rate limit budget and returns 0,
+        or the seconds until it is reset.
+    update_rate_limit(self, key: str, remaining: int, reset_at: float)
+        Method which overwrites a rate limit budget.
+    get_rate_limit(self, key: str)
+        Method which retrieves a rate limit budget.
+    """
+
+    name = None
+
+    @abstractmethod
+    def get_streams(self) -> List[dict]:
+        pass
+
+    @abstractmethod
+    def get_stream(self, name: str) -> dict:
+        pass
+
+    @abstractmethod
+    def save_stream(self, stream: dict):
+        pass
+
+    @abstractmethod
+    def save_stream_counters(self, name: str, counters: dict):
+        pass
+
+    @abstractmethod
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        pass
+
+    @abstractmethod
+    def release_lease(self, name: str, owner: str):
+        pass
+
+    @abstractmethod
+    def get_lease(self, name: str) -> dict:
+        pass
+
+    @abstractmethod
+    def save_crawl(self, crawl: dict):
+        pass
+
+    @abstractmethod
+    def get_crawl(self, crawl_id: str) -> dict:
+        pass
+
+    @abstractmethod
+    def get_crawls(self, limit: int) -> List[dict]:
+        pass
+
+    @abstractmethod
+    def add_shards(self, shards: List[dict]):
+        pass
+
+    @abstractmethod
+    def get_shards(self, crawl_id: str) -> List[dict]:
+        pass
+
+    @abstractmethod
+    def claim_shard(self, owner: str, ttl: float) -> dict:
+        pass
+
+    @abstractmethod
+    def update_shard(self, shard_id: str, owner: str, fields: dict,
+                     ttl: float = None) -> bool:
+        pass
+
+    @abstractmethod
+    def cancel_shards(self, crawl_id: str):
+        pass
+
+    @abstractmethod
+    def take_rate_limit(self, key: str, limit: int, window: float) -> float:
+        pass
+
+    @abstractmethod
+    def update_rate_limit(self, key: str, remaining: int, reset_at: float):
+        pass
+
+    @abstractmethod
+    def get_rate_limit(self, key: str) -> dict:
+        pass
+
+class MemorySharedState(SharedState):
+    """
+    Class used to keep the shared state in process memory, for deployments
+    with a single process and no MongoDB nor SQLite store, such as BigQuery
+    on App Engine.
+    """
+
+    name = 'memory'
+
+    def __init__(self):
+        self._streams = {}
+        self._counters = {}
+        self._leases = {}
+        self._crawls = {}
+        self._shards = {}
+        self._rate_limits = {}
+        self._lock = threading.Lock()
+
+    def get_streams(self):
+        with self._lock:
+            return [self._to_stream(name) for name in sorted(self._streams)]
+
+    def get_stream(self, name: str):
+        with self._lock:
+            return self._to_stream(name) if name in self._streams else None
+
+    def save_stream(self, stream: dict):
+        stream = {key: value for key, value in stream.items()
+                  if key != 'counters'}
+        with self._lock:
+            self._streams[stream['name']] = copy.deepcopy(stream)
+
+    def save_stream_counters(self, name: str, counters: dict):
+        with self._lock:
+            if name in self._streams:
+                self._counters[name] = dict(counters)
+
+    def acquire_lease(self, name: str, owner: str, ttl: float):
+        now = time.time()
+        with self._lock:
+            lease = self._leases.get(name)
+            if (lease is None or lease['owner'] == owner
+                    or lease['expires_at'] < now):
+                self._leases[name] = {'owner': owner, 'expires_at': now + ttl}
+                return True
+            return False
+
+    def release_lease(self, name: str, owner: str):
+        with self._lock:
+            lease = self._leases.get(name)
+            if lease is not None and lease['owner'] == owner:
+                del self._leases[name]
+
+    def get_lease(self, name: str):
+        with self._lock:
+            lease = self._leases.get(name)
+            if lease is None or lease['expires_at'] < time.time():
+                return None
+            return dict(lease)
+
+    def save_crawl(self, crawl: dict):
+        with self._lock:
+            self._crawls[crawl['id']] = copy.deepcopy(crawl)
+
+    def get_crawl(self, crawl_id: str):
+        with self._lock:
+            return copy.deepcopy(self._crawls.get(crawl_id))
+
+    def get_crawls(self, limit: int):
+        with self._lock:
+            crawls = sorted(self._crawls.values(),
+                            key=lambda crawl: crawl['created_at'],
+                            reverse=True)
+            return copy.deepcopy(crawls[:limit])
+
+    def add_shards(self, shards: List[dict]):
+        with self._lock:
+            for shard in shards:
+                self._shards[shard['id']] = dict(
+                    copy.deepcopy(shard), updated_at=shard['created_at'])
+
+    def get_shards(self, crawl_id: str):
+        with self._lock:
+            shards = [shard for shard in self._shards.values()
+                      if shard['crawl_id'] == crawl_id]
+            return copy.deepcopy(sorted(shards,
+                                        key=lambda shard: shard['position']))
+
+    def claim_shard(self, owner: str, ttl: float):
+        now = time.time()
+        with self._lock:
+            claimable = [shard for shard in self._shards.values()
+                         if shard['status'] == 'queued'
+                         or (shard['status'] == 'running'
+                             and shard['expires_at'] < now)]
+            if not claimable:
+                return None
+            shard = min(claimable, key=lambda shard: (shard['created_at'],
+                                                      shard['position']))
+            shard.update(status='running', owner=owner, expires_at=now + ttl,
+                         attempts=shard['attempts'] + 1, updated_at=now)
+            return copy.deepcopy(shard)
+
+    def update_shard(self, shard_id: str, owner: str, fields: dict,
+                     ttl: float = None):
+        now = time.time()
+        with self._lock:
+            shard = self._shards.get(shard_id)
+            if (shard is None or shard['owner'] != owner
+                    or shard['status'] != 'running'):
+                return False
+            shard.update(fields, updated_at=now)
+            if ttl is not None:
+                shard['expires_at'] = now + ttl
+            return True
+
+    def cancel_shards(self, crawl_id: str):
+        with self._lock:
+            for shard in self._shards.values():
+                if (shard['crawl_id'] == crawl_id
+                        and shard['status'] in ('queued', 'running')):
+                    shard.update(status='cancelled', updated_at=time.time())
+
+    def take_rate_limit(self, key: str, limit: int, window: float):
+        now = time.time()
+        with self._lock:
+            budget = self._rate_limits.get(key)
+            if budget is None or budget['reset_at'] <= now:
+                self._rate_limits[key] = {'remaining': limit - 1,
+                                          'reset_at': now + window}
+                return 0
+            if budget['remaining'] > 0:
+                budget['remaining'] -= 1
+                return 0
+            return budget['reset_at'] - now
+
+    def update_rate_limit(self, key: str, remaining: int, reset_at: float):
+        with self._lock:
+            self._rate_limits[key] = {'remaining': remaining,
+                                      'reset_at': reset_at}
+
+    def get_rate_limit(self, key: str):
+        with self._lock:
+            budget = self._rate_limits.get(key)
+            return dict(budget) if budget is not None else None
+
+    def _to_stream(self, name: str):
+        """Submethod which returns a copy of a stream definition with its
+        counters. It must be called while holding the lock.
+
+        Parameters
+        ----------
+        name: str
+            Name of the stream.
+        """
+
+        stream = copy.deepcopy(self._streams[name])
+        stream['counters'] = dict(self._counters.get(name, {}))
+        return stream
+
+class MongoSharedState(SharedState):
+    """
+    Class used to keep the shared state in MongoDB collections, which every
+    crawler container can reach.
+
+    Attributes
+    ----------
+    db: pymongo.database.Database
+        Database object used to keep the state.
+    """
+
+    name = 'mongo'
+
+    def __init__(self, db: Any):
+        """
+        Parameters
+        ----------
+        db: pymongo.database.Database
+            Database object used to keep the state.
+        """
+
+        self.db = db
+
+    def get_streams(self):
+        return mongo_utils.get_streams(self.db)
+
+    def get_stream(self, name: str):
+        return mongo_utils.get_stream(self.db, name)
+
+    def save_stream(self, stream: dict):
+        mongo_utils.save_stream(self.db, stream)
+
+    def save_stream_counters(self, name: str, counters: dict):
+        mongo_utils.save_stream_counters(self.db, name, counters)
+
+    def acquire_lease(self, name: str, owner: str, ttl: float):
+        return mongo_utils.acquire_lease(self.db, name, owner, ttl)
+
+    def release_lease(self, name: str, owner: str):
+        mongo_utils.release_lease(self.db, name, owner)
+
+    def get_lease(self, name: str):
+        return mongo_utils.get_lease(self.db, name)
+
+    def save_crawl(self, crawl: dict):
+        mongo_utils.save_crawl(self.db, crawl)
+
+    def get_crawl(self, crawl_id: str):
+        return mongo_utils.get_crawl(self.db, crawl_id)
+
+    def get_crawls(self, limit: int):
+        return mongo_utils.get_crawls(self.db, limit)
+
+    def add_shards(self, shards: List[dict]):
+        mongo_utils.add_shards(self.db, shards)
+
+    def get_shards(self, crawl_id: str):
+        return mongo_utils.get_shards(self.db, crawl_id)
+
+    def claim_shard(self, owner: str, ttl: float):
+        return mongo_utils.claim_shard(self.db, owner, ttl)
+
+    def update_shard(self, shard_id: str, owner: str, fields: dict,
+                     ttl: float = None):
+        return mongo_utils.update_shard(self.db, shard_id, owner, fields, ttl)
+
+    def cancel_shards(self, crawl_id: str):
+        mongo_utils.cancel_shards(self.db, crawl_id)
+
+    def take_rate_limit(self, key: str, limit: int, window: float):
+        return mongo_utils.take_rate_limit(self.db, key, limit, window)
+
+    def update_rate_limit(self, key: str, remaining: int, reset_at: float):
+        mongo_utils.update_rate_limit(self.db, key, remaining, reset_at)
+
+    def get_rate_limit(self, key: str):
+        return mongo_utils.get_rate_limit(self.db, key)
+
+class SQLiteSharedState(SharedState):
+    """
+    Class used to keep the shared state in a SQLite database, which every
+    process of the same host can open. It uses its own connection, so it
+    does not wait for the tweet writes.
+
+    Attributes
+    ----------
+    path: str
+        Path of the database file.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path: str = sqlite_utils.SQLITE_PATH):
+        """
+        Parameters
+        ----------
+        path: str
+            Path of the database file.
+        """
+
+        self.path = path
+        self.db = sqlite_utils.connect(path)
+        self._lock = threading.Lock()
+
+    def get_streams(self):
+        with self._lock:
+            return sqlite_utils.get_streams(self.db)
+
+    def get_stream(self, name: str):
+        with self._lock:
+            return sqlite_utils.get_stream(self.db, name)
+
+    def save_stream(self, stream: dict):
+        with self._lock:
+            sqlite_utils.save_stream(self.db, stream)
+
+    def save_stream_counters(self, name: str, counters: dict):
+        with self._lock:
+            sqlite_utils.save_stream_counters(self.db, name, counters)
+
+    def acquire_lease(self, name: str, owner: str, ttl: float):
+        with self._lock:
+            return sqlite_utils.acquire_lease(self.db, name, owner, ttl)
+
+    def release_lease(self, name: str, owner: str):
+        with self._lock:
+            sqlite_utils.release_lease(self.db, name, owner)
+
+    def get_lease(self, name: str):
+        with self._lock:
+            return sqlite_utils.get_lease(self.db, name)
+
+    def save_crawl(self, crawl: dict):
+        with self._lock:
+            sqlite_utils.save_crawl(self.db, crawl)
+
+    def get_crawl(self, crawl_id: str):
+        with self._lock:
+            return sqlite_utils.get_crawl(self.db, crawl_id)
+
+    def get_crawls(self, limit: int):
+        with self._lock:
+            return sqlite_utils.get_crawls(self.db, limit)
+
+    def add_shards(self, shards: List[dict]):
+        with self._lock:
+            sqlite_utils.add_shards(self.db, shards)
+
+    def get_shards(self, crawl_id: str):
+        with self._lock:
+            return sqlite_utils.get_shards(self.db, crawl_id)
+
+    def claim_shard(self, owner: str, ttl: float):
+        with self._lock:
+            return sqlite_utils.claim_shard(self.db, owner, ttl)
+
+    def update_shard(self, shard_id: str, owner: str, fields: dict,
+                     ttl: float = None):
+        with self._lock:
+            return sqlite_utils.update_shard(self.db, shard_id, owner, fields,
+                                             ttl)
+
+    def cancel_shards(self, crawl_id: str):
+        with self._lock:
+            sqlite_utils.cancel_shards(self.db, crawl_id)
+
+    def take_rate_limit(self, key: str, limit: int, window: float):
+        with self._lock:
+            return sqlite_utils.take_rate_limit(self.db, key, limit, window)
+
+    def update_rate_limit(self, key: str, remaining: int, reset_at: float):
+        with self._lock:
+            sqlite_utils.update_rate_limit(self.db, key, remaining, reset_at)
+
+    def get_rate_limit(self, key: str):
+        with self._lock:
+            return sqlite_utils.get_rate_limit(self.db, key)
@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import queue
+import threading
+from typing import Callable, Iterator
+
+SSE_MAX_SUBSCRIBERS = int(os.environ.get('SSE_MAX_SUBSCRIBERS', 4))
+SSE_QUEUE_SIZE = int(os.environ.get('SSE_QUEUE_SIZE', 1000))
+SSE_COUNTERS_INTERVAL = float(os.environ.get('SSE_COUNTERS_INTERVAL', 1))
+SSE_BATCH_SIZE = 100
+
+def format_event(event: str, data: dict):
+    """Method which formats a Server-Sent Event.
+
+    Parameters
+    ----------
+    event: str
+        Name of the event.
+    data: dict
+        JSON-like payload of the event.
+    """
+
+    return 'event: {}\ndata: {}\n\n'.format(
+        event, json.dumps(data, default=str))
+
+class StreamBroadcaster():
+    """
+    Class used to fan out the tweets received by the streaming crawler to
+    the clients subscribed to the Server-Sent Events feed.
+
+    Each subscriber has its own bounded queue. If a client does not keep up,
+    its oldest events are discarded, so a slow client never blocks the
+    crawler nor the other clients. Each event is only encoded once,
+    whatever the number of subscribers.
+
+    Attributes
+    ----------
+    max_subscribers: int
+        Maximum number of simultaneous subscribers. Each one holds a server
+        thread while connected.
+    queue_size: int
+        Maximum number of events queued per subscriber.
+
+    Methods
+    -------
+    subscribe(self)
+        Method which registers a new subscriber.
+    unsubscribe(self, subscriber: queue.Queue)
+        Method which removes a subscriber.
+    publish(self, event: str, data: dict)
+        Method which sends an event to every subscriber.
+    stream(self, subscriber: queue.Queue, counters: Callable[[], dict])
+        Method which yields the events of a subscriber as a SSE stream.
+    """
+
+    def __init__(self, max_subscribers: int = SSE_MAX_SUBSCRIBERS,
+                 queue_size: int = SSE_QUEUE_SIZE):
+        """
+        Parameters
+        ----------
+        max_subscribers: int
+            Maximum number of simultaneous subscribers.
+        queue_size: int
+            Maximum number of events queued per subscriber.
+        """
+
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        """
+        Method which registers a new subscriber and returns its queue, or
+        None if the maximum number of subscribers has been reached.
+        """
+
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            subscriber = queue.Queue(maxsize=self.queue_size)
+            self._subscribers.append(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber: queue.Queue):
+        """Method which removes a subscriber.
+
+        Parameters
+        ----------
+        subscriber: queue.Queue
+            Queue returned by `subscribe`.
+        """
+
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    @property
+    def subscribers(self):
+        """
+        Number of connected subscribers.
+        """
+
+        return len(self._subscribers)
+
+    def publish(self, event: str, data: dict):
+        """Method which sends an event to every subscriber.
+
+        Parameters
+        ----------
+        event: str
+            Name of the event.
+        data: dict
+            JSON-like payload of the event.
+        """
+
+        if not self._subscribers:
+            return
+        message = format_event(event, data)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            while True:
+                try:
+                    subscriber.put_nowait(message)
+                    break
+                except queue.Full:
+                    try:
+                        subscriber.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def stream(self, subscriber: queue.Queue, counters: Callable[[], dict],
+               interval: float = SSE_COUNTERS_INTERVAL) -> Iterator[str]:
+        """Method which yields the events of a subscriber as a SSE stream.
+
+        Pending events are sent together as soon as they are available. A
+        `counters` event is sent every `interval` seconds, which also keeps
+        the connection alive while no tweets arrive. The subscriber is
+        removed when the client disconnects.
+
+        Parameters
+        ----------
+        subscriber: queue.Queue
+            Queue returned by `subscribe`.
+        counters: Callable[[], dict]
+            Function which returns the current counters.
+        interval: float
+            Seconds between `counters` events.
+        """
+
+        try:
+            yield 'retry: 1000\n\n'
+            yield format_event('counters', counters())
+            next_counters = time.monotonic() + interval
+            while True:
+                timeout = max(0, next_counters - time.monotonic())
+                messages = []
+                try:
+                    messages.append(subscriber.get(timeout=timeout))
+                    while len(messages) < SSE_BATCH_SIZE:
+                        messages.append(subscriber.get_nowait())
+                except queue.Empty:
+                    pass
+                if time.monotonic() >= next_counters:
+                    messages.append(format_event('counters', counters()))
+                    next_counters = time.monotonic() + interval
+                if messages:
+                    yield ''.join(messages)
+        finally:
+            self.unsubscribe(subscriber)
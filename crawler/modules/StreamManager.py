@@ -0,0 +1,589 @@
+import os
+import time
+import uuid
+import socket
+import logging
+import threading
+from typing import Callable, Dict, List
+
+import utils.metrics_utils as metrics_utils
+import utils.track_utils as track_utils
+from modules.CrawlSessions import CrawlSessions
+from modules.IKEAStreamingCrawler import (IKEAStreamingCrawler,
+                                          STREAM_DRAIN_TIMEOUT)
+from modules.LogSampler import LogSampler
+from modules.SharedState import SharedState
+from modules.TweetSpool import TweetSpool
+from modules.TweetStore import TweetStore
+from modules.TweetWriteBuffer import TweetWriteBuffer
+
+STREAM_LEASE_TTL = float(os.environ.get('STREAM_LEASE_TTL', 30))
+STREAM_SYNC_INTERVAL = float(os.environ.get('STREAM_SYNC_INTERVAL', 5))
+STREAM_CONNECTION_LEASE = 'stream-connection'
+DEFAULT_STREAM = 'default'
+# Stream which keeps the tweets which do not match any stream locally
+STREAM_CATCH_ALL = os.environ.get('STREAM_CATCH_ALL', DEFAULT_STREAM)
+
+class ManagedStream():
+    """
+    Class used to hold the runtime state of a named stream in the process
+    which runs the connection: its write buffer and its counters.
+
+    Attributes
+    ----------
+    name: str
+        Name of the stream.
+    track: str
+        Comma separated list of phrases of the stream.
+    phrases: list[tuple[str]]
+        Parsed phrases of the track.
+    sink: str
+        Name of the store the tweets are saved to.
+    session_id: str
+        Identifier of the session the tweets are saved with.
+    received: int
+        Number of tweets routed to the stream.
+    saved: int
+        Number of tweets saved to the database. Tweets which go through the
+        spool are counted once it has written them.
+    lost: int
+        Number of tweets lost because the last flush failed on close.
+
+    Methods
+    -------
+    add(self, tweet: dict)
+        Method which adds a matching tweet to the write buffer.
+    save(self, tweets: list[dict])
+        Method which saves a batch of tweets to the sink.
+    counters(self)
+        Method which returns the counters of the stream.
+    close(self)
+        Method which flushes the pending tweets.
+    """
+
+    def __init__(self, definition: dict, store: TweetStore,
+                 sessions: CrawlSessions, spool: TweetSpool = None,
+                 publish: Callable[[List[dict]], None] = None):
+        """
+        Parameters
+        ----------
+        definition: dict
+            Stream definition kept in the shared state.
+        store: TweetStore
+            Store the tweets are saved to.
+        sessions: CrawlSessions
+            Registry used to keep the statistics of the stream session.
+        spool: TweetSpool
+            Write-ahead spool the tweets are appended to, if any. It must
+            write to `store`.
+        publish: Callable[[list[dict]], Any]
+            Function the saved tweets are published to, if any, such as
+            `IKEAStreamingCrawler.publish`. It is not used for the tweets
+            which go through the spool, which publishes them itself.
+        """
+
+        self.name = definition['name']
+        self.track = definition['track']
+        self.phrases = track_utils.parse_track(self.track)
+        self.sink = definition.get('sink')
+        self.session_id = definition['session_id']
+        self.store = store
+        self.sessions = sessions
+        self.spool = spool
+        self.publish = publish
+        # Counters go on from the previous owner of the same session
+        counters = definition.get('counters') or {}
+        if counters.get('session_id') != self.session_id:
+            counters = {}
+        self.received = counters.get('received', 0)
+        self.lost = counters.get('lost', 0)
+        stats = self.sessions.get(self.session_id)
+        if stats is None:
+            stats = {'count': 0}
+            self.sessions.create(self.session_id)
+        # Saved tweets are counted by the sessions when they are written,
+        # whether by the stream or by the spool
+        self._saved_offset = counters.get('saved', 0) - stats['count']
+        self._saved = counters.get('saved', 0)
+        self.saved_log = LogSampler()
+        self.buffer = TweetWriteBuffer(self.save)
+
+    def add(self, tweet: dict):
+        """Method which adds a matching tweet to the write buffer. If the
+        stream has been closed since the tweet was routed to it, the tweet
+        is saved right away instead.
+
+        Parameters
+        ----------
+        tweet: dict
+            JSON-like object in the data model.
+        """
+
+        self.received += 1
+        tweet = dict(tweet, session_id=self.session_id)
+        try:
+            self.buffer.add(tweet)
+        except RuntimeError:
+            self.save([tweet])
+
+    @property
+    def saved(self):
+        """
+        Method which returns the number of tweets of the stream saved to the
+        database.
+        """
+
+        stats = self.sessions.get(self.session_id)
+        # The sessions only keep the latest ones, so the last count is kept
+        if stats is not None:
+            self._saved = self._saved_offset + stats['count']
+        return self._saved
+
+    def save(self, tweets: List[dict]):
+        """Method which saves a batch of tweets to the sink. Tweets go through
+        the spool of the sink, if one is set, which records and publishes
+        them once it has written them. Otherwise, they are written, recorded
+        in the sessions and published right away.
+
+        Parameters
+        ----------
+        tweets: list[dict]
+            List of JSON-like objects to be saved.
+        """
+
+        if self.spool is not None:
+            self.spool.append(tweets)
+            metrics_utils.TWEETS_SPOOLED.labels(crawler='streaming').inc(
+                len(tweets))
+            self.saved_log.log(logging.INFO,
+                               "STREAMING | {} tweets spooled by stream '{}'.",
+                               len(tweets), self.name)
+            return
+        metrics_utils.record_write('streaming', tweets, self.store.write)
+        self.sessions.record(tweets)
+        if self.publish is not None:
+            self.publish(tweets)
+        self.saved_log.log(logging.INFO,
+                           "STREAMING | {} tweets saved by stream '{}'.",
+                           len(tweets), self.name)
+
+    def counters(self):
+        """
+        Method which returns the counters of the stream.
+        """
+
+        return {
+            'session_id': self.session_id,
+            'received': self.received,
+            'saved': self.saved,
+            'pending': len(self.buffer),
+            'lost': self.lost,
+            'updated_at': time.time()
+        }
+
+    def close(self):
+        """
+        Method which stops the write buffer and flushes the pending tweets.
+        The tweets which could not be flushed are counted as lost.
+        """
+
+        self.lost += self.buffer.close()
+
+class StreamManager():
+    """
+    Class used to run several named streams, each one with its own track,
+    sink and counters, from any number of crawler processes.
+
+    The filter endpoint only allows one connection per set of credentials,
+    so the streams share a single connection, which tracks the union of
+    their phrases. Each tweet received is matched against the phrases of
+    every stream and routed to the ones it matches. Twitter only delivers
+    tweets which match some phrase, so the ones which are not matched
+    locally go to a catch-all stream instead of being dropped.
+
+    Stream definitions and counters are kept in the shared state. The
+    process holding the connection lease opens the connection, and renews
+    the lease every `STREAM_SYNC_INTERVAL` seconds. If it dies, another
+    process takes the lease over once it expires, so there is never more
+    than one connection. Any process can serve the API.
+
+    Attributes
+    ----------
+    crawler: IKEAStreamingCrawler
+        Crawler holding the stream connection.
+    state: SharedState
+        Shared state where streams and leases are kept.
+    stores: dict[str, TweetStore]
+        Stores a stream can be saved to, by name.
+    owner: str
+        Identifier of this process in the leases.
+
+    Methods
+    -------
+    pending(self)
+        Method which returns the number of tweets waiting in the write
+        buffers of the local streams.
+    start(self)
+        Method which starts the background synchronization.
+    start_stream(self, name: str, track: str, sink: str)
+        Method which creates or restarts a named stream.
+    stop_stream(self, name: str)
+        Method which stops a named stream.
+    get_stream(self, name: str)
+        Method which returns a stream definition with its counters.
+    get_streams(self)
+        Method which returns every stream definition with its counters.
+    is_connected(self)
+        Method which tells whether this process holds the connection.
+    sync(self)
+        Method which applies the stream definitions to this process.
+    route(self, tweet: dict, raw: dict)
+        Method which routes a received tweet to the matching streams.
+    close(self)
+        Method which stops the connection and flushes every stream.
+    """
+
+    def __init__(self, crawler: IKEAStreamingCrawler, state: SharedState,
+                 stores: Dict[str, TweetStore], default_store: TweetStore,
+                 sessions: CrawlSessions, spool: TweetSpool = None,
+                 spools: Dict[str, TweetSpool] = None,
+                 lease_ttl: float = STREAM_LEASE_TTL,
+                 interval: float = STREAM_SYNC_INTERVAL):
+        """
+        Parameters
+        ----------
+        crawler: IKEAStreamingCrawler
+            Crawler holding the stream connection.
+        state: SharedState
+            Shared state where streams and leases are kept.
+        stores: dict[str, TweetStore]
+            Stores a stream can be saved to, by name.
+        default_store: TweetStore
+            Store used by the streams without a sink.
+        sessions: CrawlSessions
+            Registry used to keep the statistics of each stream session.
+        spool: TweetSpool
+            Write-ahead spool the default sink goes through, if any.
+        spools: dict[str, TweetSpool]
+            Write-ahead spools the named sinks go through, by name. Each one
+            must write to its own sink.
+        lease_ttl: float
+            Seconds until the connection lease expires if not renewed.
+        interval: float
+            Seconds between two synchronizations.
+        """
+
+        self.crawler = crawler
+        self.crawler.router = self.route
+        self.state = state
+        self.stores = stores
+        self.default_store = default_store
+        self.sessions = sessions
+        self.spool = spool
+        self.spools = spools or {}
+        self.lease_ttl = lease_ttl
+        self.interval = interval
+        self.owner = '{}-{}-{}'.format(
+            socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self._streams = {}
+        self._track = []
+        self._connected = False
+        self._lock = threading.RLock()
+        # Guards `_streams` alone, since the queue workers routing tweets
+        # must not wait for `_lock`, held while the queue is drained
+        self._streams_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def pending(self):
+        """
+        Method which returns the number of tweets waiting in the write
+        buffers of the local streams.
+        """
+
+        with self._lock:
+            return sum(len(stream.buffer) for stream in self._streams.values())
+
+    def start(self):
+        """
+        Method which starts the background synchronization.
+        """
+
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='stream-manager')
+        self._thread.start()
+
+    def start_stream(self, name: str, track: str, sink: str = None):
+        """Method which creates a named stream, or restarts it with a new
+        track and session if it already exists.
+
+        Parameters
+        ----------
+        name: str
+            Name of the stream.
+        track: str
+            Comma separated list of phrases.
+        sink: str
+            Name of the store the tweets are saved to. Defaults to the
+            default store.
+
+        Returns
+        -------
+        dict
+            Stream definition.
+        """
+
+        if sink is not None and sink not in self.stores:
+            raise ValueError("Unknown sink: '{}'.".format(sink))
+        if not track_utils.parse_track(track):
+            raise ValueError("Invalid track: '{}'.".format(track))
+        others = [track_utils.parse_track(stream['track'])
+                  for stream in self.state.get_streams()
+                  if stream['status'] == 'running' and stream['name'] != name]
+        phrases = track_utils.union(others + [track_utils.parse_track(track)])
+        if len(phrases) > track_utils.MAX_TRACK_PHRASES:
+            raise ValueError('The streams would track more than {} '
+                             'phrases.'.format(track_utils.MAX_TRACK_PHRASES))
+        definition = {
+            'name': name,
+            'track': track,
+            'sink': sink,
+            'status': 'running',
+            'session_id': uuid.uuid4().hex,
+            'updated_at': time.time()
+        }
+        self.state.save_stream(definition)
+        self.sync()
+        return definition
+
+    def stop_stream(self, name: str):
+        """Method which stops a named stream. Its definition and counters are
+        kept.
+
+        Parameters
+        ----------
+        name: str
+            Name of the stream.
+
+        Returns
+        -------
+        dict
+            Stream definition, or None if it does not exist.
+        """
+
+        definition = self.state.get_stream(name)
+        if definition is None:
+            return None
+        definition['status'] = 'stopped'
+        definition['updated_at'] = time.time()
+        self.state.save_stream(definition)
+        self.sync()
+        return definition
+
+    def get_stream(self, name: str):
+        """Method which returns a stream definition with its counters. If
+        this process runs the stream, the counters are the current ones.
+
+        Parameters
+        ----------
+        name: str
+            Name of the stream.
+        """
+
+        definition = self.state.get_stream(name)
+        if definition is not None:
+            self._update_counters(definition)
+        return definition
+
+    def get_streams(self):
+        """
+        Method which returns every stream definition with its counters.
+        """
+
+        definitions = self.state.get_streams()
+        for definition in definitions:
+            self._update_counters(definition)
+        return definitions
+
+    def is_connected(self):
+        """
+        Method which tells whether this process holds the connection.
+        """
+
+        return self._connected and self.crawler.running
+
+    def sync(self):
+        """
+        Method which applies the stream definitions to this process: takes,
+        renews or releases the connection lease, starts and stops the local
+        streams, reconnects if the union of tracks has changed, and reports
+        the counters.
+        """
+
+        with self._lock:
+            definitions = {stream['name']: stream
+                           for stream in self.state.get_streams()
+                           if stream['status'] == 'running'}
+            holds = False
+            if definitions:
+                holds = self.state.acquire_lease(
+                    STREAM_CONNECTION_LEASE, self.owner, self.lease_ttl)
+            if not holds:
+                definitions = {}
+
+            for name, stream in list(self._streams.items()):
+                definition = definitions.get(name)
+                if (definition is None
+                        or definition['session_id'] != stream.session_id):
+                    # Removed before being closed, so no more tweets are
+                    # routed to it
+                    with self._streams_lock:
+                        del self._streams[name]
+                    self._close_stream(stream)
+            for name, definition in definitions.items():
+                if name not in self._streams:
+                    sink = definition.get('sink')
+                    if sink is None:
+                        store, spool = self.default_store, self.spool
+                    else:
+                        store = self.stores.get(sink, self.default_store)
+                        spool = self.spools.get(sink)
+                    stream = ManagedStream(definition, store, self.sessions,
+                                           spool, self.crawler.publish)
+                    with self._streams_lock:
+                        self._streams[name] = stream
+            for stream in self._streams.values():
+                self.state.save_stream_counters(stream.name, stream.counters())
+
+            self._connect(track_utils.union(
+                stream.phrases for stream in self._streams.values()))
+            if self._connected is False and not definitions:
+                self.state.release_lease(STREAM_CONNECTION_LEASE, self.owner)
+
+    def route(self, tweet: dict, raw: dict = None):
+        """Method which routes a received tweet to the streams whose track it
+        matches. It is called by the crawler queue workers.
+
+        If there is a single stream, every tweet is routed to it. Otherwise
+        the phrases are matched against every field the filter endpoint
+        looks at, which are only in the raw tweet. Tweets which match no
+        stream are routed to the `STREAM_CATCH_ALL` stream, or to every
+        stream if it is not running.
+
+        Parameters
+        ----------
+        tweet: dict
+            JSON-like object in the data model.
+        raw: dict
+            Tweet as received from the Twitter API. Defaults to `tweet`.
+        """
+
+        with self._streams_lock:
+            streams = list(self._streams.values())
+            catch_all = self._streams.get(STREAM_CATCH_ALL)
+        if len(streams) == 1:
+            streams[0].add(tweet)
+            return
+        tokens = track_utils.tokenize_tweet(raw or tweet)
+        matched = [stream for stream in streams
+                   if track_utils.matches(stream.phrases, tokens)]
+        if not matched:
+            metrics_utils.STREAM_MESSAGES.labels(kind='unmatched').inc()
+            matched = [catch_all] if catch_all is not None else streams
+        for stream in matched:
+            stream.add(tweet)
+
+    def close(self):
+        """
+        Method which stops the synchronization and the connection, flushes
+        every stream and releases the connection lease.
+        """
+
+        self._stop.set()
+        with self._lock:
+            self.crawler.disconnect()
+            self.crawler.queue.drain(STREAM_DRAIN_TIMEOUT)
+            with self._streams_lock:
+                streams, self._streams = self._streams, {}
+            for stream in streams.values():
+                self._close_stream(stream)
+            self.state.release_lease(STREAM_CONNECTION_LEASE, self.owner)
+
+    def _connect(self, track: List[str]):
+        """Submethod which opens, closes or reopens the connection so it
+        tracks the given phrases. A connection being closed may take until
+        its next keep-alive to stop, so it is reopened on a later sync.
+
+        Parameters
+        ----------
+        track: list[str]
+            Phrases to track. If empty, the connection is closed.
+        """
+
+        if self.crawler.running and track == self._track:
+            return
+        if self.crawler.running:
+            message = 'STREAMING | Closing connection to track {}.'.format(
+                track or 'nothing')
+            print(message)
+            logging.info(message)
+            self.crawler.disconnect()
+        thread = self.crawler.thread
+        if thread is not None and thread.is_alive():
+            return
+        self._track = track
+        self._connected = bool(track)
+        if track:
+            self.crawler.start_session()
+            self.crawler.filter(track=track, threaded=True)
+            message = 'STREAMING | Connected to track {} phrases.'.format(
+                len(track))
+            print(message)
+            logging.info(message)
+
+    def _close_stream(self, stream: ManagedStream):
+        """Submethod which flushes a local stream and reports its final
+        counters.
+
+        Parameters
+        ----------
+        stream: ManagedStream
+            Stream to close.
+        """
+
+        try:
+            stream.close()
+        except Exception as e:
+            message = 'STREAMING | Stream {} not flushed: {}'.format(
+                stream.name, e)
+            print(message)
+            logging.error(message)
+        self.state.save_stream_counters(stream.name, stream.counters())
+
+    def _update_counters(self, definition: dict):
+        """Submethod which replaces the stored counters of a stream with the
+        current ones, if this process runs it.
+
+        Parameters
+        ----------
+        definition: dict
+            Stream definition with its stored counters.
+        """
+
+        stream = self._streams.get(definition['name'])
+        if stream is not None and stream.session_id == definition['session_id']:
+            definition['counters'] = stream.counters()
+
+    def _run(self):
+        """
+        Submethod executed by the background thread.
+        """
+
+        while not self._stop.wait(self.interval):
+            try:
+                self.sync()
+            except Exception as e:
+                message = 'STREAMING | Stream sync failed: {}'.format(e)
+                print(message)
+                logging.error(message)
@@ -0,0 +1,276 @@
+import os
+import time
+import queue
+import logging
+import tempfile
+import threading
+from typing import Callable, Union
+
+from modules.LogSampler import LogSampler
+
+STREAM_QUEUE_SIZE = int(os.environ.get('STREAM_QUEUE_SIZE', 10000))
+STREAM_WORKERS = int(os.environ.get('STREAM_WORKERS', 2))
+STREAM_QUEUE_POLICY = os.environ.get('STREAM_QUEUE_POLICY', 'block')
+STREAM_SPILL_PATH = os.environ.get('STREAM_SPILL_PATH', os.path.join(
+    tempfile.gettempdir(), 'ikea-stream-spill.ndjson'
+))
+POLICIES = ('block', 'drop_oldest', 'spill')
+
+class StreamQueue():
+    """
+    Class used to decouple the reception of stream messages from their
+    processing. Raw messages are put in a bounded queue and handled by a
+    pool of worker threads.
+
+    When the queue is full, the `policy` decides what happens:
+
+    - block: the receiver waits until there is room in the queue.
+    - drop_oldest: the oldest queued message is discarded.
+    - spill: the message is appended to a file on disk, which the workers
+      read back once there is room in the queue again.
+
+    Attributes
+    ----------
+    handler: Callable[[bytes], Any]
+        Function which processes a single raw message.
+    max_size: int
+        Maximum number of messages held in memory.
+    policy: str
+        One of 'block', 'drop_oldest' or 'spill'.
+    spill_path: str
+        File where messages are spilled with the 'spill' policy.
+
+    Methods
+    -------
+    put(self, raw_data: bytes)
+        Method which queues a raw message.
+    drain(self, timeout: float)
+        Method which waits until every queued message has been processed.
+    stats(self)
+        Method which returns the queue counters.
+    stop(self)
+        Method which processes the remaining messages and stops the workers.
+    """
+
+    def __init__(self, handler: Callable[[bytes], None],
+                 workers: int = STREAM_WORKERS,
+                 max_size: int = STREAM_QUEUE_SIZE,
+                 policy: str = STREAM_QUEUE_POLICY,
+                 spill_path: str = STREAM_SPILL_PATH):
+        """
+        Parameters
+        ----------
+        handler: Callable[[bytes], Any]
+            Function which processes a single raw message.
+        workers: int
+            Number of worker threads.
+        max_size: int
+            Maximum number of messages held in memory.
+        policy: str
+            One of 'block', 'drop_oldest' or 'spill'.
+        spill_path: str
+            File where messages are spilled with the 'spill' policy.
+        """
+
+        if policy not in POLICIES:
+            raise ValueError('Unknown queue policy: {}'.format(policy))
+        self.handler = handler
+        self.max_size = max_size
+        self.policy = policy
+        self.spill_path = spill_path
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._queue = queue.Queue(maxsize=max_size)
+        self._lock = threading.Lock()
+        self._failed_log = LogSampler()
+        self._spill_lock = threading.Lock()
+        self._spill_offset = 0
+        self._spill_pending = 0
+        if policy == 'spill' and os.path.exists(spill_path):
+            with open(spill_path, 'rb') as f:
+                self._spill_pending = sum(1 for _ in f)
+        self._workers = [
+            threading.Thread(target=self._run, daemon=True,
+                             name='stream-worker-{}'.format(i))
+            for i in range(max(1, workers))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def put(self, raw_data: Union[str, bytes]):
+        """Method which queues a raw message.
+
+        Parameters
+        ----------
+        raw_data: str | bytes
+            Raw message received from the stream.
+        """
+
+        item = (time.monotonic(), raw_data)
+        with self._lock:
+            self.received += 1
+        if self.policy == 'block':
+            self._queue.put(item)
+            return
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                pass
+            if self.policy == 'spill':
+                self._spill(raw_data)
+                return
+            try:
+                self._queue.get_nowait()
+                self._queue.task_done()
+                with self._lock:
+                    self.dropped += 1
+            except queue.Empty:
+                pass
+
+    def drain(self, timeout: float = None):
+        """Method which waits until every queued message, including spilled
+        ones, has been processed.
+
+        Parameters
+        ----------
+        timeout: float
+            Maximum number of seconds to wait.
+
+        Returns
+        -------
+        bool
+            Whether the queue has been drained.
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks or self._spill_pending:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def stats(self):
+        """
+        Method which returns the queue counters.
+        """
+
+        with self._lock:
+            return {
+                'policy': self.policy,
+                'workers': len(self._workers),
+                'depth': self._queue.qsize(),
+                'max_size': self.max_size,
+                'received': self.received,
+                'processed': self.processed,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'spilled': self.spilled,
+                'spill_pending': self._spill_pending,
+                'last_lag': self.last_lag,
+                'max_lag': self.max_lag
+            }
+
+    def stop(self, timeout: float = None):
+        """Method which processes the remaining messages and stops the
+        workers.
+
+        Parameters
+        ----------
+        timeout: float
+            Maximum number of seconds to wait for the queue to drain.
+        """
+
+        self.drain(timeout)
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def _spill(self, raw_data: Union[str, bytes]):
+        """Submethod which appends a raw message to the spill file.
+
+        Parameters
+        ----------
+        raw_data: str | bytes
+            Raw message received from the stream.
+        """
+
+        if isinstance(raw_data, str):
+            raw_data = raw_data.encode('utf-8')
+        with self._spill_lock:
+            with open(self.spill_path, 'ab') as f:
+                f.write(raw_data.rstrip(b'\r\n') + b'\n')
+            self._spill_pending += 1
+        with self._lock:
+            self.spilled += 1
+
+    def _unspill(self):
+        """
+        Submethod which moves spilled messages back to the queue while there
+        is room in it. The spill file is removed once it has been read.
+        """
+
+        if not self._spill_pending or not self._spill_lock.acquire(False):
+            return
+        try:
+            with open(self.spill_path, 'rb') as f:
+                f.seek(self._spill_offset)
+                while self._spill_pending and not self._queue.full():
+                    line = f.readline()
+                    if not line:
+                        self._spill_pending = 0
+                        break
+                    try:
+                        self._queue.put_nowait((None, line.rstrip(b'\n')))
+                    except queue.Full:
+                        break
+                    self._spill_offset = f.tell()
+                    self._spill_pending -= 1
+            if not self._spill_pending:
+                os.remove(self.spill_path)
+                self._spill_offset = 0
+        except OSError as e:
+            logging.error('STREAMING | Spill file not read: {}'.format(e))
+        finally:
+            self._spill_lock.release()
+
+    def _run(self):
+        """
+        Submethod executed by the worker threads.
+        """
+
+        while True:
+            try:
+                item = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                self._unspill()
+                continue
+            if item is None:
+                self._queue.task_done()
+                return
+            enqueued_at, raw_data = item
+            try:
+                self.handler(raw_data)
+                with self._lock:
+                    self.processed += 1
+                    if enqueued_at is not None:
+                        self.last_lag = time.monotonic() - enqueued_at
+                        self.max_lag = max(self.max_lag, self.last_lag)
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                self._failed_log.log(
+                    logging.ERROR,
+                    'STREAMING | {} messages not processed. Last error: {}',
+                    1, e)
+            finally:
+                self._queue.task_done()
+            if self._spill_pending and self._queue.qsize() < self.max_size // 2:
+                self._unspill()
@@ -0,0 +1,215 @@
+import os
+import time
+import threading
+from collections import Counter
+
+import utils.aggregate_utils as aggregate_utils
+
+STREAM_STATS_WINDOW = int(os.environ.get('STREAM_STATS_WINDOW', 60))
+STREAM_STATS_TOP_K = int(os.environ.get('STREAM_STATS_TOP_K', 100))
+STREAM_STATS_TOP_N = 10
+
+class SpaceSaving():
+    """
+    Class used to keep the approximate most frequent items of a stream in a
+    fixed number of counters (Space-Saving algorithm).
+
+    When a new item arrives and every counter is taken, the item with the
+    lowest count is replaced and the new one inherits its count, which is
+    kept as the maximum overestimation of the new item.
+
+    Attributes
+    ----------
+    size: int
+        Number of counters.
+
+    Methods
+    -------
+    add(self, item: str)
+        Method which counts an occurrence of an item.
+    top(self, n: int)
+        Method which returns the n most frequent items.
+    """
+
+    def __init__(self, size: int = STREAM_STATS_TOP_K):
+        """
+        Parameters
+        ----------
+        size: int
+            Number of counters.
+        """
+
+        self.size = size
+        self._counts = {}
+        self._errors = {}
+
+    def add(self, item: str):
+        """Method which counts an occurrence of an item.
+
+        Parameters
+        ----------
+        item: str
+            Item to count.
+        """
+
+        if item in self._counts:
+            self._counts[item] += 1
+            return
+        if len(self._counts) < self.size:
+            self._counts[item] = 1
+            self._errors[item] = 0
+            return
+        evicted = min(self._counts, key=self._counts.get)
+        count = self._counts.pop(evicted)
+        del self._errors[evicted]
+        self._counts[item] = count + 1
+        self._errors[item] = count
+
+    def top(self, n: int):
+        """Method which returns the n most frequent items, with their count
+        and its maximum overestimation.
+
+        Parameters
+        ----------
+        n: int
+            Number of items to return.
+        """
+
+        items = sorted(self._counts.items(), key=lambda item: -item[1])[:n]
+        return [{'term': item, 'count': count, 'error': self._errors[item]}
+                for item, count in items]
+
+class StreamStats():
+    """
+    Class used to keep rolling statistics of the tweets received by the
+    streaming crawler, updated as they arrive so they can be read without
+    querying the database.
+
+    Memory does not depend on the length of the stream: the rate is kept in
+    one bucket per second of the window, and hashtags and terms in a fixed
+    number of Space-Saving counters. Reads only go through those buckets
+    and counters, so their cost does not grow with the stream either.
+
+    Attributes
+    ----------
+    window: int
+        Length in seconds of the sliding window used to compute the rate.
+    total: int
+        Number of tweets received since the last reset.
+    langs: collections.Counter
+        Number of tweets received by language.
+    interactions: collections.Counter
+        Sum of each interaction of the tweets received.
+    hashtags: SpaceSaving
+        Most frequent hashtags.
+    terms: SpaceSaving
+        Most frequent terms.
+
+    Methods
+    -------
+    record(self, tweet: dict)
+        Method which updates the statistics with a transformed tweet.
+    snapshot(self)
+        Method which returns the current statistics.
+    reset(self)
+        Method which clears every statistic.
+    """
+
+    def __init__(self, window: int = STREAM_STATS_WINDOW,
+                 top_k: int = STREAM_STATS_TOP_K):
+        """
+        Parameters
+        ----------
+        window: int
+            Length in seconds of the sliding window used to compute the rate.
+        top_k: int
+            Number of counters kept for hashtags and terms.
+        """
+
+        self.window = window
+        self.top_k = top_k
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Method which clears every statistic.
+        """
+
+        with self._lock:
+            self.total = 0
+            self.started_at = time.time()
+            self.langs = Counter()
+            self.interactions = Counter()
+            self.hashtags = SpaceSaving(self.top_k)
+            self.terms = SpaceSaving(self.top_k)
+            self._buckets = [0] * self.window
+            self._bucket_times = [0] * self.window
+
+    def record(self, tweet: dict):
+        """Method which updates the statistics with a transformed tweet.
+
+        Parameters
+        ----------
+        tweet: dict
+            JSON-like object in the data model.
+        """
+
+        words = (tweet.get('text') or '').split()
+        now = int(time.time())
+        index = now % self.window
+        with self._lock:
+            if self._bucket_times[index] != now:
+                self._buckets[index] = 0
+                self._bucket_times[index] = now
+            self._buckets[index] += 1
+            self.total += 1
+            self.langs[tweet.get('lang') or 'und'] += 1
+            for key, value in (tweet.get('interactions') or {}).items():
+                self.interactions[key] += value
+            for word in words:
+                hashtag = aggregate_utils.normalize_word(word, 'hashtag')
+                if hashtag is not None:
+                    self.hashtags.add(hashtag)
+                    continue
+                term = aggregate_utils.normalize_word(word, 'term')
+                if term is not None:
+                    self.terms.add(term)
+
+    def snapshot(self, top_n: int = STREAM_STATS_TOP_N):
+        """Method which returns the current statistics.
+
+        Parameters
+        ----------
+        top_n: int
+            Number of hashtags and terms to return.
+        """
+
+        now = time.time()
+        with self._lock:
+            window_count = self._window_count(int(now))
+            elapsed = min(self.window, max(1, now - self.started_at))
+            return {
+                'total': self.total,
+                'window': self.window,
+                'window_count': window_count,
+                'rate': window_count / elapsed,
+                'langs': dict(self.langs),
+                'interactions': dict(self.interactions),
+                'hashtags': self.hashtags.top(top_n),
+                'terms': self.terms.top(top_n)
+            }
+
+    def _window_count(self, now: int):
+        """Submethod which returns the number of tweets received within the
+        window. It must be called while holding the lock.
+
+        Parameters
+        ----------
+        now: int
+            Current time, in seconds.
+        """
+
+        return sum(count for count, second
+                   in zip(self._buckets, self._bucket_times)
+                   if now - second < self.window)
@@ -0,0 +1,109 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+AGGREGATES_CACHE_TTL = float(os.environ.get('AGGREGATES_CACHE_TTL', 60))
+AGGREGATES_CACHE_SIZE = int(os.environ.get('AGGREGATES_CACHE_SIZE', 256))
+
+class TTLCache():
+    """
+    Class used to keep the results of expensive queries in memory for a short
+    time, so repeated requests do not scan the database again.
+
+    Attributes
+    ----------
+    ttl: float
+        Number of seconds a result is kept.
+    max_size: int
+        Maximum number of results kept. The least recently used one is
+        discarded first.
+    hits: int
+        Number of requests served from the cache.
+    misses: int
+        Number of requests which had to be computed.
+
+    Methods
+    -------
+    get_or_compute(self, key: Hashable, compute: Callable[[], Any])
+        Method which returns the cached result of a key, computing it if
+        missing or expired.
+    discard(self, key: Hashable)
+        Method which discards the cached result of a key.
+    clear(self)
+        Method which discards every cached result.
+    """
+
+    def __init__(self, ttl: float = AGGREGATES_CACHE_TTL,
+                 max_size: int = AGGREGATES_CACHE_SIZE):
+        """
+        Parameters
+        ----------
+        ttl: float
+            Number of seconds a result is kept.
+        max_size: int
+            Maximum number of results kept.
+        """
+
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]):
+        """Method which returns the cached result of a key, computing it if
+        missing or expired. Errors are not cached.
+
+        Parameters
+        ----------
+        key: Hashable
+            Key identifying the result.
+        compute: Callable[[], Any]
+            Function which computes the result.
+
+        Returns
+        -------
+        tuple[Any, bool]
+            Result and whether it was served from the cache.
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and now - item[0] < self.ttl:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item[1], True
+            self.misses += 1
+
+        value = compute()
+        with self._lock:
+            self._items[key] = (time.monotonic(), value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+        return value, False
+
+    def discard(self, key: Hashable):
+        """Method which discards the cached result of a key, if any, so it is
+        computed again on the next request.
+
+        Parameters
+        ----------
+        key: Hashable
+            Key identifying the result.
+        """
+
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        """
+        Method which discards every cached result.
+        """
+
+        with self._lock:
+            self._items.clear()
@@ -0,0 +1,411 @@
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+from typing import Callable, List
+
+SPOOL_DIR = os.environ.get('SPOOL_DIR', '')
+SPOOL_SEGMENT_BYTES = int(os.environ.get('SPOOL_SEGMENT_BYTES', 16 * 2 ** 20))
+SPOOL_FSYNC = os.environ.get('SPOOL_FSYNC', 'interval')
+SPOOL_FSYNC_INTERVAL = float(os.environ.get('SPOOL_FSYNC_INTERVAL', 1))
+SPOOL_BATCH_SIZE = int(os.environ.get('SPOOL_BATCH_SIZE', 1000))
+SPOOL_RETRY_DELAY = float(os.environ.get('SPOOL_RETRY_DELAY', 5))
+FSYNC_POLICIES = ('always', 'interval', 'never')
+SEGMENT_FORMAT = 'segment-{:012d}.ndjson'
+CHECKPOINT_FILE = 'checkpoint.json'
+LOCK_FILE = 'spool.lock'
+PROCESS_FORMAT = 'process-{}'
+
+class SpoolLocked(Exception):
+    """
+    Exception raised when opening a spool folder used by another spool.
+    """
+
+class TweetSpool():
+    """
+    Class used as a local write-ahead log between the crawlers and the
+    database.
+
+    Tweets are appended to newline-delimited JSON segment files, and a
+    background thread replays them into the database in batches. The
+    position of the last replayed tweet is kept in a checkpoint file, so
+    replay resumes where it left off after a restart. If the database is
+    unavailable, tweets keep being appended and the replay is retried until
+    it succeeds.
+
+    Replay is at-least-once: a batch may be written twice if the process
+    stops after writing it but before saving the checkpoint, or if a failed
+    write saved part of it. Such batches, the first one replayed after a
+    restart and any retried one, are passed to the sink with `retry` set,
+    so stores which append tweets instead of upserting them by id, such as
+    BigQuery streaming inserts, merge them instead.
+
+    A spool folder can only be used by one spool at a time, which holds a
+    lock on it until closed. Processes sharing a root folder use `claim`,
+    so each one gets its own subfolder.
+
+    Attributes
+    ----------
+    path: str
+        Folder holding the segment and checkpoint files.
+    sink: Callable[[list[dict], bool], Any]
+        Function which writes a batch of tweets to the database, and whether
+        it may have been written before.
+    fsync: str
+        One of 'always' (after every append), 'interval' (at most every
+        `fsync_interval` seconds) or 'never' (left to the OS).
+
+    Methods
+    -------
+    claim(cls, root: str, sink: Callable[[list[dict], bool], Any], **kw)
+        Method which opens a spool in the first free subfolder of a root.
+    append(self, tweets: list[dict])
+        Method which appends a batch of tweets to the spool.
+    drain(self, timeout: float)
+        Method which waits until every spooled tweet has been replayed.
+    stats(self)
+        Method which returns the spool counters.
+    close(self, timeout: float)
+        Method which stops the replay thread.
+    """
+
+    def __init__(self, path: str, sink: Callable[[List[dict], bool], None],
+                 segment_bytes: int = SPOOL_SEGMENT_BYTES,
+                 fsync: str = SPOOL_FSYNC,
+                 fsync_interval: float = SPOOL_FSYNC_INTERVAL,
+                 batch_size: int = SPOOL_BATCH_SIZE):
+        """
+        Parameters
+        ----------
+        path: str
+            Folder holding the segment and checkpoint files.
+        sink: Callable[[list[dict], bool], Any]
+            Function which writes a batch of tweets to the database, and
+            whether it may have been written before.
+        segment_bytes: int
+            Size from which a new segment file is started.
+        fsync: str
+            One of 'always', 'interval' or 'never'.
+        fsync_interval: float
+            Seconds between fsyncs with the 'interval' policy.
+        batch_size: int
+            Maximum number of tweets replayed at once.
+
+        Raises
+        ------
+        SpoolLocked
+            If the folder is used by another spool.
+        """
+
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError('Unknown fsync policy: {}'.format(fsync))
+        self.path = path
+        self.sink = sink
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.batch_size = batch_size
+        self.appended = 0
+        self.replayed = 0
+        self.failures = 0
+        self.last_error = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._last_fsync = time.monotonic()
+
+        os.makedirs(path, exist_ok=True)
+        self._lock_file = open(os.path.join(path, LOCK_FILE), 'a')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            raise SpoolLocked('SPOOL | {} is in use.'.format(path))
+        segments = self._segments()
+        self._write_segment = segments[-1] if segments else 1
+        self._repair(self._write_segment)
+        self._file = open(self._segment_path(self._write_segment), 'ab')
+        self._read_segment, self._read_offset = self._load_checkpoint()
+        if segments and self._read_segment < segments[0]:
+            self._read_segment, self._read_offset = segments[0], 0
+        # What was left by the previous process may have been written already
+        self._retry = not self._caught_up()
+
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='spool-replay')
+        self._thread.start()
+
+    @classmethod
+    def claim(cls, root: str, sink: Callable[[List[dict], bool], None],
+              **kw):
+        """Method which opens a spool in the first subfolder of `root` not
+        used by another process, such as `root/process-0`. A process which
+        replaces a dead one takes its subfolder over and replays what it
+        left.
+
+        Parameters
+        ----------
+        root: str
+            Folder holding the spool of every process.
+        sink: Callable[[list[dict], bool], Any]
+            Function which writes a batch of tweets to the database, and
+            whether it may have been written before.
+        kw: dict
+            Other parameters passed to `TweetSpool`.
+        """
+
+        slot = 0
+        while True:
+            path = os.path.join(root, PROCESS_FORMAT.format(slot))
+            try:
+                return cls(path, sink, **kw)
+            except SpoolLocked:
+                slot += 1
+
+    def append(self, tweets: List[dict]):
+        """Method which appends a batch of tweets to the spool.
+
+        Parameters
+        ----------
+        tweets: list[dict]
+            List of JSON-like objects to be saved.
+        """
+
+        if not tweets:
+            return
+        data = ''.join(
+            json.dumps(tweet, default=str) + '\n' for tweet in tweets
+        ).encode('utf-8')
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('SPOOL | Spool is closed.')
+            if self._file.tell() >= self.segment_bytes:
+                self._rotate()
+            self._file.write(data)
+            self._file.flush()
+            now = time.monotonic()
+            if (self.fsync == 'always' or (self.fsync == 'interval'
+                    and now - self._last_fsync >= self.fsync_interval)):
+                os.fsync(self._file.fileno())
+                self._last_fsync = now
+            self.appended += len(tweets)
+            self._cond.notify_all()
+
+    def drain(self, timeout: float = None):
+        """Method which waits until every spooled tweet has been replayed.
+
+        Parameters
+        ----------
+        timeout: float
+            Maximum number of seconds to wait.
+
+        Returns
+        -------
+        bool
+            Whether the spool has been drained.
+        """
+
+        with self._cond:
+            return self._cond.wait_for(self._caught_up, timeout)
+
+    def stats(self):
+        """
+        Method which returns the spool counters.
+        """
+
+        with self._cond:
+            segments = self._segments()
+            pending = sum(
+                os.path.getsize(self._segment_path(segment))
+                for segment in segments if segment >= self._read_segment
+            ) - self._read_offset
+            return {
+                'fsync': self.fsync,
+                'segments': len(segments),
+                'pending_bytes': max(0, pending),
+                'appended': self.appended,
+                'replayed': self.replayed,
+                'failures': self.failures,
+                'last_error': self.last_error
+            }
+
+    def close(self, timeout: float = None):
+        """Method which waits for the spool to drain, stops the replay thread
+        and syncs the active segment to disk. Tweets which could not be
+        replayed stay in the spool for the next start.
+
+        Parameters
+        ----------
+        timeout: float
+            Maximum number of seconds to wait for the spool to drain.
+        """
+
+        self.drain(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        with self._cond:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        self._lock_file.close()
+
+    def _segment_path(self, segment: int):
+        """Submethod which returns the path of a segment file.
+
+        Parameters
+        ----------
+        segment: int
+            Number of the segment.
+        """
+
+        return os.path.join(self.path, SEGMENT_FORMAT.format(segment))
+
+    def _segments(self):
+        """
+        Submethod which returns the numbers of the existing segment files.
+        """
+
+        segments = []
+        for name in os.listdir(self.path):
+            if name.startswith('segment-') and name.endswith('.ndjson'):
+                segments.append(int(name[len('segment-'):-len('.ndjson')]))
+        return sorted(segments)
+
+    def _repair(self, segment: int):
+        """Submethod which truncates a partially written line at the end of a
+        segment, left by a crash in the middle of an append.
+
+        Parameters
+        ----------
+        segment: int
+            Number of the segment.
+        """
+
+        path = self._segment_path(segment)
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def _rotate(self):
+        """
+        Submethod which syncs the active segment and starts a new one. It
+        must be called while holding the lock.
+        """
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._write_segment += 1
+        self._file = open(self._segment_path(self._write_segment), 'ab')
+
+    def _load_checkpoint(self):
+        """
+        Submethod which reads the position of the last replayed tweet.
+        """
+
+        try:
+            with open(os.path.join(self.path, CHECKPOINT_FILE)) as f:
+                checkpoint = json.load(f)
+            return checkpoint['segment'], checkpoint['offset']
+        except (OSError, ValueError, KeyError):
+            return 1, 0
+
+    def _save_checkpoint(self):
+        """
+        Submethod which atomically saves the position of the last replayed
+        tweet.
+        """
+
+        path = os.path.join(self.path, CHECKPOINT_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'segment': self._read_segment,
+                       'offset': self._read_offset}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    def _caught_up(self):
+        """
+        Submethod which checks whether every appended tweet has been
+        replayed. It must be called while holding the lock.
+        """
+
+        return (self._read_segment == self._write_segment
+                and self._read_offset >= self._file.tell())
+
+    def _read_batch(self):
+        """
+        Submethod which reads the next batch of tweets to replay, moving to
+        the next segment once the current one has been fully replayed.
+
+        Returns
+        -------
+        tuple[list[dict], int]
+            Tweets and offset of the segment after them.
+        """
+
+        with self._cond:
+            while (self._read_segment < self._write_segment
+                   and self._read_offset >= os.path.getsize(
+                       self._segment_path(self._read_segment))):
+                os.remove(self._segment_path(self._read_segment))
+                self._read_segment += 1
+                self._read_offset = 0
+                self._save_checkpoint()
+            end = (self._file.tell()
+                   if self._read_segment == self._write_segment else None)
+
+        tweets = []
+        offset = self._read_offset
+        with open(self._segment_path(self._read_segment), 'rb') as f:
+            f.seek(offset)
+            while len(tweets) < self.batch_size:
+                if end is not None and offset >= end:
+                    break
+                line = f.readline()
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                if line.strip():
+                    tweets.append(json.loads(line))
+        return tweets, offset
+
+    def _run(self):
+        """
+        Submethod executed by the replay thread.
+        """
+
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._closed or not self._caught_up())
+                if self._closed:
+                    return
+            try:
+                tweets, offset = self._read_batch()
+                if tweets:
+                    self.sink(tweets, self._retry)
+                    self._retry = False
+                with self._cond:
+                    self._read_offset = offset
+                    self._save_checkpoint()
+                    self.replayed += len(tweets)
+                    self._cond.notify_all()
+            except Exception as e:
+                self._retry = True
+                self.failures += 1
+                self.last_error = str(e)
+                message = 'SPOOL | Replay failed, retrying in {}s: {}'.format(
+                    SPOOL_RETRY_DELAY, e)
+                print(message)
+                logging.error(message)
+                with self._cond:
+                    self._cond.wait_for(lambda: self._closed,
+                                        SPOOL_RETRY_DELAY)
@@ -0,0 +1,633 @@
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Iterator, List
+
+from bson.errors import InvalidId
+
+import utils.aggregate_utils as aggregate_utils
+import utils.gcp_utils as gcp_utils
+import utils.mongo_utils as mongo_utils
+import utils.sqlite_utils as sqlite_utils
+from modules.TTLCache import TTLCache
+
+class TweetStore(ABC):
+    """
+    Class used as the interface of the databases where tweets are saved.
+    Every method which receives tweet ids, cursors or fields raises
+    ValueError if they are not valid.
+
+    Methods
+    -------
+    write(self, tweets: list[dict], retry: bool)
+        Method which saves a batch of tweets, updating the existing ones.
+    get_by_ids(self, ids: list[str], fields: list[str], start: str, end: str)
+        Method which retrieves the tweets with the given ids.
+    get_by_session(self, session_id: str, limit: int, after: str,
+                   fields: list[str], start: str, end: str)
+        Method which retrieves a page of the tweets saved by a session.
+    iter_tweets(self, filters: dict, fields: list[str], batch_size: int)
+        Method which iterates over the tweets matching the given filters.
+    count(self, filters: dict)
+        Method which counts the tweets matching the given filters.
+    timeseries(self, filters: dict, interval: str)
+        Method which counts the tweets by time bucket, crawler and language.
+    interactions(self, filters: dict)
+        Method which sums the interactions of the tweets by crawler.
+    top_words(self, filters: dict, kind: str, limit: int)
+        Method which counts the most frequent hashtags or terms.
+    sources(self, filters: dict, limit: int)
+        Method which counts the tweets by the client they were sent from.
+    get_checkpoint(self, key: str)
+        Method which retrieves the crawl checkpoint of a query.
+    save_checkpoint(self, key: str, checkpoint: dict)
+        Method which stores the crawl checkpoint of a query.
+    refresh_schema(self)
+        Method which reloads the table schema, if the database uses one.
+    check_indexes(self)
+        Method which reports whether the queries are covered by indexes.
+    deduplicate(self)
+        Method which removes the duplicated tweets, if the database can hold
+        them.
+    """
+
+    name = None
+
+    @abstractmethod
+    def write(self, tweets: List[dict], retry: bool = False):
+        """Method which saves a batch of tweets, using the tweet id as the key.
+
+        Parameters
+        ----------
+        tweets: list[dict]
+            List of JSON-like objects to be saved.
+        retry: bool
+            Whether the batch may have been written before, as when the spool
+            replays it, so it must not be duplicated even by the stores
+            which append tweets instead of upserting them.
+        """
+
+    @abstractmethod
+    def get_by_ids(self, ids: List[str], fields: List[str] = None,
+                   start: str = None, end: str = None):
+        """Method which retrieves the tweets with the given ids.
+
+        Parameters
+        ----------
+        ids: list[str]
+            List of tweet ids to retrieve.
+        fields: list[str]
+            Fields to retrieve.
+        start: str
+            Oldest `created_at` of the tweets, if known.
+        end: str
+            Newest `created_at` of the tweets, if known.
+
+        Returns
+        -------
+        tuple[list[dict], int]
+            Retrieved tweets and number of bytes processed, if reported by
+            the database.
+        """
+
+    @abstractmethod
+    def get_by_session(self, session_id: str, limit: int, after: str = None,
+                       fields: List[str] = None, start: str = None,
+                       end: str = None):
+        """Method which retrieves a page of the tweets saved by a crawl
+        session, newest first.
+
+        Parameters
+        ----------
+        session_id: str
+            Identifier of the crawl session.
+        limit: int
+            Maximum number of tweets to retrieve.
+        after: str
+            Cursor returned by the previous page, if any.
+        fields: list[str]
+            Fields to retrieve.
+        start: str
+            Oldest `created_at` of the session, if known.
+        end: str
+            Newest `created_at` of the session, if known.
+
+        Returns
+        -------
+        tuple[list[dict], str, int]
+            Page of tweets, cursor of the next page, or None if it is the last
+            one, and number of bytes processed, if reported by the database.
+        """
+
+    @abstractmethod
+    def iter_tweets(self, filters: dict, fields: List[str] = None,
+                    batch_size: int = 1000) -> Iterator[dict]:
+        """Method which iterates over the tweets matching the given filters.
+
+        Parameters
+        ----------
+        filters: dict
+            Optional `crawler`, `lang`, `session_id`, `since` and `until`
+            filters. Dates are formatted as YYYY-MM-DD HH:MM:SS.
+        fields: list[str]
+            Fields to retrieve. Defaults to every field.
+        batch_size: int
+            Number of tweets fetched at once.
+        """
+
+    @abstractmethod
+    def count(self, filters: dict = None):
+        """Method which counts the tweets matching the given filters.
+
+        Parameters
+        ----------
+        filters: dict
+            Optional `crawler`, `lang`, `session_id`, `since` and `until`
+            filters.
+        """
+
+    @abstractmethod
+    def timeseries(self, filters: dict, interval: str = 'hour'):
+        """Method which counts the tweets matching the given filters by time
+        bucket, crawler and language.
+
+        Parameters
+        ----------
+        filters: dict
+            Optional `crawler`, `lang`, `session_id`, `since` and `until`
+            filters.
+        interval: str
+            Size of the time buckets: 'minute', 'hour' or 'day'.
+
+        Returns
+        -------
+        list[dict]
+            Rows with the `time`, `crawler`, `lang` and `count` fields,
+            sorted by time.
+        """
+
+    @abstractmethod
+    def interactions(self, filters: dict):
+        """Method which sums the interactions of the tweets matching the given
+        filters, by crawler.
+
+        Parameters
+        ----------
+        filters: dict
+            Optional `crawler`, `lang`, `session_id`, `since` and `until`
+            filters.
+
+        Returns
+        -------
+        list[dict]
+            Rows with the `crawler` and `tweets` fields and the sum of each
+            interaction.
+        """
+
+    @abstractmethod
+    def top_words(self, filters: dict, kind: str = 'hashtag',
+                  limit: int = 20):
+        """Method which counts the most frequent hashtags or terms of the
+        tweets matching the given filters.
+
+        Parameters
+        ----------
+        filters: dict
+            Optional `crawler`, `lang`, `session_id`, `since` and `until`
+            filters.
+        kind: str
+            Either 'hashtag' or 'term'.
+        limit: int
+            Number of words to return.
+
+        Returns
+        -------
+        list[dict]
+            Rows with the `term` and `count` fields, most frequent first.
+        """
+
+    @abstractmethod
+    def sources(self, filters: dict, limit: int = 20):
+        """Method which counts the tweets matching the given filters by the
+        client they were sent from.
+
+        Parameters
+        ----------
+        filters: dict
+            Optional `crawler`, `lang`, `session_id`, `since` and `until`
+            filters.
+        limit: int
+            Number of sources to return.
+
+        Returns
+        -------
+        list[dict]
+            Rows with the `source` and `count` fields, most frequent first.
+        """
+
+    @abstractmethod
+    def get_checkpoint(self, key: str):
+        """Method which retrieves the crawl checkpoint of a query.
+
+        Parameters
+        ----------
+        key: str
+            Checkpoint key of the query.
+        """
+
+    @abstractmethod
+    def save_checkpoint(self, key: str, checkpoint: dict):
+        """Method which stores the crawl checkpoint of a query.
+
+        Parameters
+        ----------
+        key: str
+            Checkpoint key of the query.
+        checkpoint: dict
+            JSON-like object with the `since_id`, `max_id` and `top_id` fields.
+        """
+
+    def refresh_schema(self):
+        """Method which reloads the table schema, if the database uses one.
+
+        Returns
+        -------
+        bool
+            Whether the database uses a schema.
+        """
+
+        return False
+
+    def check_indexes(self):
+        """Method which reports whether the queries made by the API are
+        covered by indexes, if the database uses them.
+
+        Returns
+        -------
+        dict
+            Report by query name, or None if the database has no indexes to
+            check.
+        """
+
+    def deduplicate(self):
+        """Method which removes the duplicated tweets, if the database can
+        hold them.
+
+        Returns
+        -------
+        bool
+            Whether the tweets have been deduplicated, or None if the
+            database can not hold duplicated tweets.
+        """
+
+        return None
+
+class MongoTweetStore(TweetStore):
+    """
+    Class used to save the tweets to a MongoDB collection.
+
+    Attributes
+    ----------
+    db: pymongo.database.Database
+        Database object used to save the tweets.
+    """
+
+    name = 'mongo'
+
+    def __init__(self, db: Any):
+        """
+        Parameters
+        ----------
+        db: pymongo.database.Database
+            Database object used to save the tweets.
+        """
+
+        self.db = db
+        mongo_utils.ensure_indexes(db)
+        if mongo_utils.MONGODB_STREAM_TIMESERIES:
+            mongo_utils.ensure_stream_timeseries(db)
+
+    def write(self, tweets: List[dict], retry: bool = False):
+        mongo_utils.upsert_tweets(self.db, tweets)
+        if mongo_utils.MONGODB_STREAM_TIMESERIES:
+            mongo_utils.append_stream_tweets(self.db, tweets)
+
+    def get_by_ids(self, ids: List[str], fields: List[str] = None,
+                   start: str = None, end: str = None):
+        return list(mongo_utils.get_by_ids(self.db, ids, fields)), None
+
+    def get_by_session(self, session_id: str, limit: int, after: str = None,
+                       fields: List[str] = None, start: str = None,
+                       end: str = None):
+        try:
+            records, cursor = mongo_utils.get_by_session(
+                self.db, session_id, limit, after, fields)
+        except InvalidId as e:
+            raise ValueError(str(e))
+        return records, cursor, None
+
+    def iter_tweets(self, filters: dict, fields: List[str] = None,
+                    batch_size: int = 1000):
+        return mongo_utils.iter_tweets(self.db, filters, fields, batch_size)
+
+    def count(self, filters: dict = None):
+        return mongo_utils.count_tweets(self.db, filters)
+
+    def timeseries(self, filters: dict, interval: str = 'hour'):
+        rows = mongo_utils.aggregate_timeseries(
+            self.db, filters, aggregate_utils.INTERVALS[interval])
+        return aggregate_utils.sort_timeseries(rows)
+
+    def interactions(self, filters: dict):
+        return mongo_utils.aggregate_interactions(
+            self.db, filters, aggregate_utils.INTERACTION_FIELDS)
+
+    def top_words(self, filters: dict, kind: str = 'hashtag',
+                  limit: int = 20):
+        # Words are normalized afterwards, so more of them are retrieved
+        rows = mongo_utils.aggregate_words(self.db, filters, kind, limit * 5)
+        return aggregate_utils.merge_words(rows, kind, limit)
+
+    def sources(self, filters: dict, limit: int = 20):
+        rows = mongo_utils.aggregate_sources(self.db, filters, limit)
+        return aggregate_utils.merge_sources(rows, limit)
+
+    def get_checkpoint(self, key: str):
+        return mongo_utils.get_checkpoint(self.db, key)
+
+    def save_checkpoint(self, key: str, checkpoint: dict):
+        mongo_utils.save_checkpoint(self.db, key, checkpoint)
+
+    def check_indexes(self):
+        return mongo_utils.check_indexes(self.db)
+
+class BigQueryTweetStore(TweetStore):
+    """
+    Class used to save the tweets to a BigQuery table.
+
+    Attributes
+    ----------
+    db: google.cloud.bigquery.Client
+        BigQuery client used to save the tweets.
+    """
+
+    name = 'bigquery'
+
+    def __init__(self, db: Any):
+        """
+        Parameters
+        ----------
+        db: google.cloud.bigquery.Client
+            BigQuery client used to save the tweets.
+        """
+
+        self.db = db
+        self._session_bounds = TTLCache(gcp_utils.SESSION_BOUNDS_CACHE_TTL)
+        gcp_utils.load_schema()
+
+    def write(self, tweets: List[dict], retry: bool = False):
+        gcp_utils.write_tweets(self.db, tweets, retry)
+
+    def get_by_ids(self, ids: List[str], fields: List[str] = None,
+                   start: str = None, end: str = None):
+        return gcp_utils.get_by_ids(self.db, ids, fields, start=start,
+                                    end=end)
+
+    def get_by_session(self, session_id: str, limit: int, after: str = None,
+                       fields: List[str] = None, start: str = None,
+                       end: str = None):
+        bytes_processed = 0
+        if start is None and end is None:
+            # The first page reads the bounds again, since the session may
+            # have saved tweets since, and the next pages reuse them
+            if after is None:
+                self._session_bounds.discard(session_id)
+            bounds, cached = self._session_bounds.get_or_compute(
+                session_id,
+                lambda: gcp_utils.get_session_bounds(self.db, session_id))
+            start, end = bounds[:2]
+            bytes_processed = 0 if cached else bounds[2]
+            if start is None:
+                return [], None, bytes_processed
+        records, cursor, page_bytes = gcp_utils.get_by_session(
+            self.db, session_id, limit, after, fields, start=start, end=end)
+        return records, cursor, bytes_processed + page_bytes
+
+    def iter_tweets(self, filters: dict, fields: List[str] = None,
+                    batch_size: int = 1000):
+        return gcp_utils.iter_tweets(self.db, filters, fields, batch_size)
+
+    def count(self, filters: dict = None):
+        return gcp_utils.count_tweets(self.db, filters)
+
+    def timeseries(self, filters: dict, interval: str = 'hour'):
+        return aggregate_utils.sort_timeseries(
+            gcp_utils.aggregate_timeseries(self.db, filters, interval))
+
+    def interactions(self, filters: dict):
+        return gcp_utils.aggregate_interactions(self.db, filters)
+
+    def top_words(self, filters: dict, kind: str = 'hashtag',
+                  limit: int = 20):
+        # Words are normalized afterwards, so more of them are retrieved
+        rows = gcp_utils.aggregate_words(self.db, filters, kind, limit * 5)
+        return aggregate_utils.merge_words(rows, kind, limit)
+
+    def sources(self, filters: dict, limit: int = 20):
+        rows = gcp_utils.aggregate_sources(self.db, filters, limit)
+        return aggregate_utils.merge_sources(rows, limit)
+
+    def get_checkpoint(self, key: str):
+        return gcp_utils.get_checkpoint(self.db, key)
+
+    def save_checkpoint(self, key: str, checkpoint: dict):
+        gcp_utils.save_checkpoint(self.db, key, checkpoint)
+
+    def refresh_schema(self):
+        gcp_utils.load_schema(refresh=True)
+        return True
+
+    def deduplicate(self):
+        return gcp_utils.deduplicate_table(self.db)
+
+class SQLiteTweetStore(TweetStore):
+    """
+    Class used to save the tweets to a local SQLite database, for single node
+    deployments and offline testing. The connection is shared by every
+    thread, so queries are serialized with a lock.
+
+    Attributes
+    ----------
+    path: str
+        Path of the database file.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path: str = sqlite_utils.SQLITE_PATH):
+        """
+        Parameters
+        ----------
+        path: str
+            Path of the database file.
+        """
+
+        self.path = path
+        self.db = sqlite_utils.connect(path)
+        self._lock = threading.Lock()
+
+    def write(self, tweets: List[dict], retry: bool = False):
+        with self._lock:
+            sqlite_utils.upsert_tweets(self.db, tweets)
+
+    def get_by_ids(self, ids: List[str], fields: List[str] = None,
+                   start: str = None, end: str = None):
+        with self._lock:
+            return sqlite_utils.get_by_ids(self.db, ids, fields), None
+
+    def get_by_session(self, session_id: str, limit: int, after: str = None,
+                       fields: List[str] = None, start: str = None,
+                       end: str = None):
+        with self._lock:
+            records, cursor = sqlite_utils.get_by_session(
+                self.db, session_id, limit, after, fields)
+        return records, cursor, None
+
+    def iter_tweets(self, filters: dict, fields: List[str] = None,
+                    batch_size: int = 1000):
+        # Each batch is read on its own, so the lock is not held between them
+        after = None
+        while True:
+            with self._lock:
+                records = sqlite_utils.get_batch(
+                    self.db, filters, fields, batch_size, after)
+            for record in records:
+                after = record.pop('_cursor')
+                yield record
+            if len(records) < batch_size:
+                return
+
+    def count(self, filters: dict = None):
+        with self._lock:
+            return sqlite_utils.count_tweets(self.db, filters)
+
+    def timeseries(self, filters: dict, interval: str = 'hour'):
+        with self._lock:
+            rows = sqlite_utils.aggregate_timeseries(
+                self.db, filters, aggregate_utils.INTERVALS[interval])
+        return aggregate_utils.sort_timeseries(rows)
+
+    def interactions(self, filters: dict):
+        with self._lock:
+            return sqlite_utils.aggregate_interactions(
+                self.db, filters, aggregate_utils.INTERACTION_FIELDS)
+
+    def top_words(self, filters: dict, kind: str = 'hashtag',
+                  limit: int = 20):
+        with self._lock:
+            texts = sqlite_utils.get_texts(self.db, filters)
+        return aggregate_utils.top_words(texts, kind, limit)
+
+    def sources(self, filters: dict, limit: int = 20):
+        with self._lock:
+            rows = sqlite_utils.aggregate_sources(self.db, filters, limit)
+        return aggregate_utils.merge_sources(rows, limit)
+
+    def get_checkpoint(self, key: str):
+        with self._lock:
+            return sqlite_utils.get_checkpoint(self.db, key)
+
+    def save_checkpoint(self, key: str, checkpoint: dict):
+        with self._lock:
+            sqlite_utils.save_checkpoint(self.db, key, checkpoint)
+
+class FanOutTweetStore(TweetStore):
+    """
+    Class used to save the tweets to several databases at once. Reads and
+    checkpoints are served by the first one, the primary store.
+
+    Tweets are written to every store even if one of them fails, and the
+    first error is raised afterwards so the batch is retried. Since stores
+    update existing tweets, retrying the stores which succeeded is safe.
+
+    Attributes
+    ----------
+    stores: list[TweetStore]
+        Stores the tweets are written to.
+    """
+
+    name = 'fanout'
+
+    def __init__(self, stores: List[TweetStore]):
+        """
+        Parameters
+        ----------
+        stores: list[TweetStore]
+            Stores the tweets are written to, starting with the primary one.
+        """
+
+        if not stores:
+            raise ValueError('At least one store is required.')
+        self.stores = stores
+        self.primary = stores[0]
+
+    def write(self, tweets: List[dict], retry: bool = False):
+        error = None
+        for store in self.stores:
+            try:
+                store.write(tweets, retry)
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+
+    def get_by_ids(self, ids: List[str], fields: List[str] = None,
+                   start: str = None, end: str = None):
+        return self.primary.get_by_ids(ids, fields, start, end)
+
+    def get_by_session(self, session_id: str, limit: int, after: str = None,
+                       fields: List[str] = None, start: str = None,
+                       end: str = None):
+        return self.primary.get_by_session(session_id, limit, after, fields,
+                                           start, end)
+
+    def iter_tweets(self, filters: dict, fields: List[str] = None,
+                    batch_size: int = 1000):
+        return self.primary.iter_tweets(filters, fields, batch_size)
+
+    def count(self, filters: dict = None):
+        return self.primary.count(filters)
+
+    def timeseries(self, filters: dict, interval: str = 'hour'):
+        return self.primary.timeseries(filters, interval)
+
+    def interactions(self, filters: dict):
+        return self.primary.interactions(filters)
+
+    def top_words(self, filters: dict, kind: str = 'hashtag',
+                  limit: int = 20):
+        return self.primary.top_words(filters, kind, limit)
+
+    def sources(self, filters: dict, limit: int = 20):
+        return self.primary.sources(filters, limit)
+
+    def get_checkpoint(self, key: str):
+        return self.primary.get_checkpoint(key)
+
+    def save_checkpoint(self, key: str, checkpoint: dict):
+        self.primary.save_checkpoint(key, checkpoint)
+
+    def refresh_schema(self):
+        refreshed = [store.refresh_schema() for store in self.stores]
+        return any(refreshed)
+
+    def check_indexes(self):
+        for store in self.stores:
+            report = store.check_indexes()
+            if report is not None:
+                return report
+        return None
+
+    def deduplicate(self):
+        results = [store.deduplicate() for store in self.stores]
+        results = [result for result in results if result is not None]
+        return all(results) if results else None
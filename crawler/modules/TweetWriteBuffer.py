@@ -0,0 +1,209 @@
+import os
+import time
+import logging
+import threading
+from typing import Callable, List
+
+STREAM_BUFFER_SIZE = int(os.environ.get('STREAM_BUFFER_SIZE', 500))
+STREAM_BUFFER_MAX_AGE = float(os.environ.get('STREAM_BUFFER_MAX_AGE', 2))
+STREAM_BUFFER_MAX_PENDING = int(
+    os.environ.get('STREAM_BUFFER_MAX_PENDING', 10000))
+STREAM_BUFFER_RETRY_DELAY = float(
+    os.environ.get('STREAM_BUFFER_RETRY_DELAY', 5))
+
+class TweetWriteBuffer():
+    """
+    Class used to collect transformed tweets and write them to the database
+    in bulk from a background thread.
+
+    A flush is triggered whenever the buffer holds `max_size` tweets or the
+    oldest pending tweet is older than `max_age` seconds. If a flush fails,
+    the tweets are put back at the front of the buffer and retried later, so
+    no data is lost while the database is unavailable.
+
+    Attributes
+    ----------
+    flush_callback: Callable[[list[dict]], Any]
+        Function which writes a list of tweets to the database.
+    max_size: int
+        Number of tweets which triggers a flush. It is also the maximum
+        number of tweets written by a single call to `flush_callback`.
+    max_age: float
+        Maximum number of seconds a tweet can wait before being flushed.
+    max_pending: int
+        Maximum number of tweets held in memory, including the ones being
+        flushed. Once reached, `add` blocks until the background thread
+        catches up, so the buffer does not grow while the database is down.
+
+    Methods
+    -------
+    add(self, tweet: dict)
+        Method which appends a tweet to the buffer.
+    flush(self)
+        Method which writes every pending tweet to the database.
+    close(self)
+        Method which stops the background thread and flushes the buffer.
+    """
+
+    def __init__(self, flush_callback: Callable[[List[dict]], None],
+                 max_size: int = STREAM_BUFFER_SIZE,
+                 max_age: float = STREAM_BUFFER_MAX_AGE,
+                 max_pending: int = STREAM_BUFFER_MAX_PENDING):
+        """
+        Parameters
+        ----------
+        flush_callback: Callable[[list[dict]], Any]
+            Function which writes a list of tweets to the database.
+        max_size: int
+            Number of tweets which triggers a flush.
+        max_age: float
+            Maximum number of seconds a tweet can wait before being flushed.
+        max_pending: int
+            Maximum number of tweets held in memory.
+        """
+
+        self.flush_callback = flush_callback
+        self.max_size = max(1, max_size)
+        self.max_age = max_age
+        self.max_pending = max(self.max_size, max_pending)
+        self._pending = []
+        self._flushing = 0
+        self._oldest = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._pending)
+
+    def add(self, tweet: dict):
+        """Method which appends a tweet to the buffer.
+
+        Blocks while the buffer holds `max_pending` tweets, counting the
+        ones being flushed.
+
+        Parameters
+        ----------
+        tweet: dict
+            JSON-like object to be written.
+
+        Raises
+        ------
+        RuntimeError
+            If the buffer is closed, since the tweet would not be flushed.
+        """
+
+        with self._cond:
+            while (len(self._pending) + self._flushing >= self.max_pending
+                   and not self._closed):
+                self._cond.wait()
+            if self._closed:
+                raise RuntimeError('BUFFER | Buffer is closed.')
+            first = not self._pending
+            if first:
+                self._oldest = time.monotonic()
+            self._pending.append(tweet)
+            # The background thread waits without timeout while the buffer
+            # is empty, so it must be woken up to start the age countdown
+            if first or len(self._pending) >= self.max_size:
+                self._cond.notify_all()
+
+    def flush(self):
+        """Method which writes every pending tweet to the database.
+
+        Tweets which could not be written are put back into the buffer and
+        the exception is raised again.
+        """
+
+        with self._flush_lock:
+            with self._cond:
+                batch = self._pending
+                self._pending = []
+                self._flushing = len(batch)
+                self._oldest = None
+
+            written = 0
+            try:
+                while written < len(batch):
+                    chunk = batch[written:written + self.max_size]
+                    self.flush_callback(chunk)
+                    written += len(chunk)
+            except Exception:
+                with self._cond:
+                    self._pending[:0] = batch[written:]
+                    self._oldest = time.monotonic()
+                raise
+            finally:
+                with self._cond:
+                    self._flushing = 0
+                    self._cond.notify_all()
+            return written
+
+    def close(self):
+        """
+        Method which stops the background thread and flushes the buffer. It
+        is run at exit, so if the flush fails the tweets left are logged as
+        lost instead of raising.
+
+        Returns
+        -------
+        int
+            Number of tweets lost.
+        """
+
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        try:
+            self.flush()
+        except Exception as e:
+            message = 'BUFFER | {} tweets lost, flush failed on close: {}'
+            message = message.format(len(self), e)
+            print(message)
+            logging.error(message)
+            return len(self)
+        return 0
+
+    def _due(self):
+        """
+        Submethod which checks whether the buffer must be flushed. It must be
+        called while holding the condition lock.
+        """
+
+        if len(self._pending) >= self.max_size:
+            return True
+        return (self._oldest is not None
+                and time.monotonic() - self._oldest >= self.max_age)
+
+    def _run(self):
+        """
+        Submethod executed by the background thread. Waits until the buffer
+        is due and flushes it.
+        """
+
+        while True:
+            with self._cond:
+                while not self._closed and not self._due():
+                    timeout = None
+                    if self._oldest is not None:
+                        timeout = max(
+                            0, self.max_age - (time.monotonic() - self._oldest)
+                        )
+                    self._cond.wait(timeout)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                message = 'BUFFER | Flush failed, retrying in {}s: {}'.format(
+                    STREAM_BUFFER_RETRY_DELAY, e)
+                print(message)
+                logging.error(message)
+                with self._cond:
+                    self._cond.wait_for(
+                        lambda: self._closed, STREAM_BUFFER_RETRY_DELAY
+                    )
@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+from modules.BatchCoordinator import BatchCoordinator
+from modules.SharedState import MemorySharedState, SQLiteSharedState
+
+class FakeCrawler():
+
+    def __init__(self, fail=()):
+        self.fail = fail
+        self.sessions = []
+
+    def crawl_tweets(self, session_id=None, job=None, **params):
+        job.check_cancelled()
+        if params['query'] in self.fail:
+            raise RuntimeError('search failed')
+        self.sessions.append(session_id)
+        job.pages += 1
+        job.tweets += 3
+        return session_id
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def state(request, tmp_path):
+    if request.param == 'memory':
+        return MemorySharedState()
+    return SQLiteSharedState(str(tmp_path / 'state.sqlite'))
+
+def run(coordinator, crawl_id):
+    coordinator.start()
+    deadline = time.time() + 5
+    while coordinator.get(crawl_id)['status'] == 'running':
+        assert time.time() < deadline
+        time.sleep(0.01)
+    coordinator.shutdown()
+    return coordinator.get(crawl_id)
+
+def test_merges_the_tweets_written_by_every_shard(state):
+    crawler = FakeCrawler()
+    coordinator = BatchCoordinator(crawler, state, workers=2, interval=0.01)
+    crawl = coordinator.submit(queries=['ikea', 'malm', 'billy'])
+    crawl = run(coordinator, crawl['id'])
+    assert crawl['status'] == 'done'
+    assert (crawl['pages'], crawl['tweets']) == (3, 9)
+    assert set(crawler.sessions) == {crawl['id']}
+
+def test_failed_shard_is_retried_then_fails_the_crawl(state):
+    crawler = FakeCrawler(fail=('malm',))
+    coordinator = BatchCoordinator(crawler, state, workers=1, interval=0.01,
+                                   max_attempts=2)
+    crawl = coordinator.submit(queries=['ikea', 'malm'])
+    crawl = run(coordinator, crawl['id'])
+    assert crawl['status'] == 'failed'
+    failed = [shard for shard in crawl['shard_list']
+              if shard['status'] == 'failed']
+    assert [shard['attempts'] for shard in failed] == [2]
+    assert crawl['tweets'] == 3
+
+def test_expired_shard_is_claimed_again(state):
+    coordinator = BatchCoordinator(FakeCrawler(), state)
+    crawl = coordinator.submit(query='ikea')
+    shard = state.claim_shard('dead-worker', 0.05)
+    assert state.claim_shard('worker', 60) is None
+    time.sleep(0.1)
+    claimed = state.claim_shard('worker', 60)
+    assert (claimed['id'], claimed['attempts']) == (shard['id'], 2)
+    assert not state.update_shard(shard['id'], 'dead-worker', {})
+    assert crawl['id'] == claimed['crawl_id']
+
+@pytest.mark.parametrize('params', [
+    {'query': 'ikea', 'langs': 'es'},
+    {'queries': 'ikea'},
+    {'queries': ['ikea', 1]},
+    {'query': 'ikea', 'count': 0},
+    {'query': 'ikea', 'total': '100'},
+    {'query': 'ikea', 'since': '2021-03-01', 'days': -1},
+    {'query': 'ikea', 'count': True},
+    {'query': 'ikea', 'priority': 'high'}
+])
+def test_invalid_params_are_rejected(state, params):
+    coordinator = BatchCoordinator(FakeCrawler(), state)
+    with pytest.raises(ValueError):
+        coordinator.submit(**params)
+    assert coordinator.list() == []
@@ -0,0 +1,77 @@
+import time
+import threading
+
+from modules.RateLimitScheduler import SEARCH_ENDPOINT, RateLimitScheduler
+from modules.SharedState import MemorySharedState
+
+class FakeSession():
+
+    def __init__(self):
+        self.hooks = {'response': []}
+
+class FakeAPI():
+
+    def __init__(self):
+        self.session = FakeSession()
+
+class FakeResponse():
+
+    def __init__(self, url, headers):
+        self.url = url
+        self.headers = headers
+
+def make_scheduler(keys, limit, window=60):
+    apis = {key: FakeAPI() for key in keys}
+    scheduler = RateLimitScheduler(MemorySharedState(), apis, window=window,
+                                   poll_interval=0.01)
+    scheduler.limits[SEARCH_ENDPOINT] = limit
+    return scheduler, apis
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+def test_credentials_take_turns():
+    scheduler, _ = make_scheduler(['a', 'b'], limit=2)
+    keys = [scheduler.acquire(SEARCH_ENDPOINT) for _ in range(4)]
+    assert keys == ['a', 'b', 'a', 'b']
+    status = scheduler.status()[SEARCH_ENDPOINT]
+    assert status['remaining'] == 0
+
+def test_higher_priority_is_served_first_once_reset():
+    scheduler, _ = make_scheduler(['a'], limit=1)
+    bucket = '{}|a'.format(SEARCH_ENDPOINT)
+    scheduler.acquire(SEARCH_ENDPOINT)
+    served = []
+
+    def acquire(priority):
+        scheduler.acquire(SEARCH_ENDPOINT, priority)
+        served.append(priority)
+
+    low = threading.Thread(target=acquire, args=(0,))
+    low.start()
+    wait_until(lambda: scheduler.queued == 1)
+    high = threading.Thread(target=acquire, args=(1,))
+    high.start()
+    wait_until(lambda: scheduler.queued == 2)
+    scheduler.state.update_rate_limit(bucket, 1, time.time() + 60)
+    wait_until(lambda: served == [1])
+    scheduler.state.update_rate_limit(bucket, 1, time.time() + 60)
+    low.join(5)
+    high.join(5)
+    assert served == [1, 0]
+
+def test_response_headers_overwrite_the_budget():
+    scheduler, apis = make_scheduler(['a'], limit=180)
+    reset_at = time.time() + 60
+    hook = apis['a'].session.hooks['response'][0]
+    hook(FakeResponse('https://api.twitter.com/1.1/search/tweets.json', {
+        'x-rate-limit-limit': '450',
+        'x-rate-limit-remaining': '0',
+        'x-rate-limit-reset': str(reset_at)
+    }))
+    status = scheduler.status()[SEARCH_ENDPOINT]
+    assert (status['limit'], status['remaining']) == (450, 0)
+    assert status['available_at'] == reset_at
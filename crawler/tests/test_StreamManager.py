@@ -0,0 +1,169 @@
+import time
+
+from modules.CrawlSessions import CrawlSessions
+from modules.SharedState import MemorySharedState
+from modules.StreamManager import StreamManager
+
+class FakeQueue():
+
+    def drain(self, timeout=None):
+        return True
+
+class FakeCrawler():
+
+    running = False
+    thread = None
+
+    def __init__(self):
+        self.router = None
+        self.queue = FakeQueue()
+        self.tracks = []
+
+    def start_session(self):
+        pass
+
+    def filter(self, track, threaded=False):
+        self.tracks.append(track)
+
+    def disconnect(self):
+        pass
+
+    def publish(self, tweets):
+        pass
+
+class FakeStore():
+
+    def __init__(self):
+        self.tweets = []
+
+    def write(self, tweets):
+        self.tweets.extend(tweets)
+
+def make_manager(streams):
+    store = FakeStore()
+    manager = StreamManager(FakeCrawler(), MemorySharedState(),
+                            {'main': store}, store, CrawlSessions())
+    for name, track in streams:
+        manager.start_stream(name, track)
+    return manager, store
+
+def received(manager, name):
+    return manager.get_stream(name)['counters']['received']
+
+def tweet(text, **raw):
+    return {'id': '1', 'text': text}, dict(raw, text=text)
+
+def test_sole_stream_receives_every_tweet():
+    manager, _ = make_manager([('a', 'ikea')])
+    manager.route(*tweet('nothing to see here'))
+    assert received(manager, 'a') == 1
+
+def test_routes_by_phrases():
+    manager, _ = make_manager([('a', 'ikea'), ('b', 'billy shelf')])
+    manager.route(*tweet('my new billy shelf'))
+    manager.route(*tweet('ikea opens today'))
+    assert received(manager, 'a') == 1
+    assert received(manager, 'b') == 1
+
+def test_routes_by_raw_fields():
+    manager, _ = make_manager([('a', 'ikea'), ('b', 'malm')])
+    manager.route(*tweet('RT @someone: look', retweeted_status={
+        'text': 'look', 'extended_tweet': {'full_text': 'look, a malm'}}))
+    manager.route(*tweet('look', entities={
+        'urls': [{'expanded_url': 'https://www.ikea.com'}]}))
+    assert received(manager, 'a') == 1
+    assert received(manager, 'b') == 1
+
+def test_unmatched_tweets_go_to_catch_all_stream():
+    manager, _ = make_manager([('default', 'ikea'), ('b', 'malm')])
+    manager.route(*tweet('nothing to see here'))
+    assert received(manager, 'default') == 1
+    assert received(manager, 'b') == 0
+
+def test_unmatched_tweets_go_to_every_stream_without_catch_all():
+    manager, _ = make_manager([('a', 'ikea'), ('b', 'malm')])
+    manager.route(*tweet('nothing to see here'))
+    assert received(manager, 'a') == 1
+    assert received(manager, 'b') == 1
+
+def test_tweets_are_saved_with_stream_session():
+    manager, store = make_manager([('a', 'ikea'), ('b', 'malm')])
+    manager.route(*tweet('ikea and malm'))
+    manager.close()
+    sessions = {manager.get_stream(name)['session_id'] for name in 'ab'}
+    assert {saved['session_id'] for saved in store.tweets} == sessions
+
+def test_pending_sums_every_stream_buffer():
+    manager, store = make_manager([('a', 'ikea'), ('b', 'malm')])
+    manager.route(*tweet('ikea and malm'))
+    assert manager.pending == 2
+    manager.close()
+    assert manager.pending == 0
+
+def test_tweets_not_flushed_on_close_are_counted_as_lost():
+    manager, store = make_manager([('a', 'ikea')])
+    manager.route(*tweet('ikea'))
+    store.write = lambda tweets: 1 / 0
+    manager.close()
+    counters = manager.get_stream('a')['counters']
+    assert (counters['saved'], counters['lost']) == (0, 1)
+
+def test_tweets_routed_to_a_stream_being_closed_are_saved():
+    manager, store = make_manager([('a', 'ikea')])
+    # A worker which read the stream before it was stopped
+    stream = manager._streams['a']
+    manager.stop_stream('a')
+    stream.add(tweet('ikea')[0])
+    assert [saved['id'] for saved in store.tweets] == ['1']
+    manager.close()
+
+class FakeSpool():
+
+    def __init__(self):
+        self.tweets = []
+
+    def append(self, tweets):
+        self.tweets.extend(tweets)
+
+def test_named_sinks_go_through_their_own_spool():
+    store, spool, sink_spool = FakeStore(), FakeSpool(), FakeSpool()
+    manager = StreamManager(FakeCrawler(), MemorySharedState(),
+                            {'main': store}, store, CrawlSessions(), spool,
+                            {'main': sink_spool})
+    manager.start_stream('a', 'ikea', sink='main')
+    manager.start_stream('b', 'malm')
+    manager.route(*tweet('ikea and malm'))
+    manager.close()
+    assert store.tweets == []
+    assert ([tweet['session_id'] for tweet in sink_spool.tweets]
+            == [manager.get_stream('a')['session_id']])
+    assert ([tweet['session_id'] for tweet in spool.tweets]
+            == [manager.get_stream('b')['session_id']])
+
+def test_spooled_tweets_are_counted_once_written():
+    store, spool, sessions = FakeStore(), FakeSpool(), CrawlSessions()
+    manager = StreamManager(FakeCrawler(), MemorySharedState(), {}, store,
+                            sessions, spool)
+    manager.start_stream('a', 'ikea')
+    manager.route(*tweet('ikea'))
+    manager._streams['a'].buffer.flush()
+    assert len(spool.tweets) == 1
+    assert manager.get_stream('a')['counters']['saved'] == 0
+    # As the spool does once the tweets are written
+    sessions.record(spool.tweets)
+    assert manager.get_stream('a')['counters']['saved'] == 1
+    manager.close()
+
+def test_only_the_lease_owner_connects_until_the_lease_expires():
+    state, store = MemorySharedState(), FakeStore()
+    first, second = (
+        StreamManager(FakeCrawler(), state, {}, store, CrawlSessions(),
+                      lease_ttl=0.1)
+        for _ in range(2))
+    first.start_stream('a', 'ikea')
+    second.sync()
+    assert (first.crawler.tracks, second.crawler.tracks) == ([['ikea']], [])
+    time.sleep(0.2)
+    second.sync()
+    assert second.crawler.tracks == [['ikea']]
+    assert state.get_lease('stream-connection')['owner'] == second.owner
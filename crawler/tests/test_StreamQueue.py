@@ -0,0 +1,72 @@
+import threading
+
+import pytest
+
+from modules.StreamQueue import StreamQueue
+
+class GatedHandler():
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.started = threading.Event()
+        self.handled = []
+
+    def __call__(self, raw_data):
+        self.started.set()
+        self.gate.wait(5)
+        if isinstance(raw_data, bytes):
+            raw_data = raw_data.decode('utf-8')
+        self.handled.append(raw_data)
+
+def fill(stream_queue, handler, messages):
+    """Puts the first message, which keeps the only worker busy, and then
+    the rest."""
+
+    stream_queue.put(messages[0])
+    assert handler.started.wait(2)
+    for message in messages[1:]:
+        stream_queue.put(message)
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        StreamQueue(lambda raw_data: None, policy='ignore')
+
+def test_drop_oldest_discards_queued_message():
+    handler = GatedHandler()
+    stream_queue = StreamQueue(handler, workers=1, max_size=2,
+                               policy='drop_oldest')
+    fill(stream_queue, handler, ['m0', 'm1', 'm2', 'm3'])
+    handler.gate.set()
+    assert stream_queue.drain(2)
+    assert handler.handled == ['m0', 'm2', 'm3']
+    assert stream_queue.stats()['dropped'] == 1
+    stream_queue.stop(1)
+
+def test_spill_replays_messages_in_order(tmp_path):
+    handler = GatedHandler()
+    spill_path = str(tmp_path / 'spill.ndjson')
+    stream_queue = StreamQueue(handler, workers=1, max_size=2,
+                               policy='spill', spill_path=spill_path)
+    fill(stream_queue, handler, ['m0', 'm1', 'm2', 'm3', 'm4'])
+    assert stream_queue.stats()['spill_pending'] == 2
+    handler.gate.set()
+    assert stream_queue.drain(5)
+    assert handler.handled == ['m0', 'm1', 'm2', 'm3', 'm4']
+    assert not (tmp_path / 'spill.ndjson').exists()
+    stream_queue.stop(1)
+
+def test_block_waits_for_room():
+    handler = GatedHandler()
+    stream_queue = StreamQueue(handler, workers=1, max_size=1,
+                               policy='block')
+    fill(stream_queue, handler, ['m0', 'm1'])
+    put = threading.Thread(target=stream_queue.put, args=('m2',),
+                           daemon=True)
+    put.start()
+    put.join(0.1)
+    assert put.is_alive()
+    handler.gate.set()
+    put.join(2)
+    assert stream_queue.drain(2)
+    assert handler.handled == ['m0', 'm1', 'm2']
+    stream_queue.stop(1)
@@ -0,0 +1,102 @@
+import os
+
+import pytest
+
+from modules.TweetSpool import SpoolLocked, TweetSpool
+
+class Sink():
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.written = []
+        self.retries = []
+
+    def __call__(self, tweets, retry):
+        if self.fail:
+            raise RuntimeError('database unavailable')
+        self.written.extend(tweets)
+        self.retries.append(retry)
+
+def ids(tweets):
+    return [tweet['id'] for tweet in tweets]
+
+def test_replays_across_segments(tmp_path):
+    sink = Sink()
+    spool = TweetSpool(str(tmp_path), sink, segment_bytes=64, batch_size=3)
+    for i in range(10):
+        spool.append([{'id': str(i), 'text': 'x' * 20}])
+    assert spool.drain(5)
+    assert ids(sink.written) == [str(i) for i in range(10)]
+    spool.close(1)
+    # Replayed segments are removed, only the active one is kept
+    segments = [name for name in os.listdir(str(tmp_path))
+                if name.startswith('segment-')]
+    assert len(segments) == 1
+
+def test_resumes_replay_after_restart(tmp_path):
+    spool = TweetSpool(str(tmp_path), Sink(fail=True))
+    spool.append([{'id': '1'}, {'id': '2'}])
+    assert not spool.drain(0.2)
+    spool.close(0.1)
+
+    sink = Sink()
+    spool = TweetSpool(str(tmp_path), sink)
+    spool.append([{'id': '3'}])
+    assert spool.drain(5)
+    assert ids(sink.written) == ['1', '2', '3']
+    spool.close(1)
+
+def test_flags_batches_which_may_have_been_written(tmp_path):
+    sink = Sink(fail=True)
+    spool = TweetSpool(str(tmp_path), sink)
+    spool.append([{'id': '1'}])
+    assert not spool.drain(0.2)
+    spool.close(0.1)
+
+    sink = Sink()
+    spool = TweetSpool(str(tmp_path), sink)
+    assert spool.drain(5)
+    spool.append([{'id': '2'}])
+    assert spool.drain(5)
+    assert sink.retries == [True, False]
+    spool.close(1)
+
+def test_does_not_replay_twice_after_restart(tmp_path):
+    sink = Sink()
+    spool = TweetSpool(str(tmp_path), sink)
+    spool.append([{'id': '1'}])
+    assert spool.drain(5)
+    spool.close(1)
+
+    spool = TweetSpool(str(tmp_path), sink)
+    spool.append([{'id': '2'}])
+    assert spool.drain(5)
+    assert ids(sink.written) == ['1', '2']
+    spool.close(1)
+
+def test_truncates_partial_line(tmp_path):
+    with open(str(tmp_path / 'segment-000000000001.ndjson'), 'wb') as f:
+        f.write(b'{"id": "1"}\n{"id": "2", "te')
+    sink = Sink()
+    spool = TweetSpool(str(tmp_path), sink)
+    assert spool.drain(5)
+    assert ids(sink.written) == ['1']
+    spool.close(1)
+
+def test_folder_is_used_by_one_spool_at_a_time(tmp_path):
+    spool = TweetSpool(str(tmp_path), Sink())
+    with pytest.raises(SpoolLocked):
+        TweetSpool(str(tmp_path), Sink())
+    spool.close(1)
+    TweetSpool(str(tmp_path), Sink()).close(1)
+
+def test_claim_takes_the_first_free_folder(tmp_path):
+    first = TweetSpool.claim(str(tmp_path), Sink())
+    second = TweetSpool.claim(str(tmp_path), Sink())
+    assert (os.path.basename(first.path), os.path.basename(second.path)) == (
+        'process-0', 'process-1')
+    first.close(1)
+    third = TweetSpool.claim(str(tmp_path), Sink())
+    assert os.path.basename(third.path) == 'process-0'
+    second.close(1)
+    third.close(1)
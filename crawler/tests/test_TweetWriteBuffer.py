@@ -0,0 +1,103 @@
+import time
+import threading
+
+import pytest
+
+from modules.TweetWriteBuffer import TweetWriteBuffer
+
+class FailingSink():
+
+    def __init__(self, fail=True):
+        self.fail = fail
+        self.written = []
+
+    def __call__(self, tweets):
+        if self.fail:
+            raise RuntimeError('database unavailable')
+        self.written.extend(tweets)
+
+def wait_until(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+def test_flushes_by_age():
+    sink = FailingSink(fail=False)
+    buffer = TweetWriteBuffer(sink, max_size=100, max_age=0.05)
+    buffer.add({'id': 1})
+    buffer.add({'id': 2})
+    assert sink.written == []
+    wait_until(lambda: len(sink.written) == 2)
+    assert len(buffer) == 0
+    buffer.close()
+
+def test_flushes_by_size():
+    sink = FailingSink(fail=False)
+    buffer = TweetWriteBuffer(sink, max_size=3, max_age=60)
+    for i in range(3):
+        buffer.add({'id': i})
+    wait_until(lambda: len(sink.written) == 3)
+    buffer.close()
+
+def test_failed_flush_requeues_in_order():
+    sink = FailingSink()
+    buffer = TweetWriteBuffer(sink, max_size=10, max_age=60)
+    buffer.add({'id': 1})
+    buffer.add({'id': 2})
+    with pytest.raises(RuntimeError):
+        buffer.flush()
+    buffer.add({'id': 3})
+    sink.fail = False
+    buffer.flush()
+    assert [tweet['id'] for tweet in sink.written] == [1, 2, 3]
+    buffer.close()
+
+def test_add_blocks_while_flush_in_flight_fills_buffer():
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_failing(tweets):
+        started.set()
+        release.wait(2)
+        raise RuntimeError('database unavailable')
+
+    buffer = TweetWriteBuffer(slow_failing, max_size=2, max_age=60,
+                              max_pending=2)
+    buffer.add({'id': 1})
+    buffer.add({'id': 2})
+    assert started.wait(2)
+    added = threading.Event()
+    rejected = threading.Event()
+
+    def produce():
+        try:
+            buffer.add({'id': 3})
+            added.set()
+        except RuntimeError:
+            rejected.set()
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    # The two tweets being flushed still count towards max_pending
+    assert not added.wait(0.1)
+    release.set()
+    wait_until(lambda: len(buffer) == 2)
+    assert not added.is_set()
+    buffer.close()
+    # The blocked tweet is rejected instead of being added to a closed buffer
+    assert rejected.wait(2)
+    assert not added.is_set()
+
+def test_add_after_close_raises():
+    sink = FailingSink(fail=False)
+    buffer = TweetWriteBuffer(sink, max_size=10, max_age=60)
+    buffer.close()
+    with pytest.raises(RuntimeError):
+        buffer.add({'id': 1})
+
+def test_close_logs_lost_tweets_instead_of_raising(capsys):
+    buffer = TweetWriteBuffer(FailingSink(), max_size=10, max_age=60)
+    buffer.add({'id': 1})
+    assert buffer.close() == 1
+    assert '1 tweets lost' in capsys.readouterr().out
@@ -0,0 +1,76 @@
+import pytest
+
+import utils.gcp_utils as gcp_utils
+from benchmarks.fakes import FakeBigQueryClient
+from modules.TweetStore import BigQueryTweetStore
+
+@pytest.fixture
+def paths(monkeypatch):
+    calls = []
+    monkeypatch.setattr(gcp_utils, 'BQ_STREAMING_MAX_ROWS', 2)
+    monkeypatch.setattr(gcp_utils, 'insert_data_to_bq',
+                        lambda db, data: calls.append(('insert', len(data))))
+    monkeypatch.setattr(gcp_utils, 'upload_data_to_bq',
+                        lambda db, data: calls.append(('upload', len(data))))
+    return calls
+
+def test_path_is_chosen_by_batch_size(paths):
+    db = FakeBigQueryClient()
+    gcp_utils.write_tweets(db, [{'id': '1', 'crawler': 'batch'}])
+    gcp_utils.write_tweets(db, [{'id': str(i), 'crawler': 'streaming'}
+                                for i in range(3)])
+    assert paths == [('insert', 1), ('upload', 3)]
+
+def test_retried_batches_are_merged(paths):
+    gcp_utils.write_tweets(FakeBigQueryClient(), [{'id': '1'}], retry=True)
+    assert paths == [('upload', 1)]
+
+class QueryJob():
+
+    total_bytes_processed = 0
+    total_bytes_billed = 0
+
+    def result(self):
+        return [{'total': 3}]
+
+class RecordingClient(FakeBigQueryClient):
+
+    def __init__(self):
+        super().__init__()
+        self.queries = []
+
+    def query(self, query, job_config=None, location=None):
+        self.queries.append(query)
+        return QueryJob()
+
+def test_session_count_reads_the_sessions_table():
+    db = RecordingClient()
+    assert gcp_utils.count_tweets(db, {'session_id': 'a'}) == 3
+    assert gcp_utils.SESSIONS_TABLENAME in db.queries[0]
+
+def test_count_and_lookup_require_a_date_bound():
+    db = RecordingClient()
+    with pytest.raises(ValueError):
+        gcp_utils.count_tweets(db, {'crawler': 'streaming'})
+    with pytest.raises(ValueError):
+        gcp_utils.get_by_ids(db, ['1'])
+    assert db.queries == []
+    gcp_utils.count_tweets(db, {'since': '2021-03-01 00:00:00'})
+    assert len(db.queries) == 1
+
+def test_session_bounds_are_reused_by_the_next_pages(monkeypatch):
+    bounds = []
+    monkeypatch.setattr(gcp_utils, 'load_schema', lambda: None)
+    monkeypatch.setattr(
+        gcp_utils, 'get_session_bounds',
+        lambda db, session_id: bounds.append(session_id) or (
+            '2021-03-01 00:00:00', '2021-03-02 00:00:00', 10))
+    monkeypatch.setattr(
+        gcp_utils, 'get_by_session',
+        lambda db, session_id, limit, after, fields, start, end: (
+            [], '1', 5))
+    store = BigQueryTweetStore(RecordingClient())
+    assert store.get_by_session('a', 10)[2] == 15
+    assert store.get_by_session('a', 10, after='2')[2] == 5
+    assert store.get_by_session('a', 10)[2] == 15
+    assert bounds == ['a', 'a']
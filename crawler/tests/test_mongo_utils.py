@@ -0,0 +1,72 @@
+from datetime import datetime
+
+import mongomock
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+import utils.mongo_utils as mongo_utils
+
+def make_db(monkeypatch):
+    monkeypatch.setattr(mongo_utils, 'MONGODB_COLLECTION', 'tweets')
+    db = mongomock.MongoClient().db
+    mongo_utils.ensure_indexes(db)
+    return db
+
+def test_upsert_is_idempotent(monkeypatch):
+    db = make_db(monkeypatch)
+    tweet = {'id': '1', 'text': 'hej', 'interactions': 1, 'session_id': 'a'}
+    mongo_utils.upsert_tweets(db, [tweet])
+    mongo_utils.upsert_tweets(db, [tweet])
+    assert db.tweets.count_documents({}) == 1
+
+def test_upsert_updates_tweet_but_keeps_first_session(monkeypatch):
+    db = make_db(monkeypatch)
+    mongo_utils.upsert_tweets(db, [
+        {'id': '1', 'text': 'hej', 'interactions': 1, 'session_id': 'a'}])
+    mongo_utils.upsert_tweets(db, [
+        {'id': '1', 'text': 'hej', 'interactions': 5, 'session_id': 'b'}])
+    tweet = db.tweets.find_one({'id': '1'})
+    assert tweet['interactions'] == 5
+    assert tweet['session_id'] == 'a'
+    assert tweet['session_ids'] == ['a', 'b']
+
+def test_tweet_is_listed_and_counted_by_every_session(monkeypatch):
+    db = make_db(monkeypatch)
+    mongo_utils.upsert_tweets(db, [{'id': '1', 'session_id': 'a'},
+                                   {'id': '2', 'session_id': 'a'}])
+    mongo_utils.upsert_tweets(db, [{'id': '2', 'session_id': 'b'}])
+    records, cursor = mongo_utils.get_by_session(db, 'b', 10, fields=['id'])
+    assert [record['id'] for record in records] == ['2']
+    assert mongo_utils.count_tweets(db, {'session_id': 'a'}) == 2
+    assert mongo_utils.count_tweets(db, {'session_id': 'b'}) == 1
+
+def test_upsert_does_not_modify_given_tweets(monkeypatch):
+    db = make_db(monkeypatch)
+    tweets = [{'id': '1', 'session_id': 'a'}]
+    mongo_utils.upsert_tweets(db, tweets)
+    assert tweets == [{'id': '1', 'session_id': 'a'}]
+
+def test_duplicates_are_only_removed_when_enabled(monkeypatch):
+    monkeypatch.setattr(mongo_utils, 'MONGODB_COLLECTION', 'tweets')
+    db = mongomock.MongoClient().db
+    db.tweets.insert_many([{'id': '1'}, {'id': '1'}])
+    with pytest.raises(DuplicateKeyError):
+        mongo_utils.ensure_indexes(db)
+    assert db.tweets.count_documents({}) == 2
+    monkeypatch.setattr(mongo_utils, 'MONGODB_REMOVE_DUPLICATES', True)
+    mongo_utils.ensure_indexes(db)
+    assert db.tweets.count_documents({}) == 1
+
+def test_only_streamed_tweets_are_appended_to_timeseries(monkeypatch):
+    db = make_db(monkeypatch)
+    monkeypatch.setattr(mongo_utils, 'MONGODB_STREAM_TIMESERIES', 'stream')
+    tweets = [{'id': '1', 'crawler': 'streaming',
+               'created_at': '2021-03-01 10:00:00'},
+              {'id': '2', 'crawler': 'batch',
+               'created_at': '2021-03-01 10:00:00'}]
+    mongo_utils.append_stream_tweets(db, tweets)
+    mongo_utils.append_stream_tweets(db, tweets[:1])
+    documents = list(db.stream.find({}, {'_id': 0}))
+    assert [document['id'] for document in documents] == ['1', '1']
+    assert documents[0]['created_at'] == datetime(2021, 3, 1, 10)
+    assert tweets[0]['created_at'] == '2021-03-01 10:00:00'
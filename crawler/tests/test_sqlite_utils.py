@@ -0,0 +1,24 @@
+import utils.sqlite_utils as sqlite_utils
+
+def test_upsert_keeps_first_session(tmp_path):
+    db = sqlite_utils.connect(str(tmp_path / 'tweets.sqlite'))
+    sqlite_utils.upsert_tweets(db, [{'id': '1', 'interactions': 1,
+                                     'session_id': 'a'}])
+    sqlite_utils.upsert_tweets(db, [{'id': '1', 'interactions': 5,
+                                     'session_id': 'b'}])
+    rows = db.execute('SELECT interactions, session_id FROM tweets').fetchall()
+    assert [tuple(row) for row in rows] == [('5', 'a')]
+
+def test_tweet_is_listed_and_counted_by_every_session(tmp_path):
+    db = sqlite_utils.connect(str(tmp_path / 'tweets.sqlite'))
+    sqlite_utils.upsert_tweets(db, [{'id': '1', 'session_id': 'a'},
+                                    {'id': '2', 'session_id': 'a'}])
+    sqlite_utils.upsert_tweets(db, [{'id': '2', 'session_id': 'b'},
+                                    {'id': '3', 'session_id': 'b'}])
+    records, cursor = sqlite_utils.get_by_session(db, 'b', 1, fields=['id'])
+    assert ([record['id'] for record in records], cursor) == (['3'], '3')
+    records, cursor = sqlite_utils.get_by_session(db, 'b', 1, cursor,
+                                                  fields=['id'])
+    assert [record['id'] for record in records] == ['2']
+    assert sqlite_utils.count_tweets(db, {'session_id': 'a'}) == 2
+    assert sqlite_utils.count_tweets(db, {'session_id': 'b'}) == 2
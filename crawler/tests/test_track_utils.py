@@ -0,0 +1,39 @@
+import utils.track_utils as track_utils
+
+def test_parse_track_splits_phrases_and_terms():
+    assert track_utils.parse_track('IKEA, billy shelf,ikea,, #hej') == [
+        ('ikea',), ('billy', 'shelf'), ('#hej',)]
+
+def test_union_merges_tracks():
+    assert track_utils.union([
+        track_utils.parse_track('ikea,billy shelf'),
+        track_utils.parse_track('ikea,malm')
+    ]) == ['billy shelf', 'ikea', 'malm']
+
+def test_tokenize_matches_hashtags_and_mentions():
+    tokens = track_utils.tokenize('Bought a #Billy from @IKEA')
+    assert {'#billy', 'billy', '@ikea', 'ikea'} <= tokens
+
+def test_matches_requires_every_term_of_a_phrase():
+    phrases = track_utils.parse_track('billy shelf,malm')
+    assert track_utils.matches(phrases, {'billy', 'shelf', 'new'})
+    assert track_utils.matches(phrases, {'malm'})
+    assert not track_utils.matches(phrases, {'billy'})
+
+def test_tokenize_tweet_reads_every_matched_field():
+    tweet = {
+        'text': 'RT @someone: look at this…',
+        'extended_tweet': {'full_text': 'look at this billy'},
+        'entities': {
+            'urls': [{'expanded_url': 'https://www.ikea.com/es/'}],
+            'user_mentions': [{'screen_name': 'IKEASpain'}]
+        },
+        'retweeted_status': {'text': 'a malm dresser'},
+        'quoted_status': {
+            'text': 'see',
+            'extended_tweet': {'full_text': 'see the kallax'}
+        }
+    }
+    tokens = track_utils.tokenize_tweet(tweet)
+    assert {'billy', 'ikea', 'ikeaspain', '@ikeaspain', 'malm',
+            'kallax'} <= tokens
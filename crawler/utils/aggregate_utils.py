@@ -0,0 +1,129 @@
+import re
+from collections import Counter
+from typing import Iterable, List
+
+# Length of the `created_at` prefix which identifies each time bucket
+INTERVALS = {'minute': 16, 'hour': 13, 'day': 10}
+WORD_KINDS = ('hashtag', 'term')
+MIN_TERM_LENGTH = 4
+INTERACTION_FIELDS = ('favorite_count', 'retweet_count', 'quote_count',
+                      'reply_count')
+TAG_REGEX = re.compile(r'<[^>]+>')
+EDGE_PUNCTUATION = '.,;:!?¡¿"\'()[]{}…'
+
+def source_name(source: str):
+    """Method which extracts the name of the client a tweet was sent from,
+    removing the HTML anchor Twitter wraps it with.
+
+    Parameters
+    ----------
+    source: str
+        `source` field of the tweet.
+    """
+
+    if not source:
+        return 'unknown'
+    return TAG_REGEX.sub('', source).strip() or 'unknown'
+
+def normalize_word(word: str, kind: str):
+    """Method which normalizes a word of a tweet text and tells whether it
+    must be counted as a hashtag or a term.
+
+    Terms are words of at least `MIN_TERM_LENGTH` characters which are not
+    hashtags, mentions nor links.
+
+    Parameters
+    ----------
+    word: str
+        Word split by whitespace.
+    kind: str
+        Either 'hashtag' or 'term'.
+
+    Returns
+    -------
+    str
+        Lowercased word, or None if it must not be counted.
+    """
+
+    word = word.strip(EDGE_PUNCTUATION).lower()
+    if kind == 'hashtag':
+        return word if len(word) > 1 and word.startswith('#') else None
+    if (len(word) < MIN_TERM_LENGTH or word[0] in '#@'
+            or word.startswith('http')):
+        return None
+    return word
+
+def top_words(texts: Iterable[str], kind: str, limit: int):
+    """Method which counts the most frequent hashtags or terms of a set of
+    tweet texts.
+
+    Parameters
+    ----------
+    texts: Iterable[str]
+        Tweet texts.
+    kind: str
+        Either 'hashtag' or 'term'.
+    limit: int
+        Number of words to return.
+    """
+
+    counts = Counter()
+    for text in texts:
+        for word in (text or '').split():
+            word = normalize_word(word, kind)
+            if word is not None:
+                counts[word] += 1
+    return [{'term': word, 'count': count}
+            for word, count in counts.most_common(limit)]
+
+def merge_words(rows: Iterable[dict], kind: str, limit: int):
+    """Method which normalizes the words counted by a database and merges the
+    counts of those which become equal.
+
+    Parameters
+    ----------
+    rows: Iterable[dict]
+        Rows with the `term` and `count` fields.
+    kind: str
+        Either 'hashtag' or 'term'.
+    limit: int
+        Number of words to return.
+    """
+
+    counts = Counter()
+    for row in rows:
+        word = normalize_word(row['term'], kind)
+        if word is not None:
+            counts[word] += row['count']
+    return [{'term': word, 'count': count}
+            for word, count in counts.most_common(limit)]
+
+def merge_sources(rows: Iterable[dict], limit: int):
+    """Method which groups the source counts of a database by client name.
+
+    Parameters
+    ----------
+    rows: Iterable[dict]
+        Rows with the raw `source` and `count` fields.
+    limit: int
+        Number of sources to return.
+    """
+
+    counts = Counter()
+    for row in rows:
+        counts[source_name(row['source'])] += row['count']
+    return [{'source': source, 'count': count}
+            for source, count in counts.most_common(limit)]
+
+def sort_timeseries(rows: List[dict]):
+    """Method which sorts the rows of a time series by bucket, crawler and
+    language.
+
+    Parameters
+    ----------
+    rows: list[dict]
+        Rows with the `time`, `crawler`, `lang` and `count` fields.
+    """
+
+    return sorted(rows, key=lambda row: (row['time'], row['crawler'] or '',
+                                         row['lang'] or ''))
@@ -0,0 +1,70 @@
+import json
+from typing import Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DECODER = 'orjson' if orjson is not None else 'json'
+TWEET = 'tweet'
+KEEP_ALIVE = 'keep_alive'
+UNKNOWN = 'unknown'
+CONTROL_MESSAGES = frozenset([
+    'limit', 'delete', 'scrub_geo', 'status_withheld', 'user_withheld',
+    'disconnect', 'warning', 'friends', 'event', 'control'
+])
+
+def loads(raw_data: Union[str, bytes]):
+    """Method which decodes a JSON payload, using orjson if it is installed
+    and the standard library otherwise.
+
+    Parameters
+    ----------
+    raw_data: str | bytes
+        JSON payload.
+    """
+
+    if orjson is not None:
+        return orjson.loads(raw_data)
+    return json.loads(raw_data)
+
+def classify(raw_data: Union[str, bytes]):
+    """Method which tells the kind of a stream message without decoding it.
+
+    Tweets are serialized with `created_at` as their first key. Control
+    messages have a single top-level key naming their kind, such as `limit`,
+    `delete`, `status_withheld` or `disconnect`. Only the first bytes of the
+    message are inspected.
+
+    Parameters
+    ----------
+    raw_data: str | bytes
+        Raw message received from the stream.
+
+    Returns
+    -------
+    str
+        `TWEET`, `KEEP_ALIVE`, the name of the control message, or `UNKNOWN`
+        if the message must be decoded to be classified.
+    """
+
+    if isinstance(raw_data, bytes):
+        raw_data = raw_data[:64].decode('utf-8', 'ignore')
+    else:
+        raw_data = raw_data[:64]
+    raw_data = raw_data.lstrip()
+    if not raw_data:
+        return KEEP_ALIVE
+    if not raw_data.startswith('{'):
+        return UNKNOWN
+    start = raw_data.find('"')
+    end = raw_data.find('"', start + 1)
+    if start < 0 or end < 0:
+        return UNKNOWN
+    key = raw_data[start + 1:end]
+    if key == 'created_at':
+        return TWEET
+    if key in CONTROL_MESSAGES:
+        return key
+    return UNKNOWN
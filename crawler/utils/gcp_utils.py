@@ -1,18 +1,346 @@
 import os
 import json
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime
 from typing import List
 
 from google.cloud import storage
 from google.cloud import bigquery
 
+import utils.metrics_utils as metrics_utils
+
 DATASET = os.environ.get('DATASET')
 TABLENAME = os.environ.get('TABLENAME')
 BUCKETNAME = os.environ.get('BUCKETNAME')
 GOOGLE_CLOUD_PROJECT = os.environ.get('GOOGLE_CLOUD_PROJECT')
+SCHEMA_BLOB = 'schemes/tweets_schema.json'
+SCHEMA_CACHE_TTL = float(os.environ.get('SCHEMA_CACHE_TTL', 300))
+SESSION_BOUNDS_CACHE_TTL = float(
+    os.environ.get('SESSION_BOUNDS_CACHE_TTL', 600))
+CHECKPOINTS_TABLENAME = os.environ.get(
+    'CHECKPOINTS_TABLENAME', 'crawl_checkpoints')
+SESSIONS_TABLENAME = os.environ.get('SESSIONS_TABLENAME', 'tweet_sessions')
+DEFAULT_FIELDS = ['created_at', 'text', 'interactions']
+GET_BY_IDS_CHUNK_SIZE = int(os.environ.get('GET_BY_IDS_CHUNK_SIZE', 10000))
+BQ_INSERT_CHUNK_SIZE = 500
+BQ_STREAMING_MAX_ROWS = int(os.environ.get('BQ_STREAMING_MAX_ROWS', 1000))
+BQ_TIME_FORMATS = {'minute': ('MINUTE', '%Y-%m-%d %H:%M'),
+                   'hour': ('HOUR', '%Y-%m-%d %H'),
+                   'day': ('DAY', '%Y-%m-%d')}
+LOCAL_SCHEMA_PATH = os.environ.get('LOCAL_SCHEMA_PATH', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', SCHEMA_BLOB
+))
+
+_storage_client = None
+_bigquery_client = None
+_schema_cache = {
+    'schema': None,
+    'job_config': None,
+    'etag': None,
+    'checked_at': 0.0
+}
+_schema_lock = threading.Lock()
+_checkpoints_table = None
+_sessions_table = None
+_tweets_table = None
+
+def get_storage_client():
+    """
+    Method which returns the process-wide Cloud Storage client, creating it
+    on first use.
+    """
+
+    global _storage_client
+    if _storage_client is None:
+        _storage_client = storage.Client()
+    return _storage_client
+
+def get_bigquery_client():
+    """
+    Method which returns the process-wide BigQuery client, creating it on
+    first use. The client keeps its HTTP connections open, so it must be
+    reused instead of creating one per request.
+    """
+
+    global _bigquery_client
+    if _bigquery_client is None:
+        _bigquery_client = bigquery.Client()
+    return _bigquery_client
+
+def _build_job_config(table_schema: List[bigquery.SchemaField]):
+    """Submethod which builds the job configuration used to load tweets into
+    a staging table.
+
+    Parameters
+    ----------
+    table_schema: list[google.cloud.bigquery.SchemaField]
+        Parsed schema of the tweets table.
+    """
+
+    return bigquery.LoadJobConfig(
+        schema=table_schema,
+        create_disposition='CREATE_IF_NEEDED',
+        write_disposition='WRITE_TRUNCATE',
+        source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON
+    )
+
+def _read_local_schema():
+    """
+    Submethod which reads the table schema from `LOCAL_SCHEMA_PATH`.
+    """
+
+    with open(LOCAL_SCHEMA_PATH) as f:
+        return json.load(f)
+
+def load_schema(refresh: bool = False):
+    """Method which returns the cached table schema and job configuration.
+
+    The schema is downloaded from the bucket the first time it is needed.
+    Afterwards, the blob ETag is checked at most once every
+    `SCHEMA_CACHE_TTL` seconds, and the schema is only downloaded and parsed
+    again if it has changed. If the bucket can not be reached and there is
+    no cached schema, the local `schemes/tweets_schema.json` is used.
+
+    Parameters
+    ----------
+    refresh: bool
+        If True, the ETag is checked regardless of the TTL.
+
+    Returns
+    -------
+    tuple[list[google.cloud.bigquery.SchemaField],
+          google.cloud.bigquery.LoadJobConfig]
+    """
+
+    global _tweets_table
+    with _schema_lock:
+        now = time.monotonic()
+        cached = _schema_cache['job_config'] is not None
+        if (cached and not refresh
+                and now - _schema_cache['checked_at'] < SCHEMA_CACHE_TTL):
+            return _schema_cache['schema'], _schema_cache['job_config']
+
+        raw_schema, etag = None, None
+        try:
+            bucket = get_storage_client().bucket(BUCKETNAME)
+            blob = bucket.get_blob(SCHEMA_BLOB)
+            etag = blob.etag
+            if not cached or etag != _schema_cache['etag']:
+                raw_schema = json.loads(blob.download_as_bytes())
+        except Exception as e:
+            message = 'BIGQUERY | Could not fetch schema from bucket: {}'.format(
+                e)
+            print(message)
+            logging.warning(message)
+            if not cached:
+                raw_schema = _read_local_schema()
+
+        if raw_schema is not None:
+            _tweets_table = None
+            table_schema = parse_bq_json_schema(raw_schema)
+            _schema_cache['schema'] = table_schema
+            _schema_cache['job_config'] = _build_job_config(table_schema)
+            _schema_cache['etag'] = etag
+        _schema_cache['checked_at'] = now
+        return _schema_cache['schema'], _schema_cache['job_config']
+
+def invalidate_schema_cache():
+    """
+    Method which forces the schema to be downloaded and parsed again on the
+    next upload.
+    """
+
+    with _schema_lock:
+        _schema_cache['schema'] = None
+        _schema_cache['job_config'] = None
+        _schema_cache['etag'] = None
+        _schema_cache['checked_at'] = 0.0
+
+def _table_name(tablename: str = None):
+    """Submethod which returns the fully-qualified name of a table.
+
+    Parameters
+    ----------
+    tablename: str
+        Name of the table. Defaults to `TABLENAME`.
+    """
+
+    return '{}.{}.{}'.format(
+        GOOGLE_CLOUD_PROJECT, DATASET, tablename or TABLENAME
+    )
+
+def ensure_table(db: bigquery.Client):
+    """Method which creates the tweets table if needed, and adds to it any
+    field of the schema it is missing.
+
+    The check is only performed once per process.
+
+    Parameters
+    ----------
+    db: google.cloud.bigquery.Client
+        BigQuery client used to create the connection.
+    """
+
+    global _tweets_table
+    if _tweets_table is not None:
+        return _tweets_table
+    table_schema, _ = load_schema()
+    table = bigquery.Table(_table_name(), schema=table_schema)
+    table.description = 'Tweets collected from Twitter API'
+    table.time_partitioning = bigquery.table.TimePartitioning(
+        field='created_at', type_='DAY')
+    table.clustering_fields = ['crawler', 'lang']
+    table = db.create_table(table, exists_ok=True)
+
+    existing = {field.name for field in table.schema}
+    missing = [field for field in table_schema if field.name not in existing]
+    if missing:
+        table.schema = list(table.schema) + missing
+        table = db.update_table(table, ['schema'])
+    _tweets_table = table
+    return table
+
+def ensure_sessions_table(db: bigquery.Client):
+    """Method which creates the table linking each crawl session to the
+    tweets it saved, if needed. A tweet saved by several sessions is linked
+    to each of them, while its `session_id` keeps the first one.
+
+    The table is clustered by session, so the tweets and date bounds of a
+    session are read without scanning the tweets table.
+
+    Parameters
+    ----------
+    db: google.cloud.bigquery.Client
+        BigQuery client used to create the connection.
+    """
+
+    global _sessions_table
+    if _sessions_table is None:
+        table = bigquery.Table(_table_name(SESSIONS_TABLENAME), schema=[
+            bigquery.SchemaField('session_id', 'STRING', mode='REQUIRED'),
+            bigquery.SchemaField('id', 'INTEGER', mode='REQUIRED'),
+            bigquery.SchemaField('created_at', 'DATETIME', mode='REQUIRED')
+        ])
+        table.description = 'Tweets saved by each crawl session'
+        table.clustering_fields = ['session_id']
+        _sessions_table = db.create_table(table, exists_ok=True)
+    return _sessions_table
+
+def _session_links(data: List[dict]):
+    """Submethod which builds the rows linking the given tweets to the
+    sessions which saved them.
+
+    Parameters
+    ----------
+    data: list[dict]
+        List of JSON-like objects to be uploaded.
+    """
+
+    links = {}
+    for tweet in data:
+        if tweet.get('session_id'):
+            key = '{}|{}'.format(tweet['session_id'], tweet['id'])
+            links[key] = {'session_id': tweet['session_id'],
+                          'id': tweet['id'],
+                          'created_at': tweet['created_at']}
+    return links
+
+def write_tweets(db: bigquery.Client, data: List[dict], retry: bool = False):
+    """Method which saves a batch of tweets to BigQuery, choosing the
+    ingestion path by the size of the batch.
+
+    Batches of up to `BQ_STREAMING_MAX_ROWS` tweets, such as the ones of the
+    streaming crawler, are written with streaming inserts, which have no
+    daily quota and take milliseconds. Larger batches, such as the pages of
+    a batch crawl, are merged through a load job, which updates tweets
+    already in the table instead of duplicating them. So is a batch which
+    may have been written before, since streaming inserts would append it
+    again.
+
+    Parameters
+    ----------
+    db: google.cloud.bigquery.Client
+        BigQuery client used to create the connection and upload the data.
+    data: list[dict]
+        List of JSON-like objects to be uploaded.
+    retry: bool
+        Whether the batch may have been written before.
+    """
+
+    if not retry and len(data) <= BQ_STREAMING_MAX_ROWS:
+        insert_data_to_bq(db, data)
+    else:
+        upload_data_to_bq(db, data)
+
+def insert_data_to_bq(db: bigquery.Client, data: List[dict]):
+    """Method which writes the data passed as a parameter to BigQuery with
+    streaming inserts.
+
+    The tweet id is sent as the insert id, so BigQuery drops retried rows on
+    a best-effort basis, for about a minute. Unlike `upload_data_to_bq`,
+    tweets already in the table are not updated. Queries returning tweets
+    or counts skip any duplicate left, which can be removed with
+    `deduplicate_table`.
+
+    Parameters
+    ----------
+    db: google.cloud.bigquery.Client
+        BigQuery client used to create the connection and upload the data.
+    data: list[dict]
+        List of JSON-like objects to be uploaded.
+    """
+
+    if not data:
+        return
+    table = ensure_table(db)
+    _insert_rows(db, table, data, [tweet['id'] for tweet in data])
+    links = _session_links(data)
+    if links:
+        _insert_rows(db, ensure_sessions_table(db), list(links.values()),
+                     list(links))
+
+def _insert_rows(db: bigquery.Client, table: bigquery.Table,
+                 rows: List[dict], row_ids: List[str]):
+    """Submethod which writes rows to a table with streaming inserts, in
+    chunks of `BQ_INSERT_CHUNK_SIZE`.
+
+    Parameters
+    ----------
+    db: google.cloud.bigquery.Client
+        BigQuery client used to create the connection and upload the data.
+    table: google.cloud.bigquery.Table
+        Table the rows are inserted into.
+    rows: list[dict]
+        Rows to insert.
+    row_ids: list[str]
+        Insert id of each row, used by BigQuery to drop retried rows.
+    """
+
+    for start in range(0, len(rows), BQ_INSERT_CHUNK_SIZE):
+        end = start + BQ_INSERT_CHUNK_SIZE
+        errors = db.insert_rows_json(table, rows[start:end],
+                                     row_ids=row_ids[start:end])
+        if errors:
+            raise RuntimeError(
+                'BIGQUERY | {} rows not inserted: {}'.format(
+                    len(errors), errors[0]))
 
 def upload_data_to_bq(db: bigquery.Client, data: List[dict]):
     """Method which uploads the data passed as a parameter to BigQuery.
 
+    Data is loaded into a temporary staging table and then merged into the
+    tweets table using the tweet id as the key, so uploading the same tweet
+    twice updates it instead of duplicating it. The `session_id` is only set
+    when the tweet is first saved, and the tweets are linked to their
+    session in the sessions table.
+
+    DML statements cannot modify the rows still in the streaming buffer, so
+    while the table has one, tweets already in it are left as they are and
+    only the new ones are inserted.
+
     Parameters
     ----------
     db: google.cloud.bigquery.Client
@@ -21,26 +349,111 @@ def upload_data_to_bq(db: bigquery.Client, data: List[dict]):
         List of JSON-like objects to be uploaded.
     """
 
-    bucket = storage.Client().get_bucket(BUCKETNAME)
-    blob = bucket.get_blob('schemes/tweets_schema.json')
-    table_schema = parse_bq_json_schema(json.loads(blob.download_as_bytes()))
-    job_config = bigquery.LoadJobConfig(
-        schema=table_schema,
-        create_disposition='CREATE_IF_NEEDED',
-        write_disposition='WRITE_APPEND',
-        destination_table_description='Tweets collected from Twitter API',
-        source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
-        time_partitioning=bigquery.table.TimePartitioning(
-            field='created_at',
-            type_='DAY'),
-        clustering_fields=['crawler', 'lang']
-    )
+    if not data:
+        return
+    ensure_table(db)
+    table_schema, job_config = load_schema()
+    staging_name = _table_name(
+        '{}_staging_{}'.format(TABLENAME, uuid.uuid4().hex))
+    try:
+        load_job = db.load_table_from_json(data, staging_name,
+                                           job_config=job_config)
+        load_job.result()
 
-    table_name = '{}.{}.{}'.format(
-        GOOGLE_CLOUD_PROJECT, DATASET, TABLENAME
+        columns = [field.name for field in table_schema]
+        updates = ['{0} = S.{0}'.format(column) for column in columns
+                   if column not in ('id', 'created_at', 'session_id')]
+        when_matched = ''
+        if db.get_table(_table_name()).streaming_buffer is None:
+            when_matched = 'WHEN MATCHED THEN\n    UPDATE SET {}\n'.format(
+                ', '.join(updates))
+        dates = [tweet['created_at'] for tweet in data]
+        query = """
+MERGE `{}` T
+USING (
+    SELECT * EXCEPT(row_number)
+    FROM (
+        SELECT *, ROW_NUMBER() OVER (PARTITION BY id) AS row_number
+        FROM `{}`
     )
-    load_job = db.load_table_from_json(data, table_name, job_config=job_config)
-    load_job.result()
+    WHERE row_number = 1
+) S
+ON T.id = S.id
+    AND T.created_at = S.created_at
+    AND T.created_at BETWEEN @start AND @end
+{}WHEN NOT MATCHED THEN
+    INSERT ({}) VALUES ({})
+""".format(_table_name(), staging_name, when_matched,
+           ', '.join(columns), ', '.join(columns))
+        _, partition_parameters = _partition_filter(min(dates), max(dates))
+        merge_config = bigquery.QueryJobConfig(
+            query_parameters=partition_parameters)
+        merge_job = db.query(query, job_config=merge_config, location='EU')
+        merge_job.result()
+        _record_billing(merge_job, 'merge')
+
+        if _session_links(data):
+            sessions_table = ensure_sessions_table(db)
+            query = """
+MERGE `{}` T
+USING (
+    SELECT DISTINCT session_id, id, created_at
+    FROM `{}`
+    WHERE session_id IS NOT NULL
+) S
+ON T.session_id = S.session_id AND T.id = S.id
+WHEN NOT MATCHED THEN
+    INSERT (session_id, id, created_at)
+    VALUES (S.session_id, S.id, S.created_at)
+""".format(_table_name(sessions_table.table_id), staging_name)
+            links_job = db.query(query, location='EU')
+            links_job.result()
+            _record_billing(links_job, 'merge')
+    finally:
+        db.delete_table(staging_name, not_found_ok=True)
+
+def deduplicate_table(db: bigquery.Client):
+    """Method which removes from the tweets table the duplicated rows, such
+    as the ones saved before uploads were merged by tweet id or streamed
+    twice. Only the duplicated tweets are deleted and inserted again, once
+    each, inside a transaction.
+
+    DML statements cannot modify the rows still in the streaming buffer, so
+    the table is skipped while it has one.
+
+    Parameters
+    ----------
+    db: google.cloud.bigquery.Client
+        BigQuery client used to create the connection.
+
+    Returns
+    -------
+    bool
+        Whether the table has been deduplicated.
+    """
+
+    if db.get_table(_table_name()).streaming_buffer is not None:
+        message = ('BIGQUERY | Deduplication skipped, the table has a '
+                   'streaming buffer.')
+        print(message)
+        logging.warning(message)
+        return False
+    query = """
+BEGIN TRANSACTION;
+CREATE TEMP TABLE duplicates AS
+SELECT *
+FROM `{0}`
+WHERE TRUE
+QUALIFY COUNT(*) OVER (PARTITION BY id) > 1
+    AND ROW_NUMBER() OVER (PARTITION BY id) = 1;
+DELETE FROM `{0}`
+WHERE id IN (SELECT id FROM duplicates);
+INSERT INTO `{0}`
+SELECT * FROM duplicates;
+COMMIT TRANSACTION;
+""".format(_table_name())
+    db.query(query, location='EU').result()
+    return True
 
 def _get_field_schema(field: dict):
     """Submethod to parse a single field of a schema.
@@ -91,36 +504,586 @@ def parse_bq_json_schema(schema: List[dict]):
 
     return output
 
-def get_by_ids(db: bigquery.Client, ids: List[int]):
+def _select_fields(fields: List[str]):
+    """Submethod which builds the SELECT expressions of the given fields.
+
+    Parameters
+    ----------
+    fields: list[str]
+        Fields to retrieve. They must have been validated beforehand, as
+        they are formatted into the query.
+    """
+
+    expressions = []
+    for field in fields:
+        if field == 'id':
+            expressions.append('CAST(id AS STRING) AS id')
+        else:
+            expressions.append(field)
+    return ',\n    '.join(expressions)
+
+def _format_records(query_job: bigquery.QueryJob):
+    """Submethod which converts the rows of a query to JSON-like objects.
+
+    Parameters
+    ----------
+    query_job: google.cloud.bigquery.QueryJob
+        Query whose rows are converted.
+    """
+
+    records = list(map(dict, query_job))
+    for record in records:
+        if record.get('created_at') is not None:
+            record['created_at'] = record['created_at'].strftime(
+                '%Y-%m-%d %H:%M:%S')
+    return records
+
+def _partition_filter(start: str = None, end: str = None):
+    """Submethod which builds the `created_at` condition used to prune the
+    partitions scanned by a query.
+
+    Only the known bounds are applied. If both are unknown, every partition
+    is scanned, since a crawl can hold tweets of any date.
+
+    Parameters
+    ----------
+    start: str
+        Oldest `created_at` to scan, formatted as YYYY-MM-DD HH:MM:SS.
+    end: str
+        Newest `created_at` to scan, formatted as YYYY-MM-DD HH:MM:SS.
+
+    Returns
+    -------
+    tuple[str, list[google.cloud.bigquery.ScalarQueryParameter]]
+    """
+
+    conditions = []
+    parameters = []
+    for key, value, operator in [('start', start, '>='), ('end', end, '<=')]:
+        if value:
+            conditions.append('created_at {} @{}'.format(operator, key))
+            parameters.append(bigquery.ScalarQueryParameter(
+                key, 'DATETIME',
+                datetime.strptime(value, '%Y-%m-%d %H:%M:%S')))
+    return '\n    AND '.join(conditions) or 'TRUE', parameters
+
+def get_session_bounds(db: bigquery.Client, session_id: str):
+    """Method which retrieves the oldest and newest `created_at` of the
+    tweets saved by a crawl session. They are read from the sessions table,
+    so the bounds can be used to prune the partitions of the tweets table.
+
+    Parameters
+    ----------
+    db: google.cloud.bigquery.Client
+        BigQuery client used to create the connection and retrieve the data.
+    session_id: str
+        Identifier of the crawl session.
+
+    Returns
+    -------
+    tuple[str, str, int]
+        Oldest and newest `created_at`, or None if the session has no tweets,
+        and number of bytes processed by the query.
+    """
+
+    query = """
+SELECT MIN(created_at) AS start, MAX(created_at) AS `end`
+FROM `{}`
+WHERE session_id = @session_id
+""".format(_table_name(SESSIONS_TABLENAME))
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter('session_id', 'STRING', session_id)
+    ])
+    query_job = db.query(query, job_config=job_config, location='EU')
+    row = list(query_job.result())[0]
+    _record_billing(query_job, 'get_by_session')
+    bounds = [row[key].strftime('%Y-%m-%d %H:%M:%S') if row[key] else None
+              for key in ('start', 'end')]
+    return bounds[0], bounds[1], query_job.total_bytes_processed or 0
+
+def get_by_ids(db: bigquery.Client, ids: List[int], fields: List[str] = None,
+               start: str = None, end: str = None):
     """Method which retrieves from a BigQuery table the tweets contained in
     the list given as a parameter.
 
+    Ids are passed as an array query parameter, in chunks of
+    `GET_BY_IDS_CHUNK_SIZE`, so the query text is always the same and its
+    results can be cached by BigQuery. At least one date bound is required,
+    so the lookup does not scan every partition.
+
     Parameters
     ----------
     db: google.cloud.bigquery.Client
         BigQuery client used to create the connection and retrieve the data.
     ids: list[int]
         List of ids to retrieve.
+    fields: list[str]
+        Fields to retrieve. Defaults to `DEFAULT_FIELDS`.
+    start: str
+        Oldest `created_at` of the tweets, used to prune partitions.
+    end: str
+        Newest `created_at` of the tweets, used to prune partitions.
+
+    Returns
+    -------
+    tuple[list[dict], int]
+        Retrieved tweets and number of bytes processed by the queries.
+
+    Raises
+    ------
+    ValueError
+        If neither `start` nor `end` is given.
     """
 
     if not ids:
-        return []
-    formatted_ids = '({})'.format(', '.join(map(str, ids)))
+        return [], 0
+    if not start and not end:
+        raise ValueError('A since or until date is required to look up '
+                         'tweets by id.')
+    partition_filter, partition_parameters = _partition_filter(start, end)
     query = """
 SELECT
-    ANY_VALUE(created_at) AS created_at,
-    ANY_VALUE(text) AS text,
-    ANY_VALUE(interactions) AS interactions
+    {}
 FROM `{}.{}.{}`
 WHERE
-    id IN  {}
-    AND created_at >= DATE_SUB(CURRENT_DATE(), INTERVAL 8 DAY)
-    AND created_at <= DATE_ADD(CURRENT_DATE(), INTERVAL 1 DAY)
-GROUP BY id
-""".format(GOOGLE_CLOUD_PROJECT, DATASET, TABLENAME, formatted_ids)
-    query_job = db.query(query, location='EU')
-    records = list(map(dict, query_job))
+    id IN UNNEST(@ids)
+    AND {}
+QUALIFY ROW_NUMBER() OVER (PARTITION BY id) = 1
+""".format(_select_fields(fields or DEFAULT_FIELDS), GOOGLE_CLOUD_PROJECT,
+           DATASET, TABLENAME, partition_filter)
+
+    records, bytes_processed = [], 0
+    ids = [int(id) for id in ids]
+    for i in range(0, len(ids), GET_BY_IDS_CHUNK_SIZE):
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ArrayQueryParameter(
+                'ids', 'INT64', ids[i:i + GET_BY_IDS_CHUNK_SIZE])
+        ] + partition_parameters)
+        query_job = db.query(query, job_config=job_config, location='EU')
+        records.extend(_format_records(query_job))
+        bytes_processed += query_job.total_bytes_processed or 0
+        _record_billing(query_job, 'get_by_ids')
+    return records, bytes_processed
+
+def get_by_session(db: bigquery.Client, session_id: str, limit: int,
+                   after: str = None, fields: List[str] = None,
+                   start: str = None, end: str = None):
+    """Method which retrieves from a BigQuery table a page of the tweets saved
+    by a crawl session, newest first.
+
+    Parameters
+    ----------
+    db: google.cloud.bigquery.Client
+        BigQuery client used to create the connection and retrieve the data.
+    session_id: str
+        Identifier of the crawl session.
+    limit: int
+        Maximum number of tweets to retrieve.
+    after: str
+        Cursor returned by the previous page, if any.
+    fields: list[str]
+        Fields to retrieve. Defaults to `DEFAULT_FIELDS`.
+    start: str
+        Oldest `created_at` of the session, used to prune partitions. If
+        neither bound is given, they are read from the table.
+    end: str
+        Newest `created_at` of the session, used to prune partitions.
+
+    Returns
+    -------
+    tuple[list[dict], str, int]
+        Page of tweets, cursor of the next page, or None if it is the last
+        one, and number of bytes processed by the queries.
+    """
+
+    bytes_processed = 0
+    if start is None and end is None:
+        start, end, bytes_processed = get_session_bounds(db, session_id)
+        if start is None:
+            return [], None, bytes_processed
+    partition_filter, partition_parameters = _partition_filter(start, end)
+    query = """
+SELECT
+    id AS _cursor,
+    {}
+FROM `{}.{}.{}`
+WHERE
+    id IN (
+        SELECT id
+        FROM `{}`
+        WHERE session_id = @session_id
+            AND (@after IS NULL OR id < @after)
+    )
+    AND {}
+QUALIFY ROW_NUMBER() OVER (PARTITION BY id) = 1
+ORDER BY id DESC
+LIMIT @limit
+""".format(_select_fields(fields or DEFAULT_FIELDS),
+           GOOGLE_CLOUD_PROJECT, DATASET, TABLENAME,
+           _table_name(SESSIONS_TABLENAME), partition_filter)
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter('session_id', 'STRING', session_id),
+        bigquery.ScalarQueryParameter(
+            'after', 'INT64', int(after) if after else None),
+        bigquery.ScalarQueryParameter('limit', 'INT64', limit)
+    ] + partition_parameters)
+    query_job = db.query(query, job_config=job_config, location='EU')
+    records = _format_records(query_job)
+    cursor = str(records[-1]['_cursor']) if len(records) == limit else None
     for record in records:
-        record['created_at'] = record['created_at'].strftime(
-            '%Y-%m-%d %H:%M:%S')
-    return records
\ No newline at end of file
+        del record['_cursor']
+    _record_billing(query_job, 'get_by_session')
+    bytes_processed += query_job.total_bytes_processed or 0
+    return records, cursor, bytes_processed
+
+def iter_tweets(db: bigquery.Client, filters: dict, fields: List[str] = None,
+                page_size: int = 1000):
+    """Method which iterates over the tweets of a BigQuery table matching the
+    given filters, fetching the result rows in pages. Duplicated tweets are
+    only returned once.
+
+    Parameters
+    ----------
+    db: google.cloud.bigquery.Client
+        BigQuery client used to create the connection and retrieve the data.
+    filters: dict
+        Optional `crawler`, `lang`, `session_id`, `since` and `until` filters.
+        Dates are formatted as YYYY-MM-DD HH:MM:SS.
+    fields: list[str]
+        Fields to retrieve. They must have been validated beforehand, as they
+        are formatted into the query. Defaults to every field.
+    page_size: int
+        Number of rows fetched per API request.
+    """
+
+    conditions, parameters = _filter_conditions(filters)
+    query = """
+SELECT {}
+FROM `{}.{}.{}`
+WHERE {}
+QUALIFY ROW_NUMBER() OVER (PARTITION BY id) = 1
+""".format(', '.join(fields) if fields else '*', GOOGLE_CLOUD_PROJECT,
+           DATASET, TABLENAME, conditions)
+    job_config = bigquery.QueryJobConfig(query_parameters=parameters)
+    query_job = db.query(query, job_config=job_config, location='EU')
+    for row in query_job.result(page_size=page_size):
+        record = dict(row)
+        if record.get('id') is not None:
+            record['id'] = str(record['id'])
+        if record.get('created_at') is not None:
+            record['created_at'] = record['created_at'].strftime(
+                '%Y-%m-%d %H:%M:%S')
+        yield record
+    _record_billing(query_job, 'export')
+
+def count_tweets(db: bigquery.Client, filters: dict = None):
+    """Method which counts the tweets of a BigQuery table matching the given
+    filters. Duplicated tweets are only counted once.
+
+    The tweets of a session are counted on the sessions table, which is
+    clustered by session. Any other count requires a date bound, so it does
+    not scan every partition.
+
+    Parameters
+    ----------
+    db: google.cloud.bigquery.Client
+        BigQuery client used to create the connection and retrieve the data.
+    filters: dict
+        Optional `crawler`, `lang`, `session_id`, `since` and `until` filters.
+        Dates are formatted as YYYY-MM-DD HH:MM:SS.
+
+    Raises
+    ------
+    ValueError
+        If neither `since` nor `until` is given, unless only `session_id` is.
+    """
+
+    filters = filters or {}
+    others = [key for key, value in filters.items()
+              if value and key != 'session_id']
+    if filters.get('session_id') and not others:
+        query = """
+SELECT COUNT(DISTINCT id) AS total
+FROM `{}`
+WHERE session_id = @session_id
+""".format(_table_name(SESSIONS_TABLENAME))
+        parameters = [bigquery.ScalarQueryParameter(
+            'session_id', 'STRING', filters['session_id'])]
+    elif not filters.get('since') and not filters.get('until'):
+        raise ValueError('A since or until date is required to count '
+                         'tweets.')
+    else:
+        conditions, parameters = _filter_conditions(filters)
+        query = """
+SELECT COUNT(DISTINCT id) AS total
+FROM `{}.{}.{}`
+WHERE {}
+""".format(GOOGLE_CLOUD_PROJECT, DATASET, TABLENAME, conditions)
+    job_config = bigquery.QueryJobConfig(query_parameters=parameters)
+    query_job = db.query(query, job_config=job_config, location='EU')
+    total = list(query_job.result())[0]['total']
+    _record_billing(query_job, 'count')
+    return total
+
+def aggregate_timeseries(db: bigquery.Client, filters: dict, interval: str):
+    """Method which counts the tweets of a BigQuery table matching the given
+    filters by time bucket, crawler and language.
+
+    Parameters
+    ----------
+    db: google.cloud.bigquery.Client
+        BigQuery client used to create the connection and retrieve the data.
+    filters: dict
+        Optional `crawler`, `lang`, `session_id`, `since` and `until` filters.
+    interval: str
+        Size of the time buckets: 'minute', 'hour' or 'day'.
+    """
+
+    part, time_format = BQ_TIME_FORMATS[interval]
+    conditions, parameters = _filter_conditions(filters)
+    query = """
+SELECT
+    FORMAT_DATETIME('{}', DATETIME_TRUNC(created_at, {})) AS time,
+    crawler,
+    lang,
+    COUNT(*) AS count
+FROM `{}`
+WHERE {}
+GROUP BY time, crawler, lang
+""".format(time_format, part, _table_name(), conditions)
+    return _run_aggregate(db, query, parameters)
+
+def aggregate_interactions(db: bigquery.Client, filters: dict):
+    """Method which sums the interactions of the tweets of a BigQuery table
+    matching the given filters, by crawler.
+
+    Parameters
+    ----------
+    db: google.cloud.bigquery.Client
+        BigQuery client used to create the connection and retrieve the data.
+    filters: dict
+        Optional `crawler`, `lang`, `session_id`, `since` and `until` filters.
+    """
+
+    conditions, parameters = _filter_conditions(filters)
+    query = """
+SELECT
+    crawler,
+    COUNT(*) AS tweets,
+    IFNULL(SUM(interactions.favorite_count), 0) AS favorite_count,
+    IFNULL(SUM(interactions.retweet_count), 0) AS retweet_count,
+    IFNULL(SUM(interactions.quote_count), 0) AS quote_count,
+    IFNULL(SUM(interactions.reply_count), 0) AS reply_count
+FROM `{}`
+WHERE {}
+GROUP BY crawler
+""".format(_table_name(), conditions)
+    return _run_aggregate(db, query, parameters)
+
+def aggregate_words(db: bigquery.Client, filters: dict, kind: str,
+                    limit: int):
+    """Method which counts the most frequent hashtags or terms of the tweets
+    of a BigQuery table matching the given filters.
+
+    Parameters
+    ----------
+    db: google.cloud.bigquery.Client
+        BigQuery client used to create the connection and retrieve the data.
+    filters: dict
+        Optional `crawler`, `lang`, `session_id`, `since` and `until` filters.
+    kind: str
+        Either 'hashtag' or 'term'.
+    limit: int
+        Maximum number of words to retrieve.
+    """
+
+    conditions, parameters = _filter_conditions(filters)
+    if kind == 'hashtag':
+        words = r"REGEXP_EXTRACT_ALL(LOWER(text), r'#\w+')"
+        word_condition = 'TRUE'
+    else:
+        words = r"REGEXP_EXTRACT_ALL(LOWER(text), r'\S+')"
+        word_condition = ("CHAR_LENGTH(word) >= 4\n"
+                          "    AND NOT REGEXP_CONTAINS(word, r'^(#|@|http)')")
+    query = """
+SELECT word AS term, COUNT(*) AS count
+FROM `{}`, UNNEST({}) AS word
+WHERE {}
+    AND {}
+GROUP BY term
+ORDER BY count DESC
+LIMIT @limit
+""".format(_table_name(), words, conditions, word_condition)
+    parameters.append(bigquery.ScalarQueryParameter('limit', 'INT64', limit))
+    return _run_aggregate(db, query, parameters)
+
+def aggregate_sources(db: bigquery.Client, filters: dict, limit: int):
+    """Method which counts the tweets of a BigQuery table matching the given
+    filters by source.
+
+    Parameters
+    ----------
+    db: google.cloud.bigquery.Client
+        BigQuery client used to create the connection and retrieve the data.
+    filters: dict
+        Optional `crawler`, `lang`, `session_id`, `since` and `until` filters.
+    limit: int
+        Maximum number of sources to retrieve.
+    """
+
+    conditions, parameters = _filter_conditions(filters)
+    query = """
+SELECT source, COUNT(*) AS count
+FROM `{}`
+WHERE {}
+GROUP BY source
+ORDER BY count DESC
+LIMIT @limit
+""".format(_table_name(), conditions)
+    parameters.append(bigquery.ScalarQueryParameter('limit', 'INT64', limit))
+    return _run_aggregate(db, query, parameters)
+
+def _run_aggregate(db: bigquery.Client, query: str,
+                   parameters: List[bigquery.ScalarQueryParameter]):
+    """Submethod which runs an aggregation query and returns its rows.
+
+    Parameters
+    ----------
+    db: google.cloud.bigquery.Client
+        BigQuery client used to create the connection and retrieve the data.
+    query: str
+        Query to run.
+    parameters: list[google.cloud.bigquery.ScalarQueryParameter]
+        Parameters of the query.
+    """
+
+    job_config = bigquery.QueryJobConfig(query_parameters=parameters)
+    query_job = db.query(query, job_config=job_config, location='EU')
+    rows = [dict(row) for row in query_job.result()]
+    _record_billing(query_job, 'aggregate')
+    return rows
+
+def _record_billing(query_job: bigquery.QueryJob, operation: str):
+    """Submethod which adds the bytes billed by a finished query job to the
+    metrics.
+
+    Parameters
+    ----------
+    query_job: google.cloud.bigquery.QueryJob
+        Finished query job.
+    operation: str
+        Name of the operation the query was run for.
+    """
+
+    metrics_utils.BIGQUERY_BYTES_BILLED.labels(operation=operation).inc(
+        query_job.total_bytes_billed or 0)
+
+def _filter_conditions(filters: dict):
+    """Submethod which builds the WHERE conditions matching the given
+    filters.
+
+    Parameters
+    ----------
+    filters: dict
+        Optional `crawler`, `lang`, `session_id`, `since` and `until` filters.
+
+    Returns
+    -------
+    tuple[str, list[google.cloud.bigquery.ScalarQueryParameter]]
+    """
+
+    conditions = ['TRUE']
+    parameters = []
+    for key in ['crawler', 'lang']:
+        if filters.get(key):
+            conditions.append('{0} = @{0}'.format(key))
+            parameters.append(
+                bigquery.ScalarQueryParameter(key, 'STRING', filters[key]))
+    if filters.get('session_id'):
+        conditions.append(
+            'id IN (SELECT id FROM `{}` WHERE session_id = @session_id)'
+            .format(_table_name(SESSIONS_TABLENAME)))
+        parameters.append(bigquery.ScalarQueryParameter(
+            'session_id', 'STRING', filters['session_id']))
+    for key, operator in [('since', '>='), ('until', '<')]:
+        if filters.get(key):
+            conditions.append('created_at {} @{}'.format(operator, key))
+            parameters.append(bigquery.ScalarQueryParameter(
+                key, 'DATETIME',
+                datetime.strptime(filters[key], '%Y-%m-%d %H:%M:%S')))
+    return '\n    AND '.join(conditions), parameters
+
+def _get_checkpoints_table(db: bigquery.Client):
+    """Submethod which creates the checkpoints table if needed.
+
+    Parameters
+    ----------
+    db: google.cloud.bigquery.Client
+        BigQuery client used to create the connection.
+    """
+
+    global _checkpoints_table
+    if _checkpoints_table is None:
+        table = bigquery.Table(
+            '{}.{}.{}'.format(
+                GOOGLE_CLOUD_PROJECT, DATASET, CHECKPOINTS_TABLENAME
+            ),
+            schema=[
+                bigquery.SchemaField('key', 'STRING', mode='REQUIRED'),
+                bigquery.SchemaField('since_id', 'INTEGER'),
+                bigquery.SchemaField('max_id', 'INTEGER'),
+                bigquery.SchemaField('top_id', 'INTEGER'),
+                bigquery.SchemaField('updated_at', 'TIMESTAMP',
+                                     mode='REQUIRED')
+            ]
+        )
+        _checkpoints_table = db.create_table(table, exists_ok=True)
+    return _checkpoints_table
+
+def get_checkpoint(db: bigquery.Client, key: str):
+    """Method which retrieves the latest crawl checkpoint stored for a query.
+
+    Parameters
+    ----------
+    db: google.cloud.bigquery.Client
+        BigQuery client used to create the connection and retrieve the data.
+    key: str
+        Checkpoint key of the query.
+    """
+
+    table = _get_checkpoints_table(db)
+    query = """
+SELECT since_id, max_id, top_id
+FROM `{}.{}.{}`
+WHERE key = @key
+ORDER BY updated_at DESC
+LIMIT 1
+""".format(table.project, table.dataset_id, table.table_id)
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter('key', 'STRING', key)
+    ])
+    records = list(map(dict, db.query(query, job_config=job_config,
+                                      location='EU')))
+    return records[0] if records else None
+
+def save_checkpoint(db: bigquery.Client, key: str, checkpoint: dict):
+    """Method which stores the crawl checkpoint of a query.
+
+    Checkpoints are appended with streaming inserts, and the latest one
+    is used when reading them.
+
+    Parameters
+    ----------
+    db: google.cloud.bigquery.Client
+        BigQuery client used to create the connection and save the data.
+    key: str
+        Checkpoint key of the query.
+    checkpoint: dict
+        JSON-like object with the `since_id`, `max_id` and `top_id` fields.
+    """
+
+    row = dict(checkpoint, key=key, updated_at=time.time())
+    errors = db.insert_rows_json(_get_checkpoints_table(db), [row])
+    if errors:
+        raise RuntimeError(
+            'BIGQUERY | Checkpoint not saved: {}'.format(errors))
@@ -0,0 +1,169 @@
+import os
+import time
+from typing import Callable, List
+
+from prometheus_client import (REGISTRY, CONTENT_TYPE_LATEST, CollectorRegistry,
+                               Counter, Histogram, generate_latest,
+                               multiprocess)
+from prometheus_client.core import GaugeMetricFamily
+
+# Set with several gunicorn workers, so the metrics of every worker are
+# written to this folder and added up when scraped
+PROMETHEUS_MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+class LiveGauges():
+    """
+    Class used to collect the gauges which are read from a function when
+    the metrics are scraped, so they cost nothing meanwhile. They describe
+    the state of the process which serves the scrape, such as its queues.
+
+    Methods
+    -------
+    add(self, name: str, documentation: str, function: Callable[[], float])
+        Method which registers a gauge.
+    collect(self)
+        Method which reads every gauge.
+    """
+
+    def __init__(self):
+        self._gauges = []
+
+    def add(self, name: str, documentation: str,
+            function: Callable[[], float]):
+        """Method which registers a gauge.
+
+        Parameters
+        ----------
+        name: str
+            Name of the gauge.
+        documentation: str
+            Description shown in the HELP line.
+        function: Callable[[], float]
+            Function which returns the current value.
+        """
+
+        self._gauges.append((name, documentation, function))
+
+    def collect(self):
+        """
+        Method which reads every gauge, as required by prometheus_client.
+        """
+
+        for name, documentation, function in self._gauges:
+            gauge = GaugeMetricFamily(name, documentation)
+            gauge.add_metric([], function())
+            yield gauge
+
+LIVE_GAUGES = LiveGauges()
+if not PROMETHEUS_MULTIPROC_DIR:
+    REGISTRY.register(LIVE_GAUGES)
+
+TWEETS_RECEIVED = Counter(
+    'crawler_tweets_received_total',
+    'Tweets received from the Twitter API.', ('crawler',))
+TWEETS_TRANSFORMED = Counter(
+    'crawler_tweets_transformed_total',
+    'Tweets transformed into the data model.', ('crawler',))
+TWEETS_SPOOLED = Counter(
+    'crawler_tweets_spooled_total',
+    'Tweets appended to the write-ahead spool.', ('crawler',))
+TWEETS_PERSISTED = Counter(
+    'crawler_tweets_persisted_total',
+    'Tweets written to the database. Spooled tweets are counted under the '
+    'spool writer.', ('writer',))
+WRITE_ERRORS = Counter(
+    'crawler_write_errors_total',
+    'Failed batch writes to the database.', ('writer',))
+STREAM_MESSAGES = Counter(
+    'crawler_stream_messages_total',
+    'Messages received from the stream, by kind.', ('kind',))
+RATE_LIMIT_SLEEPS = Counter(
+    'crawler_rate_limit_sleeps_total',
+    'Waits caused by the Twitter API rate limit.', ('crawler',))
+RATE_LIMIT_SLEEP_SECONDS = Counter(
+    'crawler_rate_limit_sleep_seconds_total',
+    'Seconds waited because of the Twitter API rate limit.', ('crawler',))
+BIGQUERY_BYTES_BILLED = Counter(
+    'crawler_bigquery_bytes_billed_total',
+    'Bytes billed by the BigQuery query jobs.', ('operation',))
+DECODE_SECONDS = Histogram(
+    'crawler_decode_seconds',
+    'Seconds spent classifying and decoding a stream message.',
+    buckets=LATENCY_BUCKETS)
+TRANSFORM_SECONDS = Histogram(
+    'crawler_transform_seconds',
+    'Seconds spent transforming a streamed tweet or a page of searched '
+    'tweets.', ('crawler',), buckets=LATENCY_BUCKETS)
+TWITTER_REQUEST_SECONDS = Histogram(
+    'crawler_twitter_request_seconds',
+    'Seconds taken by the Twitter API search requests.',
+    buckets=LATENCY_BUCKETS)
+WRITE_SECONDS = Histogram(
+    'crawler_write_seconds',
+    'Seconds spent writing a batch of tweets to the database.', ('writer',),
+    buckets=LATENCY_BUCKETS)
+WRITE_BATCH_SIZE = Histogram(
+    'crawler_write_batch_size',
+    'Number of tweets of each batch written to the database.', ('writer',),
+    buckets=SIZE_BUCKETS)
+
+def record_write(writer: str, tweets: List[dict],
+                 write: Callable[[List[dict]], None]):
+    """Method which writes a batch of tweets, recording its duration, size
+    and outcome.
+
+    Parameters
+    ----------
+    writer: str
+        Component writing the batch: 'streaming', 'batch' or 'spool'.
+    tweets: list[dict]
+        List of JSON-like objects to be saved.
+    write: Callable[[list[dict]], None]
+        Function which saves the batch.
+    """
+
+    start = time.perf_counter()
+    try:
+        write(tweets)
+    except Exception:
+        WRITE_ERRORS.labels(writer=writer).inc()
+        raise
+    WRITE_SECONDS.labels(writer=writer).observe(time.perf_counter() - start)
+    WRITE_BATCH_SIZE.labels(writer=writer).observe(len(tweets))
+    TWEETS_PERSISTED.labels(writer=writer).inc(len(tweets))
+
+def gauge(name: str, documentation: str, function: Callable[[], float]):
+    """Method which registers a gauge read from a function when the metrics
+    are scraped.
+
+    Parameters
+    ----------
+    name: str
+        Name of the gauge.
+    documentation: str
+        Description shown in the HELP line.
+    function: Callable[[], float]
+        Function which returns the current value.
+    """
+
+    LIVE_GAUGES.add(name, documentation, function)
+
+def render():
+    """Method which renders every metric in the Prometheus text exposition
+    format.
+
+    If `PROMETHEUS_MULTIPROC_DIR` is set, counters and histograms are added
+    up across the worker processes, while the live gauges are the ones of
+    the process which serves the request.
+    """
+
+    registry = REGISTRY
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(LIVE_GAUGES)
+    return generate_latest(registry)
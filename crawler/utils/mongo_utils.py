@@ -1,8 +1,33 @@
 import os
+import re
+import time
+import logging
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import UpdateOne, ReturnDocument, ASCENDING, DESCENDING, TEXT
+from pymongo.errors import DuplicateKeyError, OperationFailure
 
 MONGODB_COLLECTION = os.environ.get('MONGODB_COLLECTION')
+MONGODB_CHECKPOINTS = os.environ.get('MONGODB_CHECKPOINTS', 'checkpoints')
+MONGODB_STREAMS = os.environ.get('MONGODB_STREAMS', 'streams')
+MONGODB_LEASES = os.environ.get('MONGODB_LEASES', 'leases')
+MONGODB_CRAWLS = os.environ.get('MONGODB_CRAWLS', 'crawls')
+MONGODB_SHARDS = os.environ.get('MONGODB_SHARDS', 'shards')
+MONGODB_RATE_LIMITS = os.environ.get('MONGODB_RATE_LIMITS', 'rate_limits')
+MONGODB_TEXT_INDEX = os.environ.get('MONGODB_TEXT_INDEX', 'False') == 'True'
+MONGODB_TTL_DAYS = float(os.environ.get('MONGODB_TTL_DAYS', 0))
+MONGODB_REMOVE_DUPLICATES = \
+    os.environ.get('MONGODB_REMOVE_DUPLICATES', 'False') == 'True'
+MONGODB_STREAM_TIMESERIES = os.environ.get('MONGODB_STREAM_TIMESERIES', '')
+DEFAULT_FIELDS = ['created_at', 'text', 'interactions']
+INDEXES = [
+    [('crawler', ASCENDING), ('created_at', ASCENDING)],
+    [('lang', ASCENDING)],
+    [('session_ids', ASCENDING), ('_id', DESCENDING)]
+]
 
-def get_by_ids(db, ids):
+def get_by_ids(db, ids, fields=None):
     """Method which retrieves from a mongodb collection the tweets contained in
     the list given as a parameter.
 
@@ -10,10 +35,811 @@ def get_by_ids(db, ids):
     ----------
     db: pymongo.database.Database
         MongoDB client used to create the connection and retrieve the data.
-    ids: list[int]
-        List of ids to retrieve.
+    ids: list[str]
+        List of tweet ids to retrieve.
+    fields: list[str]
+        Fields to retrieve. Defaults to `DEFAULT_FIELDS`.
     """
+    projection = {field: 1 for field in fields or DEFAULT_FIELDS}
+    projection['_id'] = 0
     return db[MONGODB_COLLECTION].find(
-        {'_id': {'$in': ids}},
-        {'_id': 0, 'created_at': 1, 'text': 1, 'interactions': 1}    
-    )
\ No newline at end of file
+        {'id': {'$in': [str(id) for id in ids]}}, projection
+    )
+
+def ensure_indexes(db):
+    """Method which creates the tweets collection and the indexes used by the
+    crawler queries:
+
+    - id: unique, so tweets are upserted by their Twitter id.
+    - crawler, created_at: exports and counts by crawler and date.
+    - lang: exports and counts by language.
+    - session_ids, _id: pages of a crawl session.
+    - text: full-text search, if `MONGODB_TEXT_INDEX` is True.
+    - saved_at: removes tweets `MONGODB_TTL_DAYS` days after they were
+      first saved, if set. It bounds the size of the stream data.
+
+    Capped collections are not supported, since they forbid the deletes of
+    the deduplication and the updates which grow the upserted tweets. The
+    append-only stream layout is the time-series collection of
+    `ensure_stream_timeseries` instead.
+
+    The unique index can not be created while the collection holds
+    duplicated tweets. They are only removed if `MONGODB_REMOVE_DUPLICATES`
+    is True; otherwise the error is raised, so the crawler does not start
+    until they are cleaned up.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection.
+    """
+    collection = db[MONGODB_COLLECTION]
+    try:
+        collection.create_index('id', unique=True)
+    except (DuplicateKeyError, OperationFailure) as e:
+        if not MONGODB_REMOVE_DUPLICATES:
+            logging.error('MONGODB | Unique id index not created, the '
+                          'collection has duplicated tweets: {}. Set '
+                          'MONGODB_REMOVE_DUPLICATES=True to remove '
+                          'them.'.format(e))
+            raise
+        removed = remove_duplicates(db)
+        logging.warning(
+            'MONGODB | {} duplicated tweets removed.'.format(removed))
+        collection.create_index('id', unique=True)
+    for keys in INDEXES:
+        collection.create_index(keys)
+    if MONGODB_TEXT_INDEX:
+        # Tweet languages are not all supported by MongoDB, so stemming and
+        # stop words are disabled instead of using the `lang` field
+        collection.create_index([('text', TEXT)], default_language='none',
+                                language_override='text_language')
+    if MONGODB_TTL_DAYS:
+        expire = int(MONGODB_TTL_DAYS * 24 * 3600)
+        try:
+            collection.create_index('saved_at', expireAfterSeconds=expire)
+        except OperationFailure:
+            # The index exists with another expiration, which is updated
+            db.command('collMod', MONGODB_COLLECTION, index={
+                'keyPattern': {'saved_at': 1}, 'expireAfterSeconds': expire})
+
+def ensure_stream_timeseries(db):
+    """Method which creates the time-series collection
+    `MONGODB_STREAM_TIMESERIES`, where the streamed tweets are appended
+    without being deduplicated, if it does not exist yet. Tweets are bucketed
+    by their `created_at` date and their `crawler`, and expire
+    `MONGODB_TTL_DAYS` days after being created, if set. It requires
+    MongoDB 5.0 or later.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection.
+    """
+    if MONGODB_STREAM_TIMESERIES in db.list_collection_names():
+        return
+    options = {'timeseries': {'timeField': 'created_at',
+                              'metaField': 'crawler',
+                              'granularity': 'seconds'}}
+    if MONGODB_TTL_DAYS:
+        options['expireAfterSeconds'] = int(MONGODB_TTL_DAYS * 24 * 3600)
+    db.create_collection(MONGODB_STREAM_TIMESERIES, **options)
+
+def append_stream_tweets(db, tweets):
+    """Method which appends the streamed tweets passed as a parameter to the
+    `MONGODB_STREAM_TIMESERIES` collection. Nothing is deduplicated, so a
+    tweet saved twice, as when the spool replays a batch, is stored twice.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and save the data.
+    tweets: list[dict]
+        List of JSON-like objects to be saved. Only the ones whose crawler
+        is streaming are appended.
+    """
+    documents = [
+        dict(tweet, created_at=datetime.strptime(tweet['created_at'],
+                                                 '%Y-%m-%d %H:%M:%S'))
+        for tweet in tweets if tweet.get('crawler') == 'streaming'
+    ]
+    if documents:
+        db[MONGODB_STREAM_TIMESERIES].insert_many(documents, ordered=False)
+
+def check_indexes(db):
+    """Method which explains the queries made by the dashboard and the
+    crawler API, and reports whether each of them uses an index and whether
+    it is covered by it, that is, answered without reading the documents.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection.
+
+    Returns
+    -------
+    dict
+        Winning plan stages, index used, documents examined, and whether the
+        query is indexed and covered, by query name.
+    """
+    collection = db[MONGODB_COLLECTION]
+    default_projection = {field: 1 for field in DEFAULT_FIELDS}
+    queries = {
+        'session_page': collection.find(
+            {'session_ids': ''}, default_projection
+        ).sort('_id', -1).limit(100),
+        'lookup_by_ids': collection.find(
+            {'id': {'$in': ['0']}}, dict(default_projection, _id=0)),
+        'export_by_crawler': collection.find(
+            {'crawler': 'streaming', 'created_at': {'$gte': ''}}, {'_id': 0}),
+        'export_by_lang': collection.find({'lang': 'en'}, {'_id': 0}),
+        'count_by_crawler': collection.find(
+            {'crawler': 'streaming'}, {'crawler': 1, '_id': 0})
+    }
+    report = {}
+    for name, cursor in queries.items():
+        explain = cursor.explain()
+        stages, indexes = [], []
+        _collect_stages(explain['queryPlanner']['winningPlan'], stages,
+                        indexes)
+        stats = explain.get('executionStats', {})
+        report[name] = {
+            'stages': stages,
+            'indexes': indexes,
+            'docs_examined': stats.get('totalDocsExamined'),
+            'indexed': 'COLLSCAN' not in stages,
+            'covered': 'COLLSCAN' not in stages and 'FETCH' not in stages
+        }
+        if 'COLLSCAN' in stages:
+            logging.warning(
+                'MONGODB | Query {} scans the whole collection.'.format(name))
+    return report
+
+def _collect_stages(plan, stages, indexes):
+    """Submethod which walks a query plan, collecting its stages and the
+    indexes it uses.
+
+    Parameters
+    ----------
+    plan: dict
+        Query plan returned by explain.
+    stages: list[str]
+        List the stages are appended to.
+    indexes: list[str]
+        List the index names are appended to.
+    """
+    stages.append(plan.get('stage'))
+    if plan.get('indexName'):
+        indexes.append(plan['indexName'])
+    if 'inputStage' in plan:
+        _collect_stages(plan['inputStage'], stages, indexes)
+    for input_stage in plan.get('inputStages', []):
+        _collect_stages(input_stage, stages, indexes)
+
+def remove_duplicates(db):
+    """Method which removes every duplicated tweet of a mongodb collection,
+    keeping the latest saved copy of each tweet id.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection.
+    """
+    collection = db[MONGODB_COLLECTION]
+    duplicates = collection.aggregate([
+        {'$sort': {'_id': -1}},
+        {'$group': {'_id': '$id', 'ids': {'$push': '$_id'},
+                    'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}}
+    ], allowDiskUse=True)
+    removed = 0
+    for duplicate in duplicates:
+        result = collection.delete_many({'_id': {'$in': duplicate['ids'][1:]}})
+        removed += result.deleted_count
+    return removed
+
+def upsert_tweets(db, tweets):
+    """Method which saves the tweets passed as a parameter, using the tweet id
+    as the key, so saving the same tweet twice updates it instead of
+    duplicating it. The `session_id` is only set when the tweet is first
+    saved, so a later crawl does not take it from the session which found it,
+    while `session_ids` keeps every session which saved it, so the tweet is
+    listed and counted by each of them.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and save the data.
+    tweets: list[dict]
+        List of JSON-like objects to be saved.
+    """
+    if not tweets:
+        return
+    saved_at = datetime.utcnow()
+    operations = []
+    for tweet in tweets:
+        tweet = dict(tweet)
+        on_insert = {}
+        update = {}
+        if tweet.get('session_id'):
+            on_insert['session_id'] = tweet['session_id']
+            update['$addToSet'] = {'session_ids': tweet['session_id']}
+        tweet.pop('session_id', None)
+        if MONGODB_TTL_DAYS:
+            on_insert['saved_at'] = saved_at
+        update['$set'] = tweet
+        if on_insert:
+            update['$setOnInsert'] = on_insert
+        operations.append(UpdateOne({'id': tweet['id']}, update, upsert=True))
+    db[MONGODB_COLLECTION].bulk_write(operations, ordered=False)
+
+def get_by_session(db, session_id, limit, after=None, fields=None):
+    """Method which retrieves from a mongodb collection a page of the tweets
+    saved by a crawl session, newest first.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and retrieve the data.
+    session_id: str
+        Identifier of the crawl session.
+    limit: int
+        Maximum number of tweets to retrieve.
+    after: str
+        Cursor returned by the previous page, if any.
+    fields: list[str]
+        Fields to retrieve. Defaults to `DEFAULT_FIELDS`.
+
+    Returns
+    -------
+    tuple[list[dict], str]
+        Page of tweets and cursor of the next page, or None if it is the
+        last one.
+    """
+    query = {'session_ids': session_id}
+    if after:
+        query['_id'] = {'$lt': ObjectId(after)}
+    projection = {field: 1 for field in fields or DEFAULT_FIELDS}
+    records = list(db[MONGODB_COLLECTION].find(query, projection)
+                   .sort('_id', -1).limit(limit))
+    cursor = str(records[-1]['_id']) if len(records) == limit else None
+    for record in records:
+        del record['_id']
+    return records, cursor
+
+def iter_tweets(db, filters, fields=None, batch_size=1000):
+    """Method which iterates over the tweets of a mongodb collection matching
+    the given filters, fetching them from the server in batches.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and retrieve the data.
+    filters: dict
+        Optional `crawler`, `lang`, `session_id`, `since` and `until` filters.
+        Dates are formatted as YYYY-MM-DD HH:MM:SS.
+    fields: list[str]
+        Fields to retrieve. Defaults to every field.
+    batch_size: int
+        Number of tweets fetched per round trip.
+    """
+    if fields:
+        projection = {field: 1 for field in fields}
+        projection['_id'] = 0
+    else:
+        projection = {'_id': 0, 'saved_at': 0, 'session_ids': 0}
+    return db[MONGODB_COLLECTION].find(
+        _build_query(filters), projection, batch_size=batch_size
+    )
+
+def count_tweets(db, filters=None):
+    """Method which counts the tweets of a mongodb collection matching the
+    given filters.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and retrieve the data.
+    filters: dict
+        Optional `crawler`, `lang`, `session_id`, `since` and `until` filters.
+        Dates are formatted as YYYY-MM-DD HH:MM:SS.
+    """
+    return db[MONGODB_COLLECTION].count_documents(_build_query(filters or {}))
+
+def aggregate_timeseries(db, filters, prefix_length):
+    """Method which counts the tweets of a mongodb collection matching the
+    given filters by time bucket, crawler and language.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and retrieve the data.
+    filters: dict
+        Optional `crawler`, `lang`, `session_id`, `since` and `until` filters.
+    prefix_length: int
+        Length of the `created_at` prefix which identifies each time bucket.
+    """
+    pipeline = [
+        {'$match': _build_query(filters)},
+        {'$group': {
+            '_id': {
+                'time': {'$substrCP': ['$created_at', 0, prefix_length]},
+                'crawler': '$crawler',
+                'lang': '$lang'
+            },
+            'count': {'$sum': 1}
+        }}
+    ]
+    return [dict(row['_id'], count=row['count'])
+            for row in db[MONGODB_COLLECTION].aggregate(pipeline)]
+
+def aggregate_interactions(db, filters, fields):
+    """Method which sums the interactions of the tweets of a mongodb
+    collection matching the given filters, by crawler.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and retrieve the data.
+    filters: dict
+        Optional `crawler`, `lang`, `session_id`, `since` and `until` filters.
+    fields: list[str]
+        Interaction fields to sum.
+    """
+    group = {'_id': '$crawler', 'tweets': {'$sum': 1}}
+    for field in fields:
+        group[field] = {'$sum': '$interactions.' + field}
+    pipeline = [{'$match': _build_query(filters)}, {'$group': group}]
+    records = []
+    for row in db[MONGODB_COLLECTION].aggregate(pipeline):
+        row['crawler'] = row.pop('_id')
+        records.append(row)
+    return records
+
+def aggregate_words(db, filters, kind, limit):
+    """Method which counts the most frequent hashtags or terms of the tweets
+    of a mongodb collection matching the given filters.
+
+    Words are split by spaces and lowercased on the server, so they may
+    need to be normalized afterwards.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and retrieve the data.
+    filters: dict
+        Optional `crawler`, `lang`, `session_id`, `since` and `until` filters.
+    kind: str
+        Either 'hashtag' or 'term'.
+    limit: int
+        Maximum number of words to retrieve.
+    """
+    if kind == 'hashtag':
+        word_match = {'word': {'$regex': '^#.'}}
+    else:
+        word_match = {'$and': [{'word': {'$regex': '^[^#@]{4}'}},
+                               {'word': {'$not': re.compile('^http')}}]}
+    pipeline = [
+        {'$match': _build_query(filters)},
+        {'$project': {'_id': 0, 'word': {'$split': [
+            {'$toLower': '$text'}, ' ']}}},
+        {'$unwind': '$word'},
+        {'$match': word_match},
+        {'$group': {'_id': '$word', 'count': {'$sum': 1}}},
+        {'$sort': {'count': -1}},
+        {'$limit': limit}
+    ]
+    return [{'term': row['_id'], 'count': row['count']} for row in
+            db[MONGODB_COLLECTION].aggregate(pipeline, allowDiskUse=True)]
+
+def aggregate_sources(db, filters, limit):
+    """Method which counts the tweets of a mongodb collection matching the
+    given filters by source.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and retrieve the data.
+    filters: dict
+        Optional `crawler`, `lang`, `session_id`, `since` and `until` filters.
+    limit: int
+        Maximum number of sources to retrieve.
+    """
+    pipeline = [
+        {'$match': _build_query(filters)},
+        {'$group': {'_id': '$source', 'count': {'$sum': 1}}},
+        {'$sort': {'count': -1}},
+        {'$limit': limit}
+    ]
+    return [{'source': row['_id'], 'count': row['count']}
+            for row in db[MONGODB_COLLECTION].aggregate(pipeline)]
+
+def _build_query(filters):
+    """Submethod which builds the query matching the given filters.
+
+    Parameters
+    ----------
+    filters: dict
+        Optional `crawler`, `lang`, `session_id`, `since` and `until` filters.
+    """
+    query = {}
+    for key in ['crawler', 'lang']:
+        if filters.get(key):
+            query[key] = filters[key]
+    if filters.get('session_id'):
+        query['session_ids'] = filters['session_id']
+    created_at = {}
+    if filters.get('since'):
+        created_at['$gte'] = filters['since']
+    if filters.get('until'):
+        created_at['$lt'] = filters['until']
+    if created_at:
+        query['created_at'] = created_at
+    return query
+
+def get_checkpoint(db, key):
+    """Method which retrieves the crawl checkpoint stored for a query.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and retrieve the data.
+    key: str
+        Checkpoint key of the query.
+    """
+    return db[MONGODB_CHECKPOINTS].find_one({'_id': key}, {'_id': 0})
+
+def save_checkpoint(db, key, checkpoint):
+    """Method which stores the crawl checkpoint of a query.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and save the data.
+    key: str
+        Checkpoint key of the query.
+    checkpoint: dict
+        JSON-like object with the `since_id`, `max_id` and `top_id` fields.
+    """
+    db[MONGODB_CHECKPOINTS].update_one(
+        {'_id': key}, {'$set': checkpoint}, upsert=True
+    )
+
+def get_streams(db):
+    """Method which retrieves every stream definition, along with the
+    counters reported by the process running it.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and retrieve the data.
+    """
+    return list(db[MONGODB_STREAMS].find({}, {'_id': 0}).sort('name'))
+
+def get_stream(db, name):
+    """Method which retrieves a stream definition and its counters.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and retrieve the data.
+    name: str
+        Name of the stream.
+    """
+    return db[MONGODB_STREAMS].find_one({'_id': name}, {'_id': 0})
+
+def save_stream(db, stream):
+    """Method which stores a stream definition, keeping its counters.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and save the data.
+    stream: dict
+        JSON-like object with the `name`, `track`, `sink`, `status`,
+        `session_id` and `updated_at` fields.
+    """
+    stream = {key: value for key, value in stream.items()
+              if key != 'counters'}
+    db[MONGODB_STREAMS].update_one(
+        {'_id': stream['name']},
+        {'$set': stream, '$setOnInsert': {'counters': {}}},
+        upsert=True
+    )
+
+def save_stream_counters(db, name, counters):
+    """Method which stores the counters of a stream.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and save the data.
+    name: str
+        Name of the stream.
+    counters: dict
+        JSON-like object with the counters of the stream.
+    """
+    db[MONGODB_STREAMS].update_one(
+        {'_id': name}, {'$set': {'counters': counters}}
+    )
+
+def acquire_lease(db, name, owner, ttl):
+    """Method which takes or renews a lease, so only one process at a time
+    does the work it protects. It is granted if nobody holds it, if it has
+    expired or if `owner` already holds it.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and save the data.
+    name: str
+        Name of the lease.
+    owner: str
+        Identifier of the process requesting it.
+    ttl: float
+        Seconds until the lease expires if it is not renewed.
+
+    Returns
+    -------
+    bool
+        Whether `owner` holds the lease.
+    """
+    now = time.time()
+    try:
+        lease = db[MONGODB_LEASES].find_one_and_update(
+            {'_id': name,
+             '$or': [{'owner': owner}, {'expires_at': {'$lt': now}}]},
+            {'$set': {'owner': owner, 'expires_at': now + ttl}},
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Another process holds it, so the upsert collided with its lease
+        return False
+    return lease is not None and lease['owner'] == owner
+
+def release_lease(db, name, owner):
+    """Method which releases a lease, if `owner` holds it.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and save the data.
+    name: str
+        Name of the lease.
+    owner: str
+        Identifier of the process holding it.
+    """
+    db[MONGODB_LEASES].delete_one({'_id': name, 'owner': owner})
+
+def get_lease(db, name):
+    """Method which retrieves the holder of a lease, if it has not expired.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and retrieve the data.
+    name: str
+        Name of the lease.
+    """
+    return db[MONGODB_LEASES].find_one(
+        {'_id': name, 'expires_at': {'$gte': time.time()}}, {'_id': 0}
+    )
+
+def save_crawl(db, crawl):
+    """Method which stores a sharded batch crawl.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and save the data.
+    crawl: dict
+        JSON-like object with the `id`, `params`, `status` and `created_at`
+        fields, along with the merged results once it has finished.
+    """
+    db[MONGODB_CRAWLS].replace_one({'_id': crawl['id']}, crawl, upsert=True)
+
+def get_crawl(db, crawl_id):
+    """Method which retrieves a sharded batch crawl.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and retrieve the data.
+    crawl_id: str
+        Identifier of the crawl.
+    """
+    return db[MONGODB_CRAWLS].find_one({'_id': crawl_id}, {'_id': 0})
+
+def get_crawls(db, limit):
+    """Method which retrieves the latest sharded batch crawls, newest first.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and retrieve the data.
+    limit: int
+        Maximum number of crawls to retrieve.
+    """
+    return list(db[MONGODB_CRAWLS].find({}, {'_id': 0})
+                .sort('created_at', DESCENDING).limit(limit))
+
+def add_shards(db, shards):
+    """Method which puts the shards of a crawl on the work queue.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and save the data.
+    shards: list[dict]
+        JSON-like objects with the `id`, `crawl_id`, `position`, `params`,
+        `status`, `attempts`, `pages`, `tweets` and `created_at` fields.
+    """
+    db[MONGODB_SHARDS].create_index([('crawl_id', ASCENDING),
+                                     ('position', ASCENDING)])
+    db[MONGODB_SHARDS].create_index([('status', ASCENDING),
+                                     ('created_at', ASCENDING)])
+    db[MONGODB_SHARDS].insert_many([
+        dict(shard, _id=shard['id'], updated_at=shard['created_at'])
+        for shard in shards
+    ])
+
+def get_shards(db, crawl_id):
+    """Method which retrieves the shards of a crawl.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and retrieve the data.
+    crawl_id: str
+        Identifier of the crawl.
+    """
+    return list(db[MONGODB_SHARDS].find({'crawl_id': crawl_id}, {'_id': 0})
+                .sort('position', ASCENDING))
+
+def claim_shard(db, owner, ttl):
+    """Method which takes the oldest shard which is queued, or whose lease
+    has expired because its worker died, and leases it to `owner`. The
+    update is atomic, so two processes never claim the same shard.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and save the data.
+    owner: str
+        Identifier of the worker claiming it. A worker holds a single shard.
+    ttl: float
+        Seconds until the lease expires if it is not renewed.
+    """
+    now = time.time()
+    shard = db[MONGODB_SHARDS].find_one_and_update(
+        {'$or': [{'status': 'queued'},
+                 {'status': 'running', 'expires_at': {'$lt': now}}]},
+        {'$set': {'status': 'running', 'owner': owner,
+                  'expires_at': now + ttl, 'updated_at': now},
+         '$inc': {'attempts': 1}},
+        sort=[('created_at', ASCENDING), ('position', ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+    if shard is not None:
+        del shard['_id']
+    return shard
+
+def update_shard(db, shard_id, owner, fields, ttl=None):
+    """Method which updates a running shard, if `owner` still holds it.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and save the data.
+    shard_id: str
+        Identifier of the shard.
+    owner: str
+        Identifier of the worker holding it.
+    fields: dict
+        Values of the `status`, `owner`, `pages`, `tweets` or `error` fields.
+    ttl: float
+        Seconds the lease is renewed for, if any.
+
+    Returns
+    -------
+    bool
+        Whether `owner` held the shard.
+    """
+    fields = dict(fields, updated_at=time.time())
+    if ttl is not None:
+        fields['expires_at'] = fields['updated_at'] + ttl
+    result = db[MONGODB_SHARDS].update_one(
+        {'_id': shard_id, 'owner': owner, 'status': 'running'},
+        {'$set': fields}
+    )
+    return result.matched_count > 0
+
+def cancel_shards(db, crawl_id):
+    """Method which cancels the queued and running shards of a crawl.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and save the data.
+    crawl_id: str
+        Identifier of the crawl.
+    """
+    db[MONGODB_SHARDS].update_many(
+        {'crawl_id': crawl_id, 'status': {'$in': ['queued', 'running']}},
+        {'$set': {'status': 'cancelled', 'updated_at': time.time()}}
+    )
+
+def take_rate_limit(db, key, limit, window):
+    """Method which takes a request from the rate limit budget of a set of
+    credentials, shared by every process. A new window of `limit` requests
+    starts once the previous one is reset.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and save the data.
+    key: str
+        Identifier of the budget.
+    limit: int
+        Number of requests allowed per window.
+    window: float
+        Length of the window in seconds.
+
+    Returns
+    -------
+    float
+        0 if a request was taken, or the seconds until the budget is reset.
+    """
+    now = time.time()
+    collection = db[MONGODB_RATE_LIMITS]
+    budget = collection.find_one_and_update(
+        {'_id': key, 'reset_at': {'$gt': now}, 'remaining': {'$gt': 0}},
+        {'$inc': {'remaining': -1}}
+    )
+    if budget is not None:
+        return 0
+    try:
+        collection.update_one(
+            {'_id': key, 'reset_at': {'$lte': now}},
+            {'$set': {'remaining': limit - 1, 'reset_at': now + window}},
+            upsert=True
+        )
+        return 0
+    except DuplicateKeyError:
+        # The window has not been reset yet, so the upsert collided with it
+        budget = collection.find_one({'_id': key})
+    return max(0, budget['reset_at'] - now) if budget is not None else 0
+
+def update_rate_limit(db, key, remaining, reset_at):
+    """Method which overwrites the rate limit budget of a set of
+    credentials with the one reported by Twitter.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and save the data.
+    key: str
+        Identifier of the budget.
+    remaining: int
+        Number of requests left in the window.
+    reset_at: float
+        Timestamp when the window is reset.
+    """
+    db[MONGODB_RATE_LIMITS].update_one(
+        {'_id': key},
+        {'$set': {'remaining': remaining, 'reset_at': reset_at}},
+        upsert=True
+    )
+
+def get_rate_limit(db, key):
+    """Method which retrieves the rate limit budget of a set of
+    credentials.
+
+    Parameters
+    ----------
+    db: pymongo.database.Database
+        MongoDB client used to create the connection and retrieve the data.
+    key: str
+        Identifier of the budget.
+    """
+    return db[MONGODB_RATE_LIMITS].find_one({'_id': key}, {'_id': 0})
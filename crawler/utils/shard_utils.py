@@ -0,0 +1,92 @@
+from datetime import date, datetime, timedelta
+from typing import List
+
+MAX_SHARDS = 1000
+DATE_FORMAT = '%Y-%m-%d'
+
+def split(query: str = None, lang: str = None, until: str = None,
+          since: str = None, days: int = 1, langs: List[str] = None,
+          queries: List[str] = None) -> List[dict]:
+    """Method which splits a batch crawl into shards which can be crawled
+    independently: one for every combination of sub-query, language and date
+    window.
+
+    Date windows are only made if `since` is given. Each window is crawled
+    with the `since:` search operator and the `until` parameter, so
+    consecutive windows do not overlap.
+
+    Parameters
+    ----------
+    query: str
+        Query of terms that the tweets must match. Ignored if `queries` is
+        given.
+    lang: str
+        Language in which the tweets must be written. Ignored if `langs` is
+        given.
+    until: str
+        Limit date to retrieve tweets from (YYYY-MM-DD). Defaults to
+        tomorrow if `since` is given.
+    since: str
+        Oldest date to retrieve tweets from (YYYY-MM-DD).
+    days: int
+        Number of days of each date window.
+    langs: list[str]
+        Languages to crawl separately.
+    queries: list[str]
+        Sub-queries to crawl separately.
+
+    Returns
+    -------
+    list[dict]
+        `query`, `lang` and `until` parameters of each shard.
+    """
+
+    queries = [q for q in queries or [query] if q]
+    if not queries:
+        raise ValueError("Missing required argument: 'query'.")
+    langs = langs or [lang]
+
+    windows = [(None, until)]
+    if since:
+        start = _parse_date(since, 'since')
+        end = (_parse_date(until, 'until') if until
+               else date.today() + timedelta(days=1))
+        days = int(days or 1)
+        if days < 1:
+            raise ValueError("Invalid value for 'days': '{}'.".format(days))
+        if start >= end:
+            raise ValueError("'since' must be before 'until'.")
+        windows = []
+        while start < end:
+            stop = min(start + timedelta(days=days), end)
+            windows.append((start.strftime(DATE_FORMAT),
+                            stop.strftime(DATE_FORMAT)))
+            start = stop
+
+    if len(queries) * len(langs) * len(windows) > MAX_SHARDS:
+        raise ValueError('The crawl would be split in more than {} '
+                         'shards.'.format(MAX_SHARDS))
+    return [
+        {
+            'query': '{} since:{}'.format(q, start) if start else q,
+            'lang': shard_lang,
+            'until': stop
+        }
+        for q in queries for shard_lang in langs for start, stop in windows
+    ]
+
+def _parse_date(value: str, name: str):
+    """Submethod which parses a YYYY-MM-DD date.
+
+    Parameters
+    ----------
+    value: str
+        Date to parse.
+    name: str
+        Name of the argument, used in the error message.
+    """
+
+    try:
+        return datetime.strptime(value, DATE_FORMAT).date()
+    except ValueError:
+        raise ValueError("Invalid date for '{}': '{}'.".format(name, value))
@@ -0,0 +1,821 @@
+import os
+import json
+import time
+import sqlite3
+import tempfile
+
+SQLITE_PATH = os.environ.get('SQLITE_PATH', os.path.join(
+    tempfile.gettempdir(), 'ikea-tweets.sqlite'
+))
+DEFAULT_FIELDS = ['created_at', 'text', 'interactions']
+COLUMNS = ['id', 'created_at', 'text', 'lang', 'coordinates', 'source',
+           'interactions', 'crawler', 'session_id']
+JSON_COLUMNS = ('coordinates', 'interactions')
+
+def connect(path=SQLITE_PATH):
+    """Method which opens a SQLite database and creates the tables and
+    indexes used by the crawler.
+
+    The database uses write-ahead logging, so readers do not block the
+    writer, and is only synced to disk at checkpoints.
+
+    Parameters
+    ----------
+    path: str
+        Path of the database file.
+    """
+    db = sqlite3.connect(path, check_same_thread=False)
+    db.row_factory = sqlite3.Row
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')
+    db.executescript('''
+CREATE TABLE IF NOT EXISTS tweets (
+    id INTEGER PRIMARY KEY,
+    created_at TEXT,
+    text TEXT,
+    lang TEXT,
+    coordinates TEXT,
+    source TEXT,
+    interactions TEXT,
+    crawler TEXT,
+    session_id TEXT
+);
+CREATE TABLE IF NOT EXISTS tweet_sessions (
+    session_id TEXT,
+    id INTEGER,
+    PRIMARY KEY (session_id, id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tweets_crawler ON tweets (crawler, created_at);
+CREATE INDEX IF NOT EXISTS tweets_lang ON tweets (lang);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    key TEXT PRIMARY KEY,
+    checkpoint TEXT
+);
+CREATE TABLE IF NOT EXISTS streams (
+    name TEXT PRIMARY KEY,
+    stream TEXT,
+    counters TEXT
+);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT,
+    expires_at REAL
+);
+CREATE TABLE IF NOT EXISTS crawls (
+    id TEXT PRIMARY KEY,
+    crawl TEXT,
+    created_at REAL
+);
+CREATE TABLE IF NOT EXISTS shards (
+    id TEXT PRIMARY KEY,
+    crawl_id TEXT,
+    position INTEGER,
+    params TEXT,
+    status TEXT,
+    owner TEXT,
+    expires_at REAL,
+    attempts INTEGER,
+    pages INTEGER,
+    tweets INTEGER,
+    error TEXT,
+    created_at REAL,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS shards_crawl ON shards (crawl_id, position);
+CREATE INDEX IF NOT EXISTS shards_status ON shards (status, created_at);
+CREATE TABLE IF NOT EXISTS rate_limits (
+    key TEXT PRIMARY KEY,
+    remaining INTEGER,
+    reset_at REAL
+);
+''')
+    return db
+
+def upsert_tweets(db, tweets):
+    """Method which saves the tweets passed as a parameter, using the tweet id
+    as the key, so saving the same tweet twice updates it instead of
+    duplicating it. The `session_id` is only set when the tweet is first
+    saved, while the `tweet_sessions` table links the tweet to every session
+    which saved it, so it is listed and counted by each of them.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to save the data.
+    tweets: list[dict]
+        List of JSON-like objects to be saved.
+    """
+    if not tweets:
+        return
+    updates = ', '.join('{0} = excluded.{0}'.format(column)
+                        for column in COLUMNS
+                        if column not in ('id', 'session_id'))
+    query = '''
+INSERT INTO tweets ({}) VALUES ({})
+ON CONFLICT (id) DO UPDATE SET {}
+'''.format(', '.join(COLUMNS), ', '.join('?' * len(COLUMNS)), updates)
+    links = [(tweet['session_id'], int(tweet['id'])) for tweet in tweets
+             if tweet.get('session_id')]
+    with db:
+        db.executemany(query, [_to_row(tweet) for tweet in tweets])
+        db.executemany('INSERT OR IGNORE INTO tweet_sessions VALUES (?, ?)',
+                       links)
+
+def get_by_ids(db, ids, fields=None):
+    """Method which retrieves from a SQLite database the tweets contained in
+    the list given as a parameter.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to retrieve the data.
+    ids: list[str]
+        List of tweet ids to retrieve.
+    fields: list[str]
+        Fields to retrieve. Defaults to `DEFAULT_FIELDS`.
+    """
+    ids = [int(id) for id in ids]
+    records = []
+    # SQLite limits the number of parameters of a query
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        query = 'SELECT {} FROM tweets WHERE id IN ({})'.format(
+            _select_fields(fields or DEFAULT_FIELDS),
+            ', '.join('?' * len(chunk))
+        )
+        records.extend(_to_record(row) for row in db.execute(query, chunk))
+    return records
+
+def get_by_session(db, session_id, limit, after=None, fields=None):
+    """Method which retrieves from a SQLite database a page of the tweets
+    saved by a crawl session, newest first.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to retrieve the data.
+    session_id: str
+        Identifier of the crawl session.
+    limit: int
+        Maximum number of tweets to retrieve.
+    after: str
+        Cursor returned by the previous page, if any.
+    fields: list[str]
+        Fields to retrieve. Defaults to `DEFAULT_FIELDS`.
+
+    Returns
+    -------
+    tuple[list[dict], str]
+        Page of tweets and cursor of the next page, or None if it is the
+        last one.
+    """
+    query = '''
+SELECT id AS _cursor, {}
+FROM tweets
+WHERE id IN (
+    SELECT id
+    FROM tweet_sessions
+    WHERE session_id = ? AND (? IS NULL OR id < ?)
+    ORDER BY id DESC
+    LIMIT ?
+)
+ORDER BY id DESC
+'''.format(_select_fields(fields or DEFAULT_FIELDS))
+    after = int(after) if after else None
+    records = [_to_record(row) for row in
+               db.execute(query, (session_id, after, after, limit))]
+    cursor = str(records[-1]['_cursor']) if len(records) == limit else None
+    for record in records:
+        del record['_cursor']
+    return records, cursor
+
+def get_batch(db, filters, fields=None, batch_size=1000, after=None):
+    """Method which retrieves from a SQLite database a batch of the tweets
+    matching the given filters, ordered by id.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to retrieve the data.
+    filters: dict
+        Optional `crawler`, `lang`, `session_id`, `since` and `until` filters.
+        Dates are formatted as YYYY-MM-DD HH:MM:SS.
+    fields: list[str]
+        Fields to retrieve. Defaults to every field.
+    batch_size: int
+        Maximum number of tweets to retrieve.
+    after: int
+        Id of the last tweet of the previous batch, if any.
+    """
+    conditions, parameters = _build_conditions(filters)
+    if after is not None:
+        conditions += ' AND id > ?'
+        parameters.append(after)
+    query = '''
+SELECT id AS _cursor, {}
+FROM tweets
+WHERE {}
+ORDER BY id
+LIMIT ?
+'''.format(_select_fields(fields or COLUMNS), conditions)
+    return [_to_record(row) for row in
+            db.execute(query, parameters + [batch_size])]
+
+def count_tweets(db, filters=None):
+    """Method which counts the tweets of a SQLite database matching the given
+    filters.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to retrieve the data.
+    filters: dict
+        Optional `crawler`, `lang`, `session_id`, `since` and `until` filters.
+        Dates are formatted as YYYY-MM-DD HH:MM:SS.
+    """
+    conditions, parameters = _build_conditions(filters or {})
+    query = 'SELECT COUNT(*) FROM tweets WHERE {}'.format(conditions)
+    return db.execute(query, parameters).fetchone()[0]
+
+def aggregate_timeseries(db, filters, prefix_length):
+    """Method which counts the tweets of a SQLite database matching the
+    given filters by time bucket, crawler and language.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to retrieve the data.
+    filters: dict
+        Optional `crawler`, `lang`, `session_id`, `since` and `until` filters.
+    prefix_length: int
+        Length of the `created_at` prefix which identifies each time bucket.
+    """
+    conditions, parameters = _build_conditions(filters)
+    query = '''
+SELECT substr(created_at, 1, ?) AS time, crawler, lang, COUNT(*) AS count
+FROM tweets
+WHERE {}
+GROUP BY time, crawler, lang
+'''.format(conditions)
+    return [dict(row) for row in
+            db.execute(query, [prefix_length] + parameters)]
+
+def aggregate_interactions(db, filters, fields):
+    """Method which sums the interactions of the tweets of a SQLite
+    database matching the given filters, by crawler.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to retrieve the data.
+    filters: dict
+        Optional `crawler`, `lang`, `session_id`, `since` and `until` filters.
+    fields: list[str]
+        Interaction fields to sum.
+    """
+    conditions, parameters = _build_conditions(filters)
+    sums = ''.join(
+        ",\n    IFNULL(SUM(json_extract(interactions, '$.{0}')), 0) AS {0}"
+        .format(field) for field in fields
+    )
+    query = '''
+SELECT crawler, COUNT(*) AS tweets{}
+FROM tweets
+WHERE {}
+GROUP BY crawler
+'''.format(sums, conditions)
+    return [dict(row) for row in db.execute(query, parameters)]
+
+def get_texts(db, filters):
+    """Method which retrieves the texts of the tweets of a SQLite database
+    matching the given filters.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to retrieve the data.
+    filters: dict
+        Optional `crawler`, `lang`, `session_id`, `since` and `until` filters.
+    """
+    conditions, parameters = _build_conditions(filters)
+    query = 'SELECT text FROM tweets WHERE {}'.format(conditions)
+    return [row['text'] for row in db.execute(query, parameters)]
+
+def aggregate_sources(db, filters, limit):
+    """Method which counts the tweets of a SQLite database matching the
+    given filters by source.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to retrieve the data.
+    filters: dict
+        Optional `crawler`, `lang`, `session_id`, `since` and `until` filters.
+    limit: int
+        Maximum number of sources to retrieve.
+    """
+    conditions, parameters = _build_conditions(filters)
+    query = '''
+SELECT source, COUNT(*) AS count
+FROM tweets
+WHERE {}
+GROUP BY source
+ORDER BY count DESC
+LIMIT ?
+'''.format(conditions)
+    return [dict(row) for row in db.execute(query, parameters + [limit])]
+
+def get_checkpoint(db, key):
+    """Method which retrieves the crawl checkpoint stored for a query.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to retrieve the data.
+    key: str
+        Checkpoint key of the query.
+    """
+    row = db.execute('SELECT checkpoint FROM checkpoints WHERE key = ?',
+                     (key,)).fetchone()
+    return json.loads(row['checkpoint']) if row is not None else None
+
+def save_checkpoint(db, key, checkpoint):
+    """Method which stores the crawl checkpoint of a query.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to save the data.
+    key: str
+        Checkpoint key of the query.
+    checkpoint: dict
+        JSON-like object with the `since_id`, `max_id` and `top_id` fields.
+    """
+    with db:
+        db.execute('INSERT OR REPLACE INTO checkpoints VALUES (?, ?)',
+                   (key, json.dumps(checkpoint)))
+
+def get_streams(db):
+    """Method which retrieves every stream definition, along with the
+    counters reported by the process running it.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to retrieve the data.
+    """
+    rows = db.execute('SELECT stream, counters FROM streams ORDER BY name')
+    return [_to_stream(row) for row in rows]
+
+def get_stream(db, name):
+    """Method which retrieves a stream definition and its counters.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to retrieve the data.
+    name: str
+        Name of the stream.
+    """
+    row = db.execute('SELECT stream, counters FROM streams WHERE name = ?',
+                     (name,)).fetchone()
+    return _to_stream(row) if row is not None else None
+
+def save_stream(db, stream):
+    """Method which stores a stream definition, keeping its counters.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to save the data.
+    stream: dict
+        JSON-like object with the `name`, `track`, `sink`, `status`,
+        `session_id` and `updated_at` fields.
+    """
+    with db:
+        db.execute('''
+INSERT INTO streams (name, stream) VALUES (?, ?)
+ON CONFLICT (name) DO UPDATE SET stream = excluded.stream
+''', (stream['name'], json.dumps({key: value for key, value in stream.items()
+                                   if key != 'counters'})))
+
+def save_stream_counters(db, name, counters):
+    """Method which stores the counters of a stream.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to save the data.
+    name: str
+        Name of the stream.
+    counters: dict
+        JSON-like object with the counters of the stream.
+    """
+    with db:
+        db.execute('UPDATE streams SET counters = ? WHERE name = ?',
+                   (json.dumps(counters), name))
+
+def acquire_lease(db, name, owner, ttl):
+    """Method which takes or renews a lease, so only one process at a time
+    does the work it protects. It is granted if nobody holds it, if it has
+    expired or if `owner` already holds it.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to save the data.
+    name: str
+        Name of the lease.
+    owner: str
+        Identifier of the process requesting it.
+    ttl: float
+        Seconds until the lease expires if it is not renewed.
+
+    Returns
+    -------
+    bool
+        Whether `owner` holds the lease.
+    """
+    now = time.time()
+    with db:
+        db.execute('''
+INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+ON CONFLICT (name) DO UPDATE SET
+    owner = excluded.owner, expires_at = excluded.expires_at
+WHERE leases.owner = excluded.owner OR leases.expires_at < ?
+''', (name, owner, now + ttl, now))
+        row = db.execute('SELECT owner FROM leases WHERE name = ?',
+                         (name,)).fetchone()
+    return row['owner'] == owner
+
+def release_lease(db, name, owner):
+    """Method which releases a lease, if `owner` holds it.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to save the data.
+    name: str
+        Name of the lease.
+    owner: str
+        Identifier of the process holding it.
+    """
+    with db:
+        db.execute('DELETE FROM leases WHERE name = ? AND owner = ?',
+                   (name, owner))
+
+def get_lease(db, name):
+    """Method which retrieves the holder of a lease, if it has not expired.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to retrieve the data.
+    name: str
+        Name of the lease.
+    """
+    row = db.execute(
+        'SELECT owner, expires_at FROM leases WHERE name = ? AND expires_at >= ?',
+        (name, time.time())).fetchone()
+    return dict(row) if row is not None else None
+
+def save_crawl(db, crawl):
+    """Method which stores a sharded batch crawl.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to save the data.
+    crawl: dict
+        JSON-like object with the `id`, `params`, `status` and `created_at`
+        fields, along with the merged results once it has finished.
+    """
+    with db:
+        db.execute('INSERT OR REPLACE INTO crawls VALUES (?, ?, ?)',
+                   (crawl['id'], json.dumps(crawl), crawl['created_at']))
+
+def get_crawl(db, crawl_id):
+    """Method which retrieves a sharded batch crawl.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to retrieve the data.
+    crawl_id: str
+        Identifier of the crawl.
+    """
+    row = db.execute('SELECT crawl FROM crawls WHERE id = ?',
+                     (crawl_id,)).fetchone()
+    return json.loads(row['crawl']) if row is not None else None
+
+def get_crawls(db, limit):
+    """Method which retrieves the latest sharded batch crawls, newest first.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to retrieve the data.
+    limit: int
+        Maximum number of crawls to retrieve.
+    """
+    rows = db.execute(
+        'SELECT crawl FROM crawls ORDER BY created_at DESC LIMIT ?', (limit,))
+    return [json.loads(row['crawl']) for row in rows]
+
+def add_shards(db, shards):
+    """Method which puts the shards of a crawl on the work queue.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to save the data.
+    shards: list[dict]
+        JSON-like objects with the `id`, `crawl_id`, `position`, `params`,
+        `status`, `attempts`, `pages`, `tweets` and `created_at` fields.
+    """
+    with db:
+        db.executemany('''
+INSERT INTO shards (id, crawl_id, position, params, status, attempts, pages,
+                    tweets, created_at, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+''', [(shard['id'], shard['crawl_id'], shard['position'],
+       json.dumps(shard['params']), shard['status'], shard['attempts'],
+       shard['pages'], shard['tweets'], shard['created_at'],
+       shard['created_at']) for shard in shards])
+
+def get_shards(db, crawl_id):
+    """Method which retrieves the shards of a crawl.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to retrieve the data.
+    crawl_id: str
+        Identifier of the crawl.
+    """
+    rows = db.execute('SELECT * FROM shards WHERE crawl_id = ? ORDER BY position',
+                      (crawl_id,))
+    return [_to_shard(row) for row in rows]
+
+def claim_shard(db, owner, ttl):
+    """Method which takes the oldest shard which is queued, or whose lease
+    has expired because its worker died, and leases it to `owner`.
+
+    The write lock is taken before reading, so two processes never claim
+    the same shard.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to save the data.
+    owner: str
+        Identifier of the worker claiming it. A worker holds a single shard.
+    ttl: float
+        Seconds until the lease expires if it is not renewed.
+    """
+    now = time.time()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        row = db.execute('''
+SELECT id FROM shards
+WHERE status = 'queued' OR (status = 'running' AND expires_at < ?)
+ORDER BY created_at, position LIMIT 1
+''', (now,)).fetchone()
+        if row is not None:
+            db.execute('''
+UPDATE shards SET status = 'running', owner = ?, expires_at = ?,
+    attempts = attempts + 1, updated_at = ?
+WHERE id = ?
+''', (owner, now + ttl, now, row['id']))
+            row = db.execute('SELECT * FROM shards WHERE id = ?',
+                             (row['id'],)).fetchone()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return _to_shard(row) if row is not None else None
+
+def update_shard(db, shard_id, owner, fields, ttl=None):
+    """Method which updates a running shard, if `owner` still holds it.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to save the data.
+    shard_id: str
+        Identifier of the shard.
+    owner: str
+        Identifier of the worker holding it.
+    fields: dict
+        Values of the `status`, `owner`, `pages`, `tweets` or `error` fields.
+    ttl: float
+        Seconds the lease is renewed for, if any.
+
+    Returns
+    -------
+    bool
+        Whether `owner` held the shard.
+    """
+    fields = dict(fields, updated_at=time.time())
+    if ttl is not None:
+        fields['expires_at'] = fields['updated_at'] + ttl
+    columns = ', '.join('{} = ?'.format(column) for column in fields)
+    with db:
+        cursor = db.execute('''
+UPDATE shards SET {}
+WHERE id = ? AND owner = ? AND status = 'running'
+'''.format(columns), list(fields.values()) + [shard_id, owner])
+    return cursor.rowcount > 0
+
+def cancel_shards(db, crawl_id):
+    """Method which cancels the queued and running shards of a crawl.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to save the data.
+    crawl_id: str
+        Identifier of the crawl.
+    """
+    with db:
+        db.execute('''
+UPDATE shards SET status = 'cancelled', updated_at = ?
+WHERE crawl_id = ? AND status IN ('queued', 'running')
+''', (time.time(), crawl_id))
+
+def take_rate_limit(db, key, limit, window):
+    """Method which takes a request from the rate limit budget of a set of
+    credentials, shared by every process. A new window of `limit` requests
+    starts once the previous one is reset.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to save the data.
+    key: str
+        Identifier of the budget.
+    limit: int
+        Number of requests allowed per window.
+    window: float
+        Length of the window in seconds.
+
+    Returns
+    -------
+    float
+        0 if a request was taken, or the seconds until the budget is reset.
+    """
+    now = time.time()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        row = db.execute('SELECT remaining, reset_at FROM rate_limits '
+                         'WHERE key = ?', (key,)).fetchone()
+        if row is None or row['reset_at'] <= now:
+            db.execute('INSERT OR REPLACE INTO rate_limits VALUES (?, ?, ?)',
+                       (key, limit - 1, now + window))
+            wait = 0
+        elif row['remaining'] > 0:
+            db.execute('UPDATE rate_limits SET remaining = remaining - 1 '
+                       'WHERE key = ?', (key,))
+            wait = 0
+        else:
+            wait = row['reset_at'] - now
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return wait
+
+def update_rate_limit(db, key, remaining, reset_at):
+    """Method which overwrites the rate limit budget of a set of
+    credentials with the one reported by Twitter.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to save the data.
+    key: str
+        Identifier of the budget.
+    remaining: int
+        Number of requests left in the window.
+    reset_at: float
+        Timestamp when the window is reset.
+    """
+    with db:
+        db.execute('INSERT OR REPLACE INTO rate_limits VALUES (?, ?, ?)',
+                   (key, remaining, reset_at))
+
+def get_rate_limit(db, key):
+    """Method which retrieves the rate limit budget of a set of
+    credentials.
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+        SQLite connection used to retrieve the data.
+    key: str
+        Identifier of the budget.
+    """
+    row = db.execute('SELECT remaining, reset_at FROM rate_limits '
+                     'WHERE key = ?', (key,)).fetchone()
+    return dict(row) if row is not None else None
+
+def _to_shard(row):
+    """Submethod which converts a row of the shards table into a shard.
+
+    Parameters
+    ----------
+    row: sqlite3.Row
+        Row of the shards table.
+    """
+    shard = dict(row)
+    shard['params'] = json.loads(shard['params'])
+    return shard
+
+def _to_stream(row):
+    """Submethod which converts a row of the streams table into a stream
+    definition.
+
+    Parameters
+    ----------
+    row: sqlite3.Row
+        Row with the `stream` and `counters` columns.
+    """
+    stream = json.loads(row['stream'])
+    stream['counters'] = json.loads(row['counters'] or '{}')
+    return stream
+
+def _build_conditions(filters):
+    """Submethod which builds the WHERE conditions matching the given
+    filters.
+
+    Parameters
+    ----------
+    filters: dict
+        Optional `crawler`, `lang`, `session_id`, `since` and `until` filters.
+    """
+    conditions, parameters = ['1'], []
+    for key in ['crawler', 'lang']:
+        if filters.get(key):
+            conditions.append('{} = ?'.format(key))
+            parameters.append(filters[key])
+    if filters.get('session_id'):
+        conditions.append(
+            'id IN (SELECT id FROM tweet_sessions WHERE session_id = ?)')
+        parameters.append(filters['session_id'])
+    if filters.get('since'):
+        conditions.append('created_at >= ?')
+        parameters.append(filters['since'])
+    if filters.get('until'):
+        conditions.append('created_at < ?')
+        parameters.append(filters['until'])
+    return ' AND '.join(conditions), parameters
+
+def _select_fields(fields):
+    """Submethod which builds the SELECT expressions of the given fields.
+
+    Parameters
+    ----------
+    fields: list[str]
+        Fields to retrieve. They must be columns of the tweets table, as they
+        are formatted into the query.
+    """
+    unknown = [field for field in fields if field not in COLUMNS]
+    if unknown:
+        raise ValueError('Unknown fields: {}'.format(unknown))
+    return ', '.join(fields)
+
+def _to_row(tweet):
+    """Submethod which converts a tweet to the values of a table row.
+
+    Parameters
+    ----------
+    tweet: dict
+        JSON-like object to be saved.
+    """
+    row = []
+    for column in COLUMNS:
+        value = tweet.get(column)
+        if column == 'id':
+            value = int(value)
+        elif column in JSON_COLUMNS and value is not None:
+            value = json.dumps(value)
+        row.append(value)
+    return row
+
+def _to_record(row):
+    """Submethod which converts a table row to a JSON-like object.
+
+    Parameters
+    ----------
+    row: sqlite3.Row
+        Row returned by a query.
+    """
+    record = {}
+    for key in row.keys():
+        value = row[key]
+        if key == 'id':
+            value = str(value)
+        elif key in JSON_COLUMNS and value is not None:
+            value = json.loads(value)
+        record[key] = value
+    return record
@@ -0,0 +1,103 @@
+import re
+from typing import Iterable, List, Set, Tuple
+
+# Maximum number of phrases accepted by the filter endpoint
+MAX_TRACK_PHRASES = 400
+WORD_REGEX = re.compile(r'[#@]?\w+')
+
+def parse_track(track: str) -> List[Tuple[str, ...]]:
+    """Method which splits a track parameter into its phrases, following the
+    syntax of the filter endpoint: commas separate phrases which are matched
+    independently (OR), and spaces separate the terms of a phrase, which
+    must all be present (AND).
+
+    Parameters
+    ----------
+    track: str
+        Comma separated list of phrases.
+
+    Returns
+    -------
+    list[tuple[str]]
+        Lowercased terms of each phrase.
+    """
+
+    phrases = []
+    for phrase in track.split(','):
+        terms = tuple(WORD_REGEX.findall(phrase.lower()))
+        if terms and terms not in phrases:
+            phrases.append(terms)
+    return phrases
+
+def union(phrase_lists: Iterable[List[Tuple[str, ...]]]) -> List[str]:
+    """Method which merges the phrases of several tracks into the list sent
+    to the filter endpoint.
+
+    Parameters
+    ----------
+    phrase_lists: Iterable[list[tuple[str]]]
+        Phrases of each track, as returned by `parse_track`.
+    """
+
+    return sorted({' '.join(terms) for phrases in phrase_lists
+                   for terms in phrases})
+
+def tokenize(text: str) -> Set[str]:
+    """Method which returns the terms of a tweet text a phrase can match.
+
+    As the filter endpoint does, a term without a leading '#' or '@' also
+    matches hashtags and mentions, so both forms are included.
+
+    Parameters
+    ----------
+    text: str
+        Tweet text.
+    """
+
+    tokens = set(WORD_REGEX.findall((text or '').lower()))
+    tokens.update([token[1:] for token in tokens if token[0] in '#@'])
+    return tokens
+
+def tokenize_tweet(tweet: dict) -> Set[str]:
+    """Method which returns the terms of a raw tweet a phrase can match.
+
+    The filter endpoint does not only match the text, so the terms of every
+    field it looks at are included: the extended text, the text of the
+    retweeted and quoted tweets, the expanded URLs and the mentioned users.
+
+    Parameters
+    ----------
+    tweet: dict
+        Tweet as received from the Twitter API.
+    """
+
+    tokens = set()
+    for status in (tweet, tweet.get('retweeted_status'),
+                   tweet.get('quoted_status')):
+        if not status:
+            continue
+        extended = status.get('extended_tweet') or {}
+        texts = [status.get('text'), status.get('full_text'),
+                 extended.get('full_text')]
+        for entities in (status.get('entities'), extended.get('entities')):
+            entities = entities or {}
+            texts.extend(url.get('expanded_url')
+                         for url in entities.get('urls') or [])
+            texts.extend('@' + (mention.get('screen_name') or '')
+                         for mention in entities.get('user_mentions') or [])
+        for text in texts:
+            tokens |= tokenize(text)
+    return tokens
+
+def matches(phrases: List[Tuple[str, ...]], tokens: Set[str]):
+    """Method which checks whether a tweet matches any phrase of a track.
+
+    Parameters
+    ----------
+    phrases: list[tuple[str]]
+        Phrases of the track, as returned by `parse_track`.
+    tokens: set[str]
+        Terms of the tweet, as returned by `tokenize`.
+    """
+
+    return any(all(term in tokens for term in terms) for terms in phrases)
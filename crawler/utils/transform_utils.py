@@ -0,0 +1,101 @@
+from typing import Iterable
+
+import dateutil.parser
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+MONTHS = {
+    'Jan': '01', 'Feb': '02', 'Mar': '03', 'Apr': '04', 'May': '05',
+    'Jun': '06', 'Jul': '07', 'Aug': '08', 'Sep': '09', 'Oct': '10',
+    'Nov': '11', 'Dec': '12'
+}
+ROOT_FIELDS = ('lang', 'coordinates', 'source')
+INTERACTION_FIELDS = ('favorite_count', 'retweet_count', 'quote_count',
+                      'reply_count')
+
+def parse_created_at(value: str):
+    """Method which converts the `created_at` field of a tweet to the format
+    used by the databases.
+
+    Twitter always formats the field as 'Wed Oct 10 20:19:24 +0000 2018', so
+    it is sliced at fixed positions instead of being parsed. Any other format
+    falls back to dateutil.
+
+    Parameters
+    ----------
+    value: str
+        Date as returned by the Twitter API.
+
+    Returns
+    -------
+    str
+        Date formatted as YYYY-MM-DD HH:MM:SS.
+    """
+
+    month = MONTHS.get(value[4:7])
+    if month is None or len(value) != 30 or value[20:25] != '+0000':
+        return dateutil.parser.parse(value).strftime(DATE_FORMAT)
+    return (value[26:30] + '-' + month + '-' + value[8:10] + ' '
+            + value[11:19])
+
+def transform(status: dict, crawler: str, session_id: str = None):
+    """Method which transforms a single status to the data model.
+
+    Only certain fields are retrieved:
+
+    [ id, created_at, text, lang, coordinates, source, favorite_count,
+      retweet_count, quote_count, reply_count ]
+
+    Parameters
+    ----------
+    status: dict
+        JSON-like object returned by the Twitter API.
+    crawler: str
+        Type of crawler which gathered the tweet, 'streaming' or 'batch'.
+    session_id: str
+        Identifier of the crawl session.
+    """
+
+    tweet = {
+        'id': status['id_str'],
+        'created_at': parse_created_at(status['created_at'])
+    }
+    extended_tweet = status.get('extended_tweet')
+    if extended_tweet and 'full_text' in extended_tweet:
+        tweet['text'] = extended_tweet['full_text']
+    else:
+        tweet['text'] = status['text']
+
+    for key in ROOT_FIELDS:
+        value = status.get(key)
+        if value is not None:
+            tweet[key] = value
+    interactions = {}
+    for key in INTERACTION_FIELDS:
+        value = status.get(key)
+        if value is not None:
+            interactions[key] = value
+    if interactions:
+        tweet['interactions'] = interactions
+    tweet['crawler'] = crawler
+    tweet['session_id'] = session_id
+    return tweet
+
+def transform_many(statuses: Iterable[dict], crawler: str,
+                   session_id: str = None):
+    """Method which transforms a batch of statuses to the data model.
+
+    Parameters
+    ----------
+    statuses: Iterable[dict]
+        JSON-like objects returned by the Twitter API.
+    crawler: str
+        Type of crawler which gathered the tweets, 'streaming' or 'batch'.
+    session_id: str
+        Identifier of the crawl session.
+
+    Returns
+    -------
+    list[dict]
+    """
+
+    return [transform(status, crawler, session_id) for status in statuses]
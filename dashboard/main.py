@@ -1,14 +1,34 @@
 import os
-import json
 import requests
 
-from flask import Flask, render_template, request
+from flask import (Flask, Response, render_template, request,
+                   stream_with_context)
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from modules.CrawlerClient import CrawlerClient
 
 CRAWLER_BASEURL = os.environ['CRAWLER_BASEURL'].strip()
 
 app = Flask(__name__)
 app.config['TEMPLATES_AUTO_RELOAD'] = True
 
+crawler = CrawlerClient(CRAWLER_BASEURL)
+
+@app.errorhandler(requests.RequestException)
+def crawler_error(error: requests.RequestException):
+    """Method which renders an error when the crawler cannot be reached or
+    does not answer in time.
+
+    Parameters
+    ----------
+    error: requests.RequestException
+        Error raised by the crawler client.
+    """
+
+    message = 'The crawler is not available: {}'.format(error)
+    app.logger.error(message)
+    return message, 502
+
 @app.route('/')
 def index():
     """Index route.
@@ -22,6 +42,21 @@ def index():
 
     return render_template('index.html')
 
+@app.route('/metrics')
+def metrics():
+    """/metrics route.
+
+    get:
+        description: exposes the dashboard metrics to Prometheus, such as
+            the latency of the requests to the crawler.
+        responses:
+            200:
+                description: metrics in the Prometheus text exposition
+                    format.
+    """
+
+    return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
+
 @app.route('/streaming', methods=['GET', 'POST'])
 def streaming():
     """/streaming route
@@ -40,23 +75,58 @@ def streaming():
     """
 
     if request.method == 'POST':
-        r = get_stream_status()
-        status = json.loads(r.text).get('message')
+        status = get_stream_status().get('message')
         if status == False:
             track = request.form['track'].strip() or 'IKEA,#IKEA'
             start_stream(track)
         else:
             stop_stream()
-    r = get_stream_status()
-    status = json.loads(r.text).get('message')
-    r = get_stream_tweets()
-    tweets = json.loads(json.loads(r.text).get('message'))
-    r = get_stream_count()
-    count = json.loads(r.text).get('message')
+    r_status, r_tweets, r_count = crawler.gather(
+        get_stream_status, get_stream_tweets, get_stream_count
+    )
+    status = r_status.get('message')
+    tweets = r_tweets.get('message')
+    count = r_count.get('message')
     return render_template(
         'streaming.html', status=status, tweets=tweets, count=count
     )
 
+@app.route('/streaming/events')
+def streaming_events():
+    """/streaming/events route.
+
+    get:
+        description: relays the live feed of the crawler stream to the
+            browser as Server-Sent Events.
+        responses:
+            200:
+                description: event stream with the new tweets and the
+                    stream counters.
+            503:
+                description: the crawler feed is not available.
+    """
+
+    r = get_stream_events()
+    if (r.status_code != 200
+            or not r.headers.get('Content-Type', '').startswith(
+                'text/event-stream')):
+        r.close()
+        return Response(status=503)
+
+    def generate():
+        try:
+            for chunk in r.iter_content(chunk_size=None):
+                yield chunk
+        finally:
+            r.close()
+
+    response = Response(stream_with_context(generate()),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(r.close)
+    return response
+
 @app.route('/batch', methods=['GET', 'POST'])
 def batch():
     """/batch route.
@@ -81,22 +151,31 @@ def batch():
             - name: until
               description: limit date to retrieve tweets from.
               required: false
+            - name: total
+              description: maximum number of tweets to be retrieved.
+              required: false
     """
 
-    crawled = False
+    job = None
     if request.method == 'POST':
         query = request.form['query'].strip() or 'IKEA #IKEA'
         lang = request.form['lang'].strip() or None
         count = request.form['count'].strip() or None
         until = request.form['until'].strip() or None
-        crawl_tweets(query, lang, count, until)
-        crawled = True
-    r = get_batch_tweets()
-    tweets = json.loads(json.loads(r.text).get('message'))
-    r = get_batch_count()
-    count = json.loads(r.text).get('message')
+        total = request.form['total'].strip() or None
+        job = crawl_tweets(query, lang, count, until, total).get('message')
+    else:
+        jobs = get_batch_jobs().get('message')
+        job = jobs[-1] if jobs else None
+    session_id = job['id'] if job else None
+    r_tweets, r_count = crawler.gather(
+        lambda: get_batch_tweets(session_id),
+        lambda: get_batch_count(session_id)
+    )
+    tweets = r_tweets.get('message')
+    count = r_count.get('message')
     return render_template(
-        'batch.html', crawled=crawled, tweets=tweets, count=count
+        'batch.html', job=job, tweets=tweets, count=count
     )
 
 def start_stream(track: str):
@@ -111,42 +190,47 @@ def start_stream(track: str):
     data = {
         'track': track
     }
-    url = '{}/stream/start'.format(CRAWLER_BASEURL)
-    return requests.post(url, json=data)
+    return crawler.post('/stream/start', data)
 
 def stop_stream():
     """
     Method which sends a request to the crawler to stop the stream.
     """
 
-    url = '{}/stream/stop'.format(CRAWLER_BASEURL)
-    return requests.post(url)
+    return crawler.post('/stream/stop')
 
 def get_stream_status():
     """
     Method which sends a request to the crawler to get the stream status.
+    The response may be cached for a short time.
     """
 
-    url = '{}/stream/status'.format(CRAWLER_BASEURL)
-    return requests.get(url)
+    return crawler.get('/stream/status', cache=True)
 
 def get_stream_tweets():
     """
     Method which sends a request to the crawler to get the stream tweets.
     """
 
-    url = '{}/stream/tweets'.format(CRAWLER_BASEURL)
-    return requests.get(url)
+    return crawler.get('/stream/tweets')
 
 def get_stream_count():
     """
     Method which sends a request to the crawler to get the stream tweet count.
+    The response may be cached for a short time.
     """
 
-    url = '{}/stream/count'.format(CRAWLER_BASEURL)
-    return requests.get(url)
+    return crawler.get('/stream/count', cache=True)
+
+def get_stream_events():
+    """
+    Method which opens a connection to the live feed of the crawler stream.
+    """
 
-def crawl_tweets(query: str, lang: str, count: str, until: str):
+    return crawler.stream('/stream/events')
+
+def crawl_tweets(query: str, lang: str, count: str, until: str,
+                 total: str = None):
     """Method which sends a request to the crawler to start the batch process.
 
     Parameters
@@ -162,29 +246,46 @@ def crawl_tweets(query: str, lang: str, count: str, until: str):
     until: str
         Returns tweets created before the given date. Date should be
         formatted as YYYY-MM-DD.
+    total: str
+        The maximum number of results to retrieve.
     """
 
     data = {
         'query': query,
         'lang': lang,
         'count': count,
-        'until': until
+        'until': until,
+        'total': total
     }
-    url = '{}/batch/crawl'.format(CRAWLER_BASEURL)
-    return requests.post(url, json=data)
+    return crawler.post('/batch/crawl', data)
 
-def get_batch_tweets():
+def get_batch_jobs():
     """
-    Method which sends a request to the crawler to get the batch tweets.
+    Method which sends a request to the crawler to get the batch jobs.
     """
 
-    url = '{}/batch/tweets'.format(CRAWLER_BASEURL)
-    return requests.get(url)
+    return crawler.get('/batch/jobs')
+
+def get_batch_tweets(session_id: str = None):
+    """Method which sends a request to the crawler to get the batch tweets.
 
-def get_batch_count():
+    Parameters
+    ----------
+    session_id: str
+        Batch job id. Defaults to the latest job.
     """
-    Method which sends a request to the crawler to get the batch tweet count.
+
+    return crawler.get('/batch/tweets', params={'session': session_id})
+
+def get_batch_count(session_id: str = None):
+    """Method which sends a request to the crawler to get the batch tweet
+    count.
+
+    Parameters
+    ----------
+    session_id: str
+        Batch job id. Defaults to the latest job.
     """
 
-    url = '{}/batch/count'.format(CRAWLER_BASEURL)
-    return requests.get(url)
\ No newline at end of file
+    return crawler.get('/batch/count', params={'session': session_id},
+                       cache=True)
\ No newline at end of file
@@ -0,0 +1,209 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List
+
+import requests
+from prometheus_client import Counter, Histogram
+from requests.adapters import HTTPAdapter
+
+CRAWLER_CONNECT_TIMEOUT = float(os.environ.get('CRAWLER_CONNECT_TIMEOUT', 3))
+CRAWLER_READ_TIMEOUT = float(os.environ.get('CRAWLER_READ_TIMEOUT', 10))
+CRAWLER_CACHE_TTL = float(os.environ.get('CRAWLER_CACHE_TTL', 2))
+# Matches the number of gunicorn threads
+CRAWLER_POOL_SIZE = int(os.environ.get('CRAWLER_POOL_SIZE', 8))
+
+REQUEST_SECONDS = Histogram(
+    'dashboard_crawler_request_seconds',
+    'Seconds taken by the requests to the crawler API.', ('method', 'route'))
+REQUEST_ERRORS = Counter(
+    'dashboard_crawler_request_errors_total',
+    'Requests to the crawler API which failed or timed out.',
+    ('method', 'route'))
+CACHE_HITS = Counter(
+    'dashboard_crawler_cache_hits_total',
+    'Crawler responses served from the cache.', ('route',))
+
+class CrawlerClient():
+    """
+    Class used to send requests to the crawler API.
+
+    Every request goes through the same `requests.Session`, so connections
+    are kept alive and reused, and has a timeout so a slow crawler cannot
+    hang the dashboard. Independent requests can be sent at the same time
+    with `gather`, and the responses of the cheap status routes can be kept
+    for a short time.
+
+    Attributes
+    ----------
+    base_url: str
+        Base URL of the crawler API.
+    timeout: tuple[float, float]
+        Connect and read timeouts of each request, in seconds.
+    cache_ttl: float
+        Number of seconds a cached response is kept.
+    session: requests.Session
+        Session holding the pool of connections to the crawler.
+
+    Methods
+    -------
+    get(self, path: str, params: dict, cache: bool)
+        Method which sends a GET request and returns the decoded response.
+    post(self, path: str, data: dict)
+        Method which sends a POST request and returns the decoded response.
+    stream(self, path: str)
+        Method which opens a streaming GET request.
+    gather(self, *calls: Callable[[], Any])
+        Method which runs several requests at the same time.
+    invalidate(self)
+        Method which discards every cached response.
+    """
+
+    def __init__(self, base_url: str,
+                 connect_timeout: float = CRAWLER_CONNECT_TIMEOUT,
+                 read_timeout: float = CRAWLER_READ_TIMEOUT,
+                 cache_ttl: float = CRAWLER_CACHE_TTL,
+                 pool_size: int = CRAWLER_POOL_SIZE):
+        """
+        Parameters
+        ----------
+        base_url: str
+            Base URL of the crawler API.
+        connect_timeout: float
+            Seconds to wait for a connection to the crawler.
+        read_timeout: float
+            Seconds to wait for the crawler to answer.
+        cache_ttl: float
+            Number of seconds a cached response is kept.
+        pool_size: int
+            Number of connections kept alive, and of requests sent at the
+            same time by `gather`.
+        """
+
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.cache_ttl = cache_ttl
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size)
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: str, params: dict = None, cache: bool = False):
+        """Method which sends a GET request and returns the decoded response.
+
+        Parameters
+        ----------
+        path: str
+            Route of the crawler API.
+        params: dict
+            Query parameters.
+        cache: bool
+            Whether the response can be served from the cache.
+        """
+
+        key = (path, tuple(sorted((params or {}).items())))
+        if cache:
+            with self._lock:
+                item = self._cache.get(key)
+            if item is not None and time.monotonic() - item[0] < self.cache_ttl:
+                CACHE_HITS.labels(route=path).inc()
+                return item[1]
+
+        r = self._request('GET', path, params=params)
+        data = r.json()
+        if cache:
+            with self._lock:
+                self._cache[key] = (time.monotonic(), data)
+        return data
+
+    def post(self, path: str, data: dict = None):
+        """Method which sends a POST request and returns the decoded response.
+        The cache is discarded, as the request may change the crawler state.
+
+        Parameters
+        ----------
+        path: str
+            Route of the crawler API.
+        data: dict
+            JSON body of the request.
+        """
+
+        self.invalidate()
+        return self._request('POST', path, json=data).json()
+
+    def stream(self, path: str):
+        """Method which opens a streaming GET request. Only the connection
+        has a timeout, as the response may never end.
+
+        Parameters
+        ----------
+        path: str
+            Route of the crawler API.
+        """
+
+        return self._request('GET', path, stream=True,
+                             timeout=(self.timeout[0], None))
+
+    def gather(self, *calls: Callable[[], Any]) -> List[Any]:
+        """Method which runs several requests at the same time and returns
+        their results in the same order. If any of them fails, its error is
+        raised.
+
+        Parameters
+        ----------
+        calls: Callable[[], Any]
+            Functions which send one request each.
+        """
+
+        futures = [self._executor.submit(call) for call in calls]
+        return [future.result() for future in futures]
+
+    def invalidate(self):
+        """
+        Method which discards every cached response.
+        """
+
+        with self._lock:
+            self._cache.clear()
+
+    def _request(self, method: str, path: str, **kw):
+        """Submethod which sends a request, recording its latency and
+        whether it failed. Responses with an error status raise.
+
+        Parameters
+        ----------
+        method: str
+            HTTP method.
+        path: str
+            Route of the crawler API.
+        kw: dict
+            Arguments passed to `requests.Session.request`.
+        """
+
+        kw.setdefault('timeout', self.timeout)
+        start = time.perf_counter()
+        try:
+            r = self.session.request(method, self._url(path), **kw)
+            r.raise_for_status()
+        except requests.RequestException:
+            REQUEST_ERRORS.labels(method=method, route=path).inc()
+            raise
+        finally:
+            REQUEST_SECONDS.labels(method=method, route=path).observe(
+                time.perf_counter() - start)
+        return r
+
+    def _url(self, path: str):
+        """Submethod which builds the URL of a route.
+
+        Parameters
+        ----------
+        path: str
+            Route of the crawler API.
+        """
+
+        return '{}{}'.format(self.base_url, path)